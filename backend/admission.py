@@ -0,0 +1,148 @@
+"""
+Admission control for the expensive resources a request uses.
+
+Each gate lets at most `limit` callers use a resource at once and queues up
+to `max_queue` more for at most `queue_timeout` seconds:
+
+- transcription  whole-file speech-to-text (audio decode + model); bounds
+                 memory, since every transcription holds the decoded audio
+                 and the model's activations
+- llm            outbound Gemini calls; bounds open connections and the
+                 request and response bodies held while waiting on them
+
+A caller that finds the queue full is turned away at once (429); one that
+waits longer than queue_timeout gets 503. Both carry Retry-After. Handlers
+check saturated() before reserving quota so a busy pod answers without any
+upstream round trip; the pipeline (captioning.py) takes the actual slots.
+
+Limits are per process. With gunicorn, multiply by GUNICORN_WORKERS for the
+pod. Queue depth, slots in use and wait times are reported in /stats and on
+/metrics, and time a request spent queued shows up as its admission_<name>
+stage (telemetry.py).
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from service_client import LatencyHistogram
+from telemetry import record_stage
+
+load_dotenv()
+
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "1"))
+TRANSCRIBE_QUEUE_MAX = int(os.getenv("TRANSCRIBE_QUEUE_MAX", "2"))
+TRANSCRIBE_QUEUE_TIMEOUT = float(os.getenv("TRANSCRIBE_QUEUE_TIMEOUT", "60"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+
+class Saturated(Exception):
+    """A resource is at its limit and its queue is full (429) or the wait timed out (503)"""
+
+    def __init__(self, resource: str, status_code: int, retry_after: int):
+        self.resource = resource
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = f"Server busy ({resource}), please retry in {retry_after}s"
+        super().__init__(self.message)
+
+
+class AdmissionGate:
+    """Counting semaphore with a bounded, timed wait queue"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # A client retrying before a queued caller could have been served would only queue again
+        self.retry_after = max(1, math.ceil(queue_timeout))
+        self.in_use = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+        self._counts = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        self.wait_time = LatencyHistogram()
+
+    def saturated(self) -> bool:
+        """True if a new caller would be turned away right now"""
+        with self._condition:
+            return self.in_use >= self.limit and self.waiting >= self.max_queue
+
+    def acquire(self):
+        start = time.monotonic()
+        queued = False
+        with self._condition:
+            if self.in_use >= self.limit:
+                queued = True
+                if self.waiting >= self.max_queue:
+                    self._counts["rejected_queue_full"] += 1
+                    raise Saturated(self.name, 429, self.retry_after)
+                self.waiting += 1
+                try:
+                    deadline = start + self.queue_timeout
+                    while self.in_use >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._counts["rejected_timeout"] += 1
+                            raise Saturated(self.name, 503, self.retry_after)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_use += 1
+            self._counts["admitted"] += 1
+        waited_ms = (time.monotonic() - start) * 1000
+        self.wait_time.observe(waited_ms)
+        if queued:
+            record_stage(f"admission_{self.name}", waited_ms)
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._condition:
+            stats = dict(self._counts)
+            stats.update(in_use=self.in_use, queued=self.waiting)
+        stats.update(limit=self.limit, max_queue=self.max_queue, queue_timeout_seconds=self.queue_timeout)
+        stats["wait_ms"] = self.wait_time.stats()
+        return stats
+
+
+transcription_gate = AdmissionGate("transcription", TRANSCRIBE_CONCURRENCY, TRANSCRIBE_QUEUE_MAX, TRANSCRIBE_QUEUE_TIMEOUT)
+llm_gate = AdmissionGate("llm", LLM_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT)
+
+
+def check_admission(file_type: str):
+    """Raise Saturated if a request for this file type would be turned away now"""
+    gates = [transcription_gate, llm_gate] if file_type == "video" else [llm_gate]
+    for gate in gates:
+        if gate.saturated():
+            raise Saturated(gate.name, 429, gate.retry_after)
+
+
+def admission_stats() -> dict:
+    return {gate.name: gate.stats() for gate in (transcription_gate, llm_gate)}
+
+
+def _reset_after_fork():
+    # A lock held by another thread at fork time would never be released in the child
+    for gate in (transcription_gate, llm_gate):
+        gate._condition = threading.Condition()
+        gate.in_use = gate.waiting = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,28 +1,90 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from phi.agent import Agent
-from phi.model.google import Gemini
-import google.generativeai as genai
-import whisper
-from googletrans import Translator
-import tempfile
+import json
 import os
 import shutil
+import time
 from dotenv import load_dotenv
-import requests
 from functools import wraps
+from admission import Saturated, admission_stats, check_admission
+from auth_client import AuthError, validate_token, reserve_caption_quota, release_caption_quota, auth_stats
+from batch import BATCH_MAX_BYTES, BATCH_MAX_FILES, batch_stats, run_batch
+from caption_cache import caption_cache
+from image_prep import image_preprocessor
+from keyframes import keyframe_stats
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from model_usage import model_usage
+from profiler import RequestProfiler, wants_profile
+from prompts import InvalidCaptionRequest, caption_options, prompt_registry
+from streaming import SSE_HEADERS, caption_events, response_timing
+from telemetry import REQUEST_ID_HEADER, finish_request, new_request_id, stage, start_trace
+from jobs import JOBS_UPLOAD_DIR, QueueFullError, job_store, public_job
+from transcription import transcriber
+from uploads import UPLOAD_FORM_OVERHEAD_BYTES, UPLOAD_MAX_BYTES, UploadRequest, get_upload, upload_stats
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+from warmup import model_warmup
+import uuid
+
+# captioning.py (phidata, google-generativeai, the speech-to-text engine) is
+# imported by the handlers and by the warm-up thread, not at startup
 
 # Load environment variables
 load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://localhost:4000")
-
-if API_KEY:
-    genai.configure(api_key=API_KEY)
 
 app = Flask(__name__)
+# Uploads are written once, hashed and size-checked while they stream in (uploads.py)
+app.request_class = UploadRequest
+# Requests announcing a larger body are rejected before it is read
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES
+UploadRequest.endpoint_max_content_length["generate_captions_batch"] = BATCH_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES
 CORS(app)
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    upload_stats.record_rejected()
+    if request.endpoint == "generate_captions_batch":
+        return jsonify({"error": f"Upload too large (limit {UPLOAD_MAX_BYTES // (1024 * 1024)} MB per file, "
+                                 f"{BATCH_MAX_BYTES // (1024 * 1024)} MB per batch)"}), 413
+    return jsonify({"error": f"File too large (limit {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)"}), 413
+
+@app.errorhandler(InvalidCaptionRequest)
+def invalid_caption_request(e):
+    return jsonify({"error": e.message}), 400
+
+@app.errorhandler(Saturated)
+def saturated(e):
+    response = jsonify({"error": e.message})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status_code
+
+@app.before_request
+def start_request_trace():
+    g.trace = start_trace(new_request_id(request.headers.get(REQUEST_ID_HEADER)))
+    g.profiler = RequestProfiler(g.trace).start() if wants_profile(request.headers) else None
+
+@app.after_request
+def finish_request_trace(response):
+    trace, profiler = g.trace, g.profiler
+    endpoint, method, status = request.endpoint or "unmatched", request.method, response.status_code
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+    # Stages so far; a streamed body's later stages only reach /metrics and the slow-request log
+    if trace.stages:
+        response.headers["Server-Timing"] = trace.server_timing()
+
+    def finish():
+        if profiler:
+            profiler.stop()
+        finish_request(trace, endpoint, method, status)
+
+    # Runs once the body has been sent, so streamed responses are timed in full
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def discard_uploads(exc):
+    request.discard_uploads()
+
 # Auth middleware
 def require_auth(f):
     @wraps(f)
@@ -35,215 +97,255 @@ def require_auth(f):
         token = auth_header.split(' ')[1]
         
         try:
-            # Validate token with auth service
-            response = requests.post(
-                f"{AUTH_SERVICE_URL}/validate-token",
-                json={"token": token},
-                headers={"Content-Type": "application/json"},
-                timeout=5
-            )
-            
-            if response.status_code != 200:
-                return jsonify({"error": "Invalid or expired token"}), 401
-            
-            user_data = response.json()
-            request.user = user_data.get('user')
-            
-            return f(*args, **kwargs)
-        except requests.exceptions.RequestException as e:
-            print(f"Auth service error: {str(e)}")
-            return jsonify({"error": "Authentication service unavailable"}), 503
+            with stage("auth"):
+                request.user = validate_token(token)
+        except AuthError as e:
+            return jsonify({"error": e.message}), e.status_code
+        
+        return f(*args, **kwargs)
     
     return decorated_function
 
-def check_and_decrement_caption_quota(user_id: str, token: str) -> bool:
-    """Check if user has remaining captions and decrement if they do"""
+
+@app.route("/generate-captions", methods=["POST"])
+@require_auth
+def generate_captions():
+    # Usually already imported by the warm-up thread
+    from captioning import caption_content
+
+    started = time.perf_counter()
+    # Get token from request
+    auth_header = request.headers.get('Authorization')
+    token = auth_header.split(' ')[1] if auth_header else None
+    reservation = None
+
+    # Parsing the form streams the upload to disk; a 413 is raised from here
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    # Unknown options (400) and a saturated pod (429) are answered before any quota or model work
+    options = caption_options(request.form)
+    check_admission(options["file_type"])
+
     try:
-        # Check caption limit
-        check_response = requests.get(
-            f"{AUTH_SERVICE_URL}/caption/check-limit",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=5
-        )
-        
-        if check_response.status_code != 200:
-            return False
-        
-        limit_data = check_response.json()
-        
-        if not limit_data.get('has_remaining', False):
-            return False
-        
-        # Decrement usage
-        decrement_response = requests.post(
-            f"{AUTH_SERVICE_URL}/caption/decrement",
-            json={"user_id": user_id},
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            },
-            timeout=5
-        )
-        
-        return decrement_response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Error checking/decrementing quota: {str(e)}")
-        return False
+        upload = get_upload(request.files["file"])
 
-# Initialize AI Agent
-agent = Agent(
-    name="Content Caption Generator",
-    model=Gemini(id="gemini-2.0-flash-exp"),
-    markdown=True,
-)
+        # Reserve one caption atomically; released again if generation fails
+        try:
+            reservation = reserve_caption_quota(token)
+        except AuthError as e:
+            return jsonify({"error": e.message}), e.status_code
 
-model = whisper.load_model("base")
+        # The upload is already on disk and hashed; the spool file is removed on teardown
+        captions = caption_content(
+            upload.path, options["file_type"], options["tone"], options["length"], options["hashtag_count"],
+            content_hash=upload.sha256
+        )
+        response_timing.sync_total.observe((time.perf_counter() - started) * 1000)
+        return jsonify({"captions": captions})
 
-@app.route("/generate-captions", methods=["POST"])
+    except Saturated:
+        if reservation:
+            release_caption_quota(request.user['id'], reservation)
+        raise
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        if reservation:
+            release_caption_quota(request.user['id'], reservation)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/generate-captions/stream", methods=["POST"])
 @require_auth
-def generate_captions():
+def generate_captions_stream():
+    """Same form as /generate-captions; progress and caption text stream back as Server-Sent Events"""
+    started = time.perf_counter()
+    auth_header = request.headers.get('Authorization')
+    token = auth_header.split(' ')[1] if auth_header else None
+
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    options = caption_options(request.form)
+    check_admission(options["file_type"])
+    upload = get_upload(request.files["file"])
+
+    # Quota and admission errors are still plain JSON responses, before the stream starts
     try:
-        # Get user info and token from request
-        user = request.user
-        auth_header = request.headers.get('Authorization')
-        token = auth_header.split(' ')[1] if auth_header else None
-        
-        # Check and decrement caption quota
-        if not check_and_decrement_caption_quota(user['id'], token):
-            return jsonify({
-                "error": "Caption generation limit reached. Please upgrade your plan or wait for the next billing period."
-            }), 403
-        
-        if "file" not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
+        reservation = reserve_caption_quota(token)
+    except AuthError as e:
+        return jsonify({"error": e.message}), e.status_code
 
-        file = request.files["file"]
-        file_type = request.form.get("fileType", "image")
-        tone = request.form.get("tone", "casual")
-        length = request.form.get("length", "medium")
-        hashtag_count = int(request.form.get("hashtagCount", 5))
+    # Streaming outlives the view (and its teardown): the stream removes the spool files itself
+    uploads = request.detach_uploads()
 
-        # Save uploaded file
-        temp_dir = tempfile.mkdtemp()
-        file_path = os.path.join(temp_dir, file.filename)
-        file.save(file_path)
+    # The stream ends after the request context is gone
+    user_id = request.user['id']
 
-        try:
-            # Analyze content
-            content_description = ""
-            if file_type == "video":
-                result = model.transcribe(file_path)
-                content_description = f"""
-                Video Content Analysis:
-                Transcription: {result['text']}
-                """
-            else:
-                image = genai.upload_file(file_path)
-                description_prompt = """
-                Analyze this image in detail. Consider:
-                1. Main subjects/people
-                2. Actions/activities
-                3. Setting/location
-                4. Mood/atmosphere
-                5. Colors and visual elements
-                6. Any text or significant details
-                """
-                description_response = agent.run(description_prompt, images=[image])
-                content_description = f"""
-                Image Content Analysis:
-                {description_response.content}
-                """
-
-            # Define length guides
-            length_guides = {
-                "short": "Keep captions between 50-80 characters",
-                "medium": "Keep captions between 120-150 characters",
-                "long": "Keep captions between 200-250 characters"
-            }
-
-            # Define tone guides with natural examples
-            tone_guides = {
-                "formal": {
-                    "style": "Polished, respectful, and business-like. Focus on professionalism and clear communication.",
-                    "examples": [
-                        "This serene landscape showcases the beauty of nature's harmony.",
-                        "An extraordinary event that highlights collaboration and shared success.",
-                        "A timeless architectural marvel, exemplifying elegance and precision."
-                    ]
-                },
-                "casual": {
-                    "style": "Relaxed, conversational, and relatable. Use light emojis and everyday language.",
-                    "examples": [
-                        "Weekend vibes: A little coffee, a little sunshine, and a lot of good energy! ☀️☕",
-                        "Just me, my favorite book, and the sound of rain. Couldn't ask for more 🌧️📚",
-                        "When life gives you sunsets, you just sit back and enjoy 🌅"
-                    ]
-                },
-                "professional": {
-                    "style": "Inspiring, empowering, and goal-oriented. Focus on achievement and growth.",
-                    "examples": [
-                        "Breaking barriers and building a legacy – one step at a time. 💼",
-                        "Success begins with a vision and grows through persistence and teamwork.",
-                        "Shaping the future by embracing challenges and fostering innovation."
-                    ]
-                },
-                "friendly": {
-                    "style": "Warm, engaging, and community-oriented. Encourage interaction and build connection.",
-                    "examples": [
-                        "Sharing this little slice of joy with you all! What's bringing you happiness today? 💛",
-                        "This place has a piece of my heart ❤️ What's your favorite escape spot? 🌍",
-                        "Moments like these are best enjoyed with friends. Who would you bring here? 👫"
-                    ]
-                },
-                "humorous": {
-                    "style": "Playful, witty, and fun. Use creative wordplay and appropriate emojis.",
-                    "examples": [
-                        "When life gives you lemons, trade them for pizza 🍕✨ Priorities, am I right?",
-                        "Caught mid-dance move... The floor wasn't ready for my talent 💃🔥",
-                        "If at first you don't succeed, order dessert and call it a win 🍰🎉"
-                    ]
-                }
-            }
-
-            # Generate captions with natural style
-            caption_prompt = f"""
-            Based on this content:
-            {content_description}
-
-            Generate 5 unique {tone.upper()} captions that sound natural and engaging.
-            
-            Tone Style: {tone_guides[tone]['style']}
-            
-            Here are examples of the tone to match:
-            {tone_guides[tone]['examples']}
-
-            Requirements:
-            1. Match the natural style of the example captions above
-            2. Include exactly {hashtag_count} relevant hashtags at the end
-            3. Keep length {length} ({length_guides[length]})
-            4. Use appropriate emojis where they feel natural
-            5. Make each caption unique and engaging
-            6. For friendly tone, include engaging questions
-            7. For humorous tone, include witty observations
-            8. For formal tone, maintain professionalism
-            
-            Format each caption like this:
-            • [Natural caption with emojis if appropriate] #Hashtag1 #Hashtag2 ...
-            """
-
-            response = agent.run(caption_prompt)
-            return jsonify({"captions": response.content})
+    def finish(ok):
+        if not ok:
+            release_caption_quota(user_id, reservation)
+        for spooled in uploads:
+            spooled.discard()
 
+    events = caption_events(
+        upload.path, options["file_type"], upload.sha256, options["tone"], options["length"],
+        options["hashtag_count"], started, on_complete=finish
+    )
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@app.route("/generate-captions/batch", methods=["POST"])
+@require_auth
+def generate_captions_batch():
+    """Caption many uploads with one quota reservation; results stream back as NDJSON"""
+    auth_header = request.headers.get('Authorization')
+    token = auth_header.split(' ')[1] if auth_header else None
+
+    files = [f for f in request.files.getlist("files") if f.filename]
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files (limit {BATCH_MAX_FILES} per batch)"}), 400
+
+    # One fileType for the whole batch, or one per file in upload order
+    file_types = request.form.getlist("fileType") or ["image"]
+    if len(file_types) not in (1, len(files)):
+        return jsonify({"error": "Send one fileType for the batch or one per file"}), 400
+    file_types = file_types * len(files) if len(file_types) == 1 else file_types
+    options = caption_options(request.form)
+    for file_type in file_types:
+        prompt_registry.validate(file_type, options["tone"], options["length"], options["hashtag_count"])
+    for file_type in set(file_types):
+        check_admission(file_type)
+
+    items = []
+    for index, (file, file_type) in enumerate(zip(files, file_types)):
+        upload = get_upload(file)
+        items.append({
+            "index": index,
+            "filename": file.filename,
+            "path": upload.path,
+            "file_type": file_type,
+            "content_hash": upload.sha256,
+        })
+
+    # One reservation for the whole batch; items that fail are released at the end
+    try:
+        reservation = reserve_caption_quota(token, count=len(items))
+    except AuthError as e:
+        return jsonify({"error": e.message}), e.status_code
+
+    # Streaming outlives the view (and its teardown): the stream removes the spool files itself
+    uploads = request.detach_uploads()
+    user_id = request.user['id']
+
+    def stream():
+        succeeded = 0
+        try:
+            for result in run_batch(items, options["tone"], options["length"], options["hashtag_count"]):
+                if "error" not in result:
+                    succeeded += 1
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "succeeded": succeeded, "failed": len(items) - succeeded}) + "\n"
         finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            # Failed items, and unfinished ones if the client went away
+            if succeeded < len(items):
+                release_caption_quota(user_id, {**reservation, "reserved": len(items) - succeeded})
+            for upload in uploads:
+                upload.discard()
 
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+@app.route("/jobs", methods=["POST"])
+@require_auth
+def create_job():
+    """Queue a caption job (meant for videos) and return its id immediately"""
+    auth_header = request.headers.get('Authorization')
+    token = auth_header.split(' ')[1] if auth_header else None
+
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    options = caption_options(request.form, default_file_type="video")
+    upload = get_upload(request.files["file"])
+
+    try:
+        reservation = reserve_caption_quota(token)
+    except AuthError as e:
+        return jsonify({"error": e.message}), e.status_code
+
+    job_id = str(uuid.uuid4())
+    upload_dir = os.path.join(JOBS_UPLOAD_DIR, job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, secure_filename(request.files["file"].filename) or "upload")
+
+    try:
+        upload.move_to(file_path)
+        job = job_store.submit(
+            request.user['id'], reservation, file_path,
+            options["file_type"], options["tone"], options["length"], options["hashtag_count"], job_id=job_id
+        )
+    except QueueFullError:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        release_caption_quota(request.user['id'], reservation)
+        response = jsonify({"error": "Too many jobs queued, please retry later"})
+        response.headers["Retry-After"] = "30"
+        return response, 429
     except Exception as e:
         print(f"Error: {str(e)}")
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        release_caption_quota(request.user['id'], reservation)
         return jsonify({"error": str(e)}), 500
 
+    response = jsonify(public_job(job))
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+@require_auth
+def get_job(job_id):
+    """Poll a caption job's status and, once finished, its result"""
+    job = job_store.get(job_id)
+    if not job or job['user_id'] != request.user['id']:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job(job))
+
 @app.route("/health", methods=["GET"])
 def health_check():
+    """Liveness: the process is up and serving, models may still be loading"""
     return jsonify({"status": "healthy"})
 
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """Readiness: 200 once every model has been loaded (see warmup.py)"""
+    ready = model_warmup.is_ready()
+    return jsonify({
+        "status": "ready" if ready else "warming_up",
+        "models": model_warmup.status()
+    }), 200 if ready else 503
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "auth": auth_stats(),
+        "caption_cache": caption_cache.stats(),
+        "jobs": job_store.counts(),
+        "transcription": transcriber.stats(),
+        "uploads": upload_stats.stats(),
+        "images": image_preprocessor.stats(),
+        "keyframes": keyframe_stats.stats(),
+        "batches": batch_stats.stats(),
+        "response_timing": response_timing.stats(),
+        "model_usage": model_usage.stats(),
+        "admission": admission_stats()
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """The numbers behind /stats in the Prometheus text format, summed over the pod's workers"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
+    # The reloader's parent only watches files; warm up in the serving child
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model_warmup.start()
     app.run(debug=True)
@@ -0,0 +1,194 @@
+"""
+Token validation for the caption backend.
+
+Tokens issued by the auth service are HS256 JWTs signed with JWT_SECRET
+(see create_jwt_token in services/auth/app.py). When the backend shares that
+secret it can verify the signature and expiry in-process and only talk to the
+auth service when a revocation check is wanted.
+"""
+import os
+import threading
+import time
+
+import jwt
+import requests
+from dotenv import load_dotenv
+
+from service_client import ServiceClient
+from telemetry import request_headers, stage
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://localhost:4000")
+JWT_SECRET = os.getenv("JWT_SECRET")
+JWT_ALGORITHM = "HS256"
+# Proves to the auth service that a quota release comes from this backend
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN", "")
+
+# Revocation check modes:
+#   off     - trust any token with a valid signature and expiry
+#   on-miss - confirm with the auth service once per cache entry (default)
+#   always  - confirm with the auth service on every request
+AUTH_REVOCATION_CHECK = os.getenv("AUTH_REVOCATION_CHECK", "on-miss").lower()
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# Keep-alive connections to the auth service; size for threads per worker
+AUTH_HTTP_POOL_SIZE = int(os.getenv("AUTH_HTTP_POOL_SIZE", "20"))
+AUTH_CONNECT_TIMEOUT = float(os.getenv("AUTH_CONNECT_TIMEOUT", "0.5"))
+AUTH_READ_TIMEOUT = float(os.getenv("AUTH_READ_TIMEOUT", "2.0"))
+# Fail fast after this many consecutive errors, probe again after the reset timeout
+AUTH_BREAKER_FAILURES = int(os.getenv("AUTH_BREAKER_FAILURES", "5"))
+AUTH_BREAKER_RESET_SECONDS = float(os.getenv("AUTH_BREAKER_RESET_SECONDS", "10"))
+
+AUTH_REVOCATION_CHECK_MODES = ("off", "on-miss", "always")
+if AUTH_REVOCATION_CHECK not in AUTH_REVOCATION_CHECK_MODES:
+    raise ValueError(f"Unknown AUTH_REVOCATION_CHECK: {AUTH_REVOCATION_CHECK}")
+
+auth_service = ServiceClient(
+    AUTH_SERVICE_URL,
+    pool_size=AUTH_HTTP_POOL_SIZE,
+    connect_timeout=AUTH_CONNECT_TIMEOUT,
+    read_timeout=AUTH_READ_TIMEOUT,
+    failure_threshold=AUTH_BREAKER_FAILURES,
+    reset_timeout=AUTH_BREAKER_RESET_SECONDS,
+    header_hook=request_headers,
+)
+
+
+class AuthError(Exception):
+    """Raised when a token is rejected"""
+
+    def __init__(self, message: str, status_code: int = 401):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+
+# Counters for how often the auth service was actually contacted
+_remote_lock = threading.Lock()
+_remote_stats = {"remote_validations": 0, "local_validations": 0}
+
+
+def _count(key: str):
+    with _remote_lock:
+        _remote_stats[key] += 1
+
+
+def decode_token_locally(token: str) -> dict:
+    """Verify signature and expiry of a token issued by the auth service"""
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise AuthError("Token has expired")
+    except jwt.InvalidTokenError:
+        raise AuthError("Invalid or expired token")
+
+
+def validate_token_remotely(token: str) -> dict:
+    """Ask the auth service to validate the token and return the user"""
+    _count("remote_validations")
+    try:
+        response = auth_service.post(
+            "/validate-token",
+            json={"token": token}
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Auth service error: {str(e)}")
+        raise AuthError("Authentication service unavailable", 503)
+
+    if response.status_code != 200:
+        raise AuthError("Invalid or expired token")
+
+    return response.json().get('user')
+
+
+def validate_token(token: str) -> dict:
+    """Return the user for a bearer token, using the cache where possible"""
+    if not JWT_SECRET:
+        # Without the shared secret every request has to go to the auth service
+        return validate_token_remotely(token)
+
+    payload = decode_token_locally(token)
+    _count("local_validations")
+
+    if AUTH_REVOCATION_CHECK == "always":
+        return validate_token_remotely(token)
+
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
+    if AUTH_REVOCATION_CHECK == "off":
+        # Same fields as /validate-token; tokens issued before full_name was a claim have None
+        user = {"id": payload['sub'], "email": payload.get('email'), "full_name": payload.get('full_name')}
+    else:
+        user = validate_token_remotely(token)
+
+    # Never keep a token around longer than it is valid
+    expires_in = payload['exp'] - time.time() if 'exp' in payload else None
+    token_cache.set(token, user, ttl_seconds=expires_in)
+    return user
+
+
+def reserve_caption_quota(token: str, count: int = 1) -> dict:
+    """Atomically reserve captions; returns the reservation or raises AuthError"""
+    try:
+        with stage("quota_reserve"):
+            response = auth_service.post(
+                "/caption/reserve",
+                json={"count": count},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+    except requests.exceptions.RequestException as e:
+        print(f"Error reserving quota: {str(e)}")
+        raise AuthError("Authentication service unavailable", 503)
+
+    if response.status_code in (403, 404):
+        raise AuthError(
+            "Caption generation limit reached. Please upgrade your plan or wait for the next billing period.",
+            403
+        )
+    if response.status_code != 200:
+        raise AuthError("Could not reserve caption quota", 503)
+
+    return response.json()
+
+
+def release_caption_quota(user_id: str, reservation: dict):
+    """Give back a user's reservation after a failed generation (best effort)
+
+    Sent with the internal credential rather than the user's token, which may
+    have expired by the time a queued job or a long stream fails.
+    """
+    try:
+        with stage("quota_release"):
+            response = auth_service.post(
+                "/caption/release",
+                json={
+                    "user_id": user_id,
+                    "count": reservation.get('reserved', 1),
+                    "period_start": reservation['period_start']
+                },
+                headers={"X-Internal-Token": INTERNAL_SERVICE_TOKEN}
+            )
+        if response.status_code != 200:
+            print(f"Quota release rejected: {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        print(f"Error releasing quota: {str(e)}")
+
+
+def auth_stats() -> dict:
+    """Cache, round-trip and upstream latency counters for the /stats endpoint"""
+    with _remote_lock:
+        counters = dict(_remote_stats)
+    return {
+        "revocation_check": AUTH_REVOCATION_CHECK,
+        "local_verification": bool(JWT_SECRET),
+        "cache": token_cache.stats(),
+        **counters,
+        "auth_service": auth_service.stats(),
+    }
@@ -0,0 +1,123 @@
+"""
+Batch caption generation.
+
+/generate-captions/batch takes a whole campaign of uploads in one request.
+The handler authenticates and reserves quota once for all of them; run_batch
+then does the work:
+
+- each item is analyzed (describe_content) on a pool of BATCH_CONCURRENCY
+  threads owned by the batch, so one large batch cannot take over the process
+- as analyses finish, their caption prompts are grouped into packs of up to
+  CAPTION_PACK_SIZE and each pack is answered by one model call
+  (captioning.generate_captions_batch)
+- results are yielded as soon as each item is done, in completion order, so
+  the handler can stream them back while the rest are still running
+
+A failing item produces an error result and does not stop the batch.
+"""
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from telemetry import in_context
+from uploads import UPLOAD_MAX_BYTES
+
+load_dotenv()
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# Whole request; each file is still limited to UPLOAD_MAX_BYTES
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(max(500 * 1024 * 1024, UPLOAD_MAX_BYTES))))
+
+
+class BatchStats:
+    """Batch counters for /stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "caption_packs": 0,
+        }
+
+    def record(self, field: str, count: int = 1):
+        with self._lock:
+            self._stats[field] += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_files"] = BATCH_MAX_FILES
+        stats["concurrency"] = BATCH_CONCURRENCY
+        return stats
+
+
+batch_stats = BatchStats()
+
+
+def _describe(item: dict) -> str:
+    from captioning import describe_content
+    return describe_content(item["path"], item["file_type"], content_hash=item["content_hash"])
+
+
+def _caption_pack(pack: list, tone: str, length: str, hashtag_count: int) -> list:
+    from captioning import generate_captions_batch
+    return generate_captions_batch([description for _, description in pack], tone, length, hashtag_count)
+
+
+def _result(item: dict, captions: list = None, error: str = None) -> dict:
+    result = {"index": item["index"], "filename": item["filename"]}
+    if error is None:
+        result["captions"] = captions
+        batch_stats.record("succeeded")
+    else:
+        result["error"] = error
+        batch_stats.record("failed")
+    return result
+
+
+def run_batch(items: list, tone: str, length: str, hashtag_count: int, concurrency: int = BATCH_CONCURRENCY):
+    """Yield {index, filename, captions} or {index, filename, error} for each item as it finishes
+
+    items are dicts with index, filename, path, file_type and content_hash.
+    """
+    from captioning import CAPTION_PACK_SIZE
+
+    batch_stats.record("batches")
+    batch_stats.record("items", len(items))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="caption-batch")
+    # future -> ("describe", item) or ("captions", [(item, description), ...])
+    running = {executor.submit(in_context(_describe), item): ("describe", item) for item in items}
+    described = []
+    try:
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, work = running.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    print(f"Batch {kind} error: {str(e)}")
+                    for item in ([work] if kind == "describe" else [item for item, _ in work]):
+                        yield _result(item, error=str(e))
+                    continue
+                if kind == "describe":
+                    described.append((work, value))
+                else:
+                    for (item, _), captions in zip(work, value):
+                        yield _result(item, captions)
+
+            # Fill a pack before calling the model, unless nothing else is left to wait for
+            analyzing = any(kind == "describe" for kind, _ in running.values())
+            while len(described) >= CAPTION_PACK_SIZE or (described and not analyzing):
+                pack, described = described[:CAPTION_PACK_SIZE], described[CAPTION_PACK_SIZE:]
+                batch_stats.record("caption_packs")
+                running[executor.submit(in_context(_caption_pack), pack, tone, length, hashtag_count)] = ("captions", pack)
+    finally:
+        # Also reached when the client disconnects mid-stream
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,104 @@
+"""
+Latency and token usage of the two image caption modes.
+
+- two-pass     vision call for a description, then a text call for captions
+- single-pass  one vision call returning captions and a short description
+               as JSON (IMAGE_CAPTION_MODE=single-pass)
+
+Each image is captioned --runs times per mode with the caption cache turned
+off, alternating modes so both see the same API conditions. Reports median
+latency, model calls and prompt/response tokens per caption request (from
+model_usage.py). Needs GOOGLE_API_KEY:
+
+    python benchmarks/caption_mode_benchmark.py photo1.jpg photo2.jpg --runs 3 --output modes.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Every run must reach the model
+os.environ["CAPTION_CACHE_BACKEND"] = "none"
+
+MODES = ("two-pass", "single-pass")
+
+
+def usage_totals(stats: dict) -> dict:
+    return {
+        "calls": sum(kind["calls"] for kind in stats.values()),
+        "input_tokens": sum(kind["input_tokens"] for kind in stats.values()),
+        "output_tokens": sum(kind["output_tokens"] for kind in stats.values()),
+    }
+
+
+def caption_once(path: str, mode: str, tone: str, length: str, hashtag_count: int) -> dict:
+    from captioning import caption_content
+    from model_usage import model_usage
+
+    before = usage_totals(model_usage.stats())
+    start = time.perf_counter()
+    captions = caption_content(path, "image", tone, length, hashtag_count, mode=mode)
+    seconds = time.perf_counter() - start
+    after = usage_totals(model_usage.stats())
+    result = {name: after[name] - before[name] for name in after}
+    result["seconds"] = seconds
+    result["captions"] = len(captions)
+    return result
+
+
+def summarize(runs: list) -> dict:
+    return {
+        "runs": len(runs),
+        "p50_seconds": round(statistics.median(run["seconds"] for run in runs), 3),
+        "max_seconds": round(max(run["seconds"] for run in runs), 3),
+        "calls": round(statistics.mean(run["calls"] for run in runs), 2),
+        "input_tokens": round(statistics.mean(run["input_tokens"] for run in runs), 1),
+        "output_tokens": round(statistics.mean(run["output_tokens"] for run in runs), 1),
+        "captions": round(statistics.mean(run["captions"] for run in runs), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Image files")
+    parser.add_argument("--runs", type=int, default=3, help="Caption requests per image and mode")
+    parser.add_argument("--tone", default="casual")
+    parser.add_argument("--length", default="medium")
+    parser.add_argument("--hashtag-count", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if not os.getenv("GOOGLE_API_KEY"):
+        raise SystemExit("GOOGLE_API_KEY is required")
+
+    runs = {mode: [] for mode in MODES}
+    for path in args.images:
+        for _ in range(args.runs):
+            for mode in MODES:
+                runs[mode].append(caption_once(path, mode, args.tone, args.length, args.hashtag_count))
+
+    results = {mode: summarize(mode_runs) for mode, mode_runs in runs.items()}
+    print(f"{len(args.images)} image(s) x {args.runs} run(s), tone={args.tone} length={args.length}")
+    print(f"{'mode':<12} {'p50 s':>7} {'max s':>7} {'calls':>6} {'in tok':>8} {'out tok':>8} {'captions':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['p50_seconds']:>7} {r['max_seconds']:>7} {r['calls']:>6} "
+              f"{r['input_tokens']:>8} {r['output_tokens']:>8} {r['captions']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "images": [os.path.basename(path) for path in args.images],
+                "runs": args.runs,
+                "tone": args.tone,
+                "length": args.length,
+                "hashtag_count": args.hashtag_count,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Bytes sent and latency for image analysis, before and after preprocessing.
+
+For each image reports the original size, the prepared size and the time
+spent preparing it. With --gemini (needs GOOGLE_API_KEY) it also times the
+full vision call both ways:
+
+- before  genai.upload_file(original) + generate_content
+- after   image_prep + inline bytes (or an upload of the prepared bytes)
+
+    python benchmarks/image_benchmark.py photo1.jpg photo2.jpg --gemini --output images.json
+
+Without image arguments a 12 MP noise photo is generated, which is fine for
+bytes and prep time but not a meaningful Gemini input.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_prep import IMAGE_FORMAT, IMAGE_INLINE_MAX_BYTES, IMAGE_MAX_EDGE, IMAGE_QUALITY, preprocess_image  # noqa: E402
+
+PROMPT = "Describe this image in two sentences."
+
+
+def synthetic_photo(directory: str) -> str:
+    import numpy as np
+    from PIL import Image
+
+    path = os.path.join(directory, "synthetic_12mp.jpg")
+    pixels = (np.random.default_rng(0).random((3000, 4000, 3)) * 255).astype("uint8")
+    Image.fromarray(pixels).save(path, quality=95)
+    return path
+
+
+def time_gemini(file_path: str, prepared: dict) -> dict:
+    import google.generativeai as genai
+    from captioning import GEMINI_MODEL_ID, gemini_image_part
+
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    model = genai.GenerativeModel(GEMINI_MODEL_ID)
+
+    start = time.perf_counter()
+    model.generate_content([genai.upload_file(file_path), PROMPT])
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.generate_content([gemini_image_part(prepared), PROMPT])
+    after = time.perf_counter() - start
+    return {"before_seconds": round(before, 3), "after_seconds": round(after, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Image files")
+    parser.add_argument("--max-edge", type=int, default=IMAGE_MAX_EDGE)
+    parser.add_argument("--format", default=IMAGE_FORMAT, choices=["jpeg", "webp"])
+    parser.add_argument("--quality", type=int, default=IMAGE_QUALITY)
+    parser.add_argument("--gemini", action="store_true", help="Also time the Gemini vision call both ways")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        images = args.images or [synthetic_photo(directory)]
+        for path in images:
+            start = time.perf_counter()
+            prepared = preprocess_image(path, args.max_edge, args.format, args.quality)
+            prep = time.perf_counter() - start
+            prepared["inline"] = len(prepared["data"]) <= IMAGE_INLINE_MAX_BYTES
+
+            result = {
+                "image": os.path.basename(path),
+                "original_bytes": prepared["original_bytes"],
+                "sent_bytes": len(prepared["data"]),
+                "size": f"{prepared['width']}x{prepared['height']}",
+                "mime_type": prepared["mime_type"],
+                "inline": prepared["inline"],
+                "prep_seconds": round(prep, 3),
+            }
+            if args.gemini:
+                result.update(time_gemini(path, prepared))
+            results.append(result)
+
+            line = (f"{result['image']:<30} {result['original_bytes'] / 1024:>9.0f} KiB -> "
+                    f"{result['sent_bytes'] / 1024:>7.0f} KiB  {result['size']:>10}  prep={prep * 1000:6.0f} ms")
+            if args.gemini:
+                line += f"  gemini before={result['before_seconds']:.2f}s after={result['after_seconds']:.2f}s"
+            print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"max_edge": args.max_edge, "format": args.format, "quality": args.quality,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
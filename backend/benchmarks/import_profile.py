@@ -0,0 +1,100 @@
+"""
+Startup import-time profile for the backend.
+
+Imports a module (app by default) in a fresh interpreter with
+`python -X importtime`, prints the total and the slowest imports, and fails
+when startup regresses:
+
+- the total import time is over --budget-ms, or
+- a module that should only load lazily (--forbid) was imported.
+
+    python benchmarks/import_profile.py --budget-ms 1500 --output imports.json
+
+Exit status is 1 on a violation, so it can run as a CI check (make
+check-backend-imports).
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by warmup.py / the handlers, never at import
+DEFAULT_FORBIDDEN = "torch,whisper,faster_whisper,ctranslate2,phi,google.generativeai,googletrans"
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def profile_imports(module: str) -> list:
+    """(module, self_us, cumulative_us, depth) for every import, in load order"""
+    env = dict(os.environ)
+    # The stub engine keeps the profile independent of installed models
+    env.setdefault("STT_ENGINE", "stub")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=0, help="Fail above this total (0 = no limit)")
+    parser.add_argument("--forbid", default=DEFAULT_FORBIDDEN,
+                        help="Comma-separated top-level packages that must not be imported")
+    parser.add_argument("--top", type=int, default=15, help="How many of the slowest imports to list")
+    parser.add_argument("--output", help="Write the profile as JSON to this file")
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    target = next((row for row in rows if row[0] == args.module and row[3] == 0), None)
+    total_ms = target[2] / 1000 if target else sum(row[1] for row in rows) / 1000
+
+    # Packages the module imports directly or indirectly, slowest first
+    slowest = sorted((row for row in rows if row[3] == 1), key=lambda row: row[2], reverse=True)[:args.top]
+    forbidden = [name.strip() for name in args.forbid.split(",") if name.strip()]
+    loaded = {row[0] for row in rows}
+    violations = sorted(
+        name for name in forbidden
+        if name in loaded or any(module.startswith(name + ".") for module in loaded)
+    )
+
+    print(f"import {args.module}: {total_ms:.0f} ms, {len(rows)} modules")
+    for name, _, cumulative_us, _ in slowest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if violations:
+        print(f"FAIL: imported at startup but should load lazily: {', '.join(violations)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "module": args.module,
+                "total_ms": round(total_ms, 1),
+                "modules": len(rows),
+                "slowest": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, _, us, _ in slowest],
+                "forbidden_imported": violations,
+            }, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
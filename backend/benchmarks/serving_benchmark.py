@@ -0,0 +1,143 @@
+"""
+Throughput of a running backend at increasing concurrency.
+
+Drives one path with N concurrent clients for --duration seconds per level
+and reports requests/s and latency percentiles, so the dev server and
+gunicorn can be compared on the same machine:
+
+    python app.py                                  # dev server, :5000
+    gunicorn -c gunicorn.conf.py app:app           # production, :5000
+    python benchmarks/serving_benchmark.py --path /stats --concurrency 1,4,16
+
+For caption endpoints pass --token and --file (sent as a multipart upload with
+--form fields); identical uploads hit the caption cache, which isolates the
+serving overhead from model latency.
+
+Only the standard library is used so it runs from any Python 3 environment.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def multipart_body(file_path: str, fields: dict) -> tuple:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode("utf-8")
+        )
+    filename = os.path.basename(file_path)
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    with open(file_path, "rb") as f:
+        data = f.read()
+    parts.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + data + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def call(url: str, token: str = None, body: bytes = None, content_type: str = None) -> int:
+    req = urllib.request.Request(url, data=body, method="POST" if body is not None else "GET")
+    if content_type:
+        req.add_header("Content-Type", content_type)
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_level(url: str, token: str, body: bytes, content_type: str, concurrency: int, duration: float) -> dict:
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            code = call(url, token, body, content_type)
+            local_latencies.append(time.perf_counter() - start)
+            if code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def pct(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--path", default="/stats")
+    parser.add_argument("--token", help="Bearer token for authenticated paths")
+    parser.add_argument("--file", help="Upload this file as multipart 'file' (POST)")
+    parser.add_argument("--form", default="fileType=image,tone=casual,length=medium,hashtagCount=5",
+                        help="Form fields sent with --file, as k=v pairs")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each level")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    body = content_type = None
+    if args.file:
+        fields = dict(pair.split("=", 1) for pair in args.form.split(",") if "=" in pair)
+        body, content_type = multipart_body(args.file, fields)
+
+    url = f"{args.url}{args.path}"
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = [run_level(url, args.token, body, content_type, level, args.duration) for level in levels]
+
+    if args.json:
+        print(json.dumps({"url": url, "results": results}, indent=2))
+        return
+
+    print(f"{url}  ({args.duration:.0f}s per level)")
+    print(f"{'conc':>5} {'reqs':>7} {'err':>5} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>5} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Speech-to-text engine benchmark.
+
+Runs each engine in a fresh process and reports model load time, wall time
+and real-time factor (wall time / audio length) per clip, and the peak RSS of
+that process. Engines are given as name[:compute_type]:
+
+    python benchmarks/stt_benchmark.py --input sample.mp4 \
+        --engines whisper,faster-whisper:int8,faster-whisper:float32,stub \
+        --model base --lengths 30,120 --output stt.json
+
+Audio is transcribed in one piece on one process, so the numbers compare the
+engines themselves; see transcription_benchmark.py for chunked parallelism.
+Without --input a synthetic clip is generated with ffmpeg.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stt_engines import WHISPER_MODEL_NAME, create_engine  # noqa: E402
+from transcription import SAMPLE_RATE, load_audio  # noqa: E402
+from transcription_benchmark import make_clip  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_engine(kind: str, compute_type: str, model_size: str, clips: dict, threads: int) -> dict:
+    """Load one engine and transcribe every clip (runs in its own process)"""
+    baseline_rss = peak_rss_mb()
+    start = time.perf_counter()
+    engine = create_engine(kind, model_size, compute_type, threads=threads)
+    load_seconds = time.perf_counter() - start
+
+    runs = []
+    for seconds, path in sorted(clips.items()):
+        audio = load_audio(path)
+        start = time.perf_counter()
+        text = engine.transcribe(audio)
+        wall = time.perf_counter() - start
+        audio_seconds = len(audio) / SAMPLE_RATE
+        runs.append({
+            "audio_seconds": round(audio_seconds, 2),
+            "wall_seconds": round(wall, 3),
+            "real_time_factor": round(wall / audio_seconds, 4) if audio_seconds else None,
+            "characters": len(text),
+        })
+    return {
+        "engine": engine.name,
+        "model": engine.model_size,
+        "compute_type": engine.compute_type,
+        "load_seconds": round(load_seconds, 3),
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Audio/video file to cut clips from")
+    parser.add_argument("--engines", default="whisper,faster-whisper:int8,stub",
+                        help="Comma-separated name[:compute_type] entries")
+    parser.add_argument("--model", default=WHISPER_MODEL_NAME, help="Model size (tiny, base, small, ...)")
+    parser.add_argument("--lengths", default="30,120", help="Clip lengths in seconds")
+    parser.add_argument("--threads", type=int, default=0, help="Engine threads (0 = runtime default)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    lengths = [int(x) for x in args.lengths.split(",") if x.strip()]
+    engines = [entry.strip().partition(":") for entry in args.engines.split(",") if entry.strip()]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        clips = {seconds: make_clip(args.input, seconds, directory) for seconds in lengths}
+
+        for kind, _, compute_type in engines:
+            # A fresh process per engine so peak RSS is not inherited from the previous one
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                try:
+                    result = pool.submit(run_engine, kind, compute_type, args.model, clips, args.threads).result()
+                except Exception as e:
+                    print(f"{kind:<15} skipped: {str(e)}")
+                    results.append({"engine": kind, "compute_type": compute_type or None, "error": str(e)})
+                    continue
+            results.append(result)
+            print(f"{result['engine']:<15} {result['compute_type']:<13} load={result['load_seconds']:7.2f}s  "
+                  f"peak_rss={result['peak_rss_mb']:8.1f} MB")
+            for run in result["runs"]:
+                print(f"    {run['audio_seconds']:>7.1f}s audio  wall={run['wall_seconds']:8.2f}s  "
+                      f"rtf={run['real_time_factor']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Wall-time benchmark for chunked Whisper transcription.
+
+Transcribes clips of increasing length with different worker counts and
+reports wall time and real-time factor (wall time / audio length) for each
+combination. Model loading is done before timing starts.
+
+    python benchmarks/transcription_benchmark.py --input sample.mp4 \
+        --lengths 30,60,120,300 --workers 1,2,4 --output transcription.json
+
+Without --input a synthetic clip (tone bursts separated by silence) is
+generated with ffmpeg. It is fine for timing but not for accuracy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcription import ChunkedTranscriber, cpu_limit  # noqa: E402
+
+
+def make_clip(source: str, seconds: int, directory: str) -> str:
+    path = os.path.join(directory, f"clip_{seconds}s.wav")
+    if source:
+        cmd = ["ffmpeg", "-nostdin", "-y", "-i", source, "-t", str(seconds), "-vn", "-ac", "1", "-ar", "16000", path]
+    else:
+        # 440 Hz bursts: 5 s on, 1 s off, so there are silences to split at
+        # (commas inside a filter argument must be escaped)
+        expr = r"if(lt(mod(t\,6)\,5)\,0.3*sin(2*PI*440*t)\,0)"
+        cmd = ["ffmpeg", "-nostdin", "-y", "-f", "lavfi", "-i",
+               f"aevalsrc={expr}:s=16000:d={seconds}", "-ac", "1", path]
+    subprocess.run(cmd, capture_output=True, check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Audio/video file to cut clips from")
+    parser.add_argument("--lengths", default="30,60,120,300", help="Clip lengths in seconds")
+    parser.add_argument("--workers", default=None, help="Worker counts (default: 1 and the CPU limit)")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    lengths = [int(x) for x in args.lengths.split(",") if x.strip()]
+    if args.workers:
+        worker_counts = [int(x) for x in args.workers.split(",") if x.strip()]
+    else:
+        worker_counts = sorted({1, cpu_limit()})
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        clips = {seconds: make_clip(args.input, seconds, directory) for seconds in lengths}
+        warmup = make_clip(args.input, 2, directory)
+
+        for workers in worker_counts:
+            transcriber = ChunkedTranscriber(workers=workers, chunk_seconds=args.chunk_seconds, max_audio_seconds=0)
+            # Load the model in every process before timing
+            transcriber.warm_up()
+            transcriber.transcribe(warmup)
+
+            for seconds in lengths:
+                start = time.perf_counter()
+                result = transcriber.transcribe(clips[seconds])
+                wall = time.perf_counter() - start
+                results.append({
+                    "audio_seconds": result["audio_seconds"],
+                    "workers": workers,
+                    "chunks": result["chunks"],
+                    "wall_seconds": round(wall, 3),
+                    "real_time_factor": round(wall / result["audio_seconds"], 4) if result["audio_seconds"] else None,
+                })
+                print(f"{seconds:>5}s audio  workers={workers:<2} chunks={result['chunks']:<3} "
+                      f"wall={wall:8.2f}s  rtf={results[-1]['real_time_factor']}")
+            transcriber.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpu_limit": cpu_limit(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
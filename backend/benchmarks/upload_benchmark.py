@@ -0,0 +1,125 @@
+"""
+Per-request memory and disk I/O of upload handling.
+
+Posts multipart uploads of increasing size to two minimal Flask apps through
+the test client and measures each request:
+
+- copy    Flask's default request plus file.save() into a temp dir and a
+          separate hashing pass (what /generate-captions used to do)
+- stream  uploads.UploadRequest: written once, hashed while it arrives
+
+Reported per request: wall time, peak Python heap (tracemalloc) and the bytes
+the process wrote and read through syscalls (wchar/rchar in /proc/self/io,
+Linux only).
+
+    python benchmarks/upload_benchmark.py --sizes-mb 10,50,200 --output uploads.json
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request  # noqa: E402
+from werkzeug.datastructures import FileStorage  # noqa: E402
+from werkzeug.test import encode_multipart  # noqa: E402
+
+from caption_cache import file_sha256  # noqa: E402
+from uploads import UploadRequest, get_upload  # noqa: E402
+
+
+def proc_io() -> dict:
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+
+def copy_app() -> Flask:
+    app = Flask("copy")
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        file = request.files["file"]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(temp_dir, file.filename)
+            file.save(file_path)
+            return jsonify({"sha256": file_sha256(file_path)})
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return app
+
+
+def stream_app(max_bytes: int) -> Flask:
+    app = Flask("stream")
+    app.request_class = UploadRequest
+    app.config["MAX_CONTENT_LENGTH"] = max_bytes
+
+    @app.teardown_request
+    def discard_uploads(exc):
+        request.discard_uploads()
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        return jsonify({"sha256": get_upload(request.files["file"]).sha256})
+
+    return app
+
+
+def measure(app: Flask, payload: bytes) -> dict:
+    client = app.test_client()
+    # Encode the body up front so the client's own buffering is not measured
+    boundary, body = encode_multipart({"file": FileStorage(io.BytesIO(payload), filename="clip.mp4")})
+    before = proc_io()
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.post("/upload", data=body, content_type=f"multipart/form-data; boundary={boundary}")
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = proc_io()
+    assert response.status_code == 200, response.data
+    return {
+        "wall_seconds": round(wall, 3),
+        "peak_heap_mb": round(peak / 1024 / 1024, 2),
+        "bytes_written": after.get("wchar", 0) - before.get("wchar", 0) if after else None,
+        "bytes_read": after.get("rchar", 0) - before.get("rchar", 0) if after else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", default="10,50", help="Upload sizes in MiB")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes_mb.split(",") if x.strip()]
+    apps = {"copy": copy_app(), "stream": stream_app(max(sizes) * 2 * 1024 * 1024)}
+
+    results = []
+    for size in sizes:
+        payload = os.urandom(size * 1024 * 1024)
+        for name, app in apps.items():
+            result = {"mode": name, "size_mb": size, **measure(app, payload)}
+            results.append(result)
+            written = result["bytes_written"] / 1024 / 1024 if result["bytes_written"] is not None else float("nan")
+            read = result["bytes_read"] / 1024 / 1024 if result["bytes_read"] is not None else float("nan")
+            print(f"{size:>5} MiB  {name:<6} wall={result['wall_seconds']:7.3f}s  "
+                  f"heap_peak={result['peak_heap_mb']:7.2f} MiB  written={written:8.1f} MiB  read={read:8.1f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Result cache for /generate-captions.
+
+Two levels, both keyed by content rather than by request:
+
+1. content description - keyed by the SHA-256 of the uploaded bytes (plus the
+   file type). Holds the transcription or image analysis, which is the
+   expensive Whisper / Gemini vision step.
+2. captions - keyed by the description together with tone, length,
+   hashtag count and the prompt version (prompts.PROMPT_VERSION). Holds the
+   structured captions.
+
+Storage is pluggable: an in-process LRU (default), a directory on disk, or
+any Redis-protocol server. Values are stored as JSON strings so every backend
+holds the same bytes.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from prompts import PROMPT_VERSION
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+# memory | disk | redis | none
+CAPTION_CACHE_BACKEND = os.getenv("CAPTION_CACHE_BACKEND", "memory").lower()
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", "1000"))
+CAPTION_CACHE_DESCRIPTION_TTL = int(os.getenv("CAPTION_CACHE_DESCRIPTION_TTL", "86400"))
+CAPTION_CACHE_CAPTIONS_TTL = int(os.getenv("CAPTION_CACHE_CAPTIONS_TTL", "3600"))
+CAPTION_CACHE_DIR = os.getenv("CAPTION_CACHE_DIR", "/tmp/caption-cache")
+CAPTION_CACHE_REDIS_URL = os.getenv("CAPTION_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    """Per-process LRU; entries are lost on restart and not shared between workers"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        # The TTL cap is per entry (see set); this is only an upper bound
+        self._cache = TTLCache(max_entries, ttl_seconds=float("inf"))
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        self._cache.set(key, value, ttl_seconds=ttl_seconds)
+
+    def size(self) -> int:
+        return self._cache.stats()["size"]
+
+
+class DiskBackend:
+    """One file per entry under a directory; survives restarts and can be shared via a volume"""
+
+    name = "disk"
+
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        # Eviction trims a tenth below the limit, so the directory is only scanned every few writes
+        self.evict_to = max_entries - max_entries // 10
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Files as of the last scan plus those written since; files written by other
+        # processes sharing the directory are counted at the next scan
+        self._entries = len(self._scan())
+
+    def _scan(self) -> list:
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        except OSError:
+            return []
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            try:
+                os.remove(path)
+                with self._lock:
+                    self._entries -= 1
+            except OSError:
+                pass
+            return None
+        # Touch so eviction is least-recently-used rather than oldest-written
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            new_entry = not os.path.exists(path)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": time.time() + ttl_seconds, "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # A full or read-only disk costs a cache entry, not the request
+            print(f"Caption cache write failed: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if new_entry:
+            with self._lock:
+                self._entries += 1
+                full = self._entries > self.max_entries
+            if full:
+                self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in self._scan():
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+            entries.sort()
+            excess = max(0, len(entries) - self.evict_to)
+            for _, path in entries[:excess]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._entries = len(entries) - excess
+
+    def size(self) -> int:
+        return len(self._scan())
+
+
+class RedisBackend:
+    """Any Redis-protocol server (Redis, Valkey, KeyDB, or a local stand-in)"""
+
+    name = "redis"
+
+    def __init__(self, url: str = None, client=None, prefix: str = "captiongen:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError(
+                    "CAPTION_CACHE_BACKEND=redis requires the 'redis' package"
+                )
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            print(f"Caption cache read failed: {str(e)}")
+            return None
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        try:
+            self.client.set(self.prefix + key, value, ex=ttl_seconds)
+        except Exception as e:
+            print(f"Caption cache write failed: {str(e)}")
+
+    def size(self) -> int:
+        return -1
+
+
+class NullBackend:
+    """Caching disabled"""
+
+    name = "none"
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        pass
+
+    def size(self) -> int:
+        return 0
+
+
+def create_backend(kind: str):
+    if kind == "memory":
+        return MemoryBackend(CAPTION_CACHE_MAX_ENTRIES)
+    if kind == "disk":
+        return DiskBackend(CAPTION_CACHE_DIR, CAPTION_CACHE_MAX_ENTRIES)
+    if kind == "redis":
+        return RedisBackend(CAPTION_CACHE_REDIS_URL)
+    if kind == "none":
+        return NullBackend()
+    raise ValueError(f"Unknown CAPTION_CACHE_BACKEND: {kind}")
+
+
+class CaptionCache:
+    """Description and caption lookups over a shared backend, with per-level counters"""
+
+    def __init__(self, backend, description_ttl: int, captions_ttl: int):
+        self.backend = backend
+        self.description_ttl = description_ttl
+        self.captions_ttl = captions_ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            "description_hits": 0,
+            "description_misses": 0,
+            "caption_hits": 0,
+            "caption_misses": 0,
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _get(self, key: str, level: str):
+        raw = self.backend.get(key)
+        if raw is None:
+            self._count(f"{level}_misses")
+            return None
+        self._count(f"{level}_hits")
+        return json.loads(raw)
+
+    @staticmethod
+    def description_key(content_hash: str, file_type: str) -> str:
+        return f"desc:{file_type}:{content_hash}"
+
+    @staticmethod
+    def captions_key(content_description: str, tone: str, length: str, hashtag_count: int) -> str:
+        digest = hashlib.sha256(content_description.encode("utf-8")).hexdigest()
+        return f"cap:v{PROMPT_VERSION}:{digest}:{tone}:{length}:{hashtag_count}"
+
+    def get_description(self, content_hash: str, file_type: str):
+        return self._get(self.description_key(content_hash, file_type), "description")
+
+    def set_description(self, content_hash: str, file_type: str, content_description: str):
+        self.backend.set(
+            self.description_key(content_hash, file_type),
+            json.dumps(content_description),
+            self.description_ttl
+        )
+
+    def get_captions(self, content_description: str, tone: str, length: str, hashtag_count: int):
+        return self._get(self.captions_key(content_description, tone, length, hashtag_count), "caption")
+
+    def set_captions(self, content_description: str, tone: str, length: str, hashtag_count: int, captions):
+        self.backend.set(
+            self.captions_key(content_description, tone, length, hashtag_count),
+            json.dumps(captions),
+            self.captions_ttl
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        for level in ("description", "caption"):
+            lookups = stats[f"{level}_hits"] + stats[f"{level}_misses"]
+            stats[f"{level}_hit_rate"] = round(stats[f"{level}_hits"] / lookups, 4) if lookups else 0.0
+        stats["backend"] = self.backend.name
+        stats["entries"] = self.backend.size()
+        return stats
+
+
+caption_cache = CaptionCache(
+    create_backend(CAPTION_CACHE_BACKEND),
+    CAPTION_CACHE_DESCRIPTION_TTL,
+    CAPTION_CACHE_CAPTIONS_TTL,
+)
@@ -0,0 +1,354 @@
+"""
+Caption generation pipeline.
+
+Shared by the synchronous /generate-captions handler and the background job
+workers: content analysis (speech-to-text plus keyframes for video, Gemini
+vision for images) and caption generation from that analysis, both going
+through the result cache.
+
+Prompts come from the registry in prompts.py. Captions are requested as
+structured output and returned as [{"text": ..., "hashtags": [...]}].
+
+Every model call is timed as a gemini_<kind> stage of the request it runs
+for (telemetry.py); analysis threads are handed work through in_context().
+"""
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from phi.agent import Agent
+from phi.model.google import Gemini
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+from admission import llm_gate, transcription_gate
+from caption_cache import caption_cache, file_sha256
+from image_prep import image_preprocessor
+from keyframes import extract_keyframes
+from model_usage import model_usage
+from prompts import normalize_captions, parse_json, prompt_registry
+from telemetry import in_context, record_stage, stage
+from transcription import transcriber
+
+load_dotenv()
+API_KEY = os.getenv("GOOGLE_API_KEY")
+# Transcription and keyframe extraction together must finish within this
+VIDEO_ANALYSIS_BUDGET_SECONDS = float(os.getenv("VIDEO_ANALYSIS_BUDGET_SECONDS", "120"))
+# Two threads per video being analyzed
+VIDEO_ANALYSIS_THREADS = int(os.getenv("VIDEO_ANALYSIS_THREADS", "8"))
+# Most caption prompts answered by one model call in generate_captions_batch
+CAPTION_PACK_SIZE = int(os.getenv("CAPTION_PACK_SIZE", "5"))
+# Images: two-pass (describe, then caption the description) or single-pass
+# (one vision call returning captions and a short description as JSON)
+IMAGE_CAPTION_MODE = os.getenv("IMAGE_CAPTION_MODE", "two-pass")
+
+IMAGE_CAPTION_MODES = ("two-pass", "single-pass")
+if IMAGE_CAPTION_MODE not in IMAGE_CAPTION_MODES:
+    raise ValueError(f"Unknown IMAGE_CAPTION_MODE: {IMAGE_CAPTION_MODE}")
+
+if API_KEY:
+    genai.configure(api_key=API_KEY)
+
+GEMINI_MODEL_ID = "gemini-2.0-flash-exp"
+
+# Initialize AI Agent
+agent = Agent(
+    name="Content Caption Generator",
+    model=Gemini(id=GEMINI_MODEL_ID),
+    markdown=True,
+)
+
+# Images and captions go to Gemini directly: small images can be sent inline,
+# and captions come back as schema-checked JSON
+gemini_model = genai.GenerativeModel(GEMINI_MODEL_ID)
+
+video_executor = ThreadPoolExecutor(max_workers=VIDEO_ANALYSIS_THREADS, thread_name_prefix="video-analysis")
+
+
+def gemini_image_part(prepared: dict):
+    """Inline blob for small prepared images, a Files API upload otherwise"""
+    if prepared["inline"]:
+        return {"mime_type": prepared["mime_type"], "data": prepared["data"]}
+    with stage("gemini_upload_file"):
+        return genai.upload_file(io.BytesIO(prepared["data"]), mime_type=prepared["mime_type"])
+
+
+def record_agent_usage(kind: str, response, start: float):
+    """Latency and token counts of an agent.run response"""
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_stage(f"gemini_{kind}", elapsed_ms)
+    metrics = response.metrics or {}
+    model_usage.record(
+        kind, elapsed_ms, sum(metrics.get("input_tokens", [])), sum(metrics.get("output_tokens", []))
+    )
+
+
+def record_gemini_usage(kind: str, response, start: float, image: bool = False):
+    """Latency and token counts of a gemini_model.generate_content response"""
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_stage(f"gemini_{kind}", elapsed_ms)
+    if image:
+        image_preprocessor.record_vision_latency(elapsed_ms)
+    usage = response.usage_metadata
+    model_usage.record(kind, elapsed_ms, usage.prompt_token_count or 0, usage.candidates_token_count or 0)
+
+
+def structured_output(schema: str):
+    """Generation config that makes Gemini answer with JSON matching a registry schema"""
+    return genai.GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=prompt_registry.schemas[schema],
+    )
+
+
+def timed_keyframes(file_path: str) -> list:
+    with stage("keyframes"):
+        return extract_keyframes(file_path, VIDEO_ANALYSIS_BUDGET_SECONDS)
+
+
+def describe_video(file_path: str) -> str:
+    """Transcript and scene keyframes, extracted concurrently, analyzed in one multimodal request"""
+    # Raises Saturated when transcriptions are backed up; the slot is held until the transcription ends
+    transcription_gate.acquire()
+    deadline = time.monotonic() + VIDEO_ANALYSIS_BUDGET_SECONDS
+    try:
+        transcript_future = video_executor.submit(in_context(transcriber.transcribe), file_path)
+    except Exception:
+        transcription_gate.release()
+        raise
+    transcript_future.add_done_callback(lambda _: transcription_gate.release())
+    frames_future = video_executor.submit(in_context(timed_keyframes), file_path)
+
+    transcript = ""
+    transcript_error = None
+    try:
+        transcript = transcript_future.result(timeout=max(0.0, deadline - time.monotonic()))["text"]
+    except FuturesTimeoutError:
+        transcript_error = TimeoutError(f"Transcription exceeded {VIDEO_ANALYSIS_BUDGET_SECONDS:.0f}s")
+        print(f"Error: {str(transcript_error)}; continuing with keyframes only")
+    except Exception as e:
+        # e.g. a video without an audio track
+        transcript_error = e
+        print(f"Transcription failed: {str(e)}")
+
+    try:
+        frames = frames_future.result(timeout=max(0.0, deadline - time.monotonic()) + 5)
+    except Exception as e:
+        print(f"Keyframe extraction failed: {str(e)}")
+        frames = []
+
+    if not frames:
+        if transcript_error:
+            raise transcript_error
+        return f"""
+            Video Content Analysis:
+            Transcription: {transcript}
+            """
+
+    speech = f"Transcript of the audio:\n{transcript}" if transcript else "The video has no intelligible speech."
+    video_prompt = prompt_registry.render("video_description", speech=speech)
+    # JPEG bytes; the agent sends them inline as image/jpeg
+    with llm_gate.slot():
+        start = time.perf_counter()
+        response = agent.run(video_prompt, images=frames)
+        record_agent_usage("video_description", response, start)
+    return f"""
+            Video Content Analysis:
+            Transcription: {transcript}
+            Visual Analysis: {response.content}
+            """
+
+
+def describe_content(file_path: str, file_type: str, content_hash: str = None) -> str:
+    """Transcribe a video or analyze an image (cached by the hash of the bytes)"""
+    content_hash = content_hash or file_sha256(file_path)
+    content_description = caption_cache.get_description(content_hash, file_type)
+    if content_description is None:
+        if file_type == "video":
+            content_description = describe_video(file_path)
+        else:
+            with stage("image_prep"):
+                prepared = image_preprocessor.prepare(file_path, content_hash)
+            description_prompt = prompt_registry.render("image_description")
+            with llm_gate.slot():
+                start = time.perf_counter()
+                description_response = gemini_model.generate_content([gemini_image_part(prepared), description_prompt])
+                record_gemini_usage("image_description", description_response, start, image=True)
+            content_description = f"""
+            Image Content Analysis:
+            {description_response.text}
+            """
+        caption_cache.set_description(content_hash, file_type, content_description)
+    return content_description
+
+
+def generate_captions(content_description: str, tone: str, length: str, hashtag_count: int) -> list:
+    """Captions for an analyzed piece of content (cached)"""
+    captions = caption_cache.get_captions(content_description, tone, length, hashtag_count)
+    if captions is None:
+        caption_prompt = prompt_registry.render(
+            "captions", content_description=content_description, tone=tone, length=length, hashtag_count=hashtag_count
+        )
+        with llm_gate.slot():
+            start = time.perf_counter()
+            response = gemini_model.generate_content(caption_prompt, generation_config=structured_output("captions"))
+            record_gemini_usage("captions", response, start)
+        captions = normalize_captions(parse_json(response.text), hashtag_count)
+        caption_cache.set_captions(content_description, tone, length, hashtag_count, captions)
+    return captions
+
+
+def iter_json_array(chunks):
+    """Yield each element of a streamed top-level JSON array as soon as it is complete"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = None
+    for chunk in chunks:
+        buffer += chunk
+        if position is None:
+            start = buffer.find("[")
+            if start < 0:
+                continue
+            position = start + 1
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer) or buffer[position] == "]":
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Incomplete; wait for the next chunk
+                break
+            if isinstance(element, (int, float)) and (end == len(buffer) or buffer[end] not in " \t\r\n,]"):
+                # A number is only complete once something other than a digit follows ("1" of "12", "1" of "1.5")
+                break
+            position = end
+            yield element
+
+
+def stream_captions(content_description: str, tone: str, length: str, hashtag_count: int):
+    """Yield each caption as soon as Gemini has produced it (cached once complete)"""
+    captions = caption_cache.get_captions(content_description, tone, length, hashtag_count)
+    if captions is not None:
+        yield from captions
+        return
+    caption_prompt = prompt_registry.render(
+        "captions", content_description=content_description, tone=tone, length=length, hashtag_count=hashtag_count
+    )
+    captions = []
+    # Held until the response is fully read (or the client goes away)
+    with llm_gate.slot():
+        start = time.perf_counter()
+        response = gemini_model.generate_content(
+            caption_prompt, generation_config=structured_output("captions"), stream=True
+        )
+        for element in iter_json_array(chunk.text for chunk in response):
+            try:
+                caption = normalize_captions([element], hashtag_count)[0]
+            except ValueError:
+                continue
+            captions.append(caption)
+            yield caption
+        record_gemini_usage("captions_stream", response, start)
+    if not captions:
+        raise ValueError("no captions in the response")
+    caption_cache.set_captions(content_description, tone, length, hashtag_count, captions)
+
+
+def generate_captions_batch(content_descriptions: list, tone: str, length: str, hashtag_count: int) -> list:
+    """Captions for several analyzed items (cached); misses share one model call per CAPTION_PACK_SIZE"""
+    results = [caption_cache.get_captions(d, tone, length, hashtag_count) for d in content_descriptions]
+    # Identical content in one batch is captioned once
+    missing = list(dict.fromkeys(d for d, captions in zip(content_descriptions, results) if captions is None))
+
+    generated = {}
+    for start_index in range(0, len(missing), CAPTION_PACK_SIZE):
+        pack = missing[start_index:start_index + CAPTION_PACK_SIZE]
+        packed = {}
+        if len(pack) > 1:
+            contents = "\n\n".join(
+                f"Content {number}:\n{content_description.strip()}"
+                for number, content_description in enumerate(pack, start=1)
+            )
+            caption_prompt = prompt_registry.render(
+                "packed_captions", content_count=len(pack), contents=contents,
+                tone=tone, length=length, hashtag_count=hashtag_count
+            )
+            with llm_gate.slot():
+                start = time.perf_counter()
+                response = gemini_model.generate_content(
+                    caption_prompt, generation_config=structured_output("packed_captions")
+                )
+                record_gemini_usage("captions_packed", response, start)
+            try:
+                entries = parse_json(response.text)
+            except ValueError:
+                entries = []
+            for entry in entries if isinstance(entries, list) else []:
+                try:
+                    if isinstance(entry, dict) and entry.get("content") in range(1, len(pack) + 1):
+                        packed[entry["content"]] = normalize_captions(entry.get("captions"), hashtag_count)
+                except ValueError:
+                    continue
+        for number, content_description in enumerate(pack, start=1):
+            captions = packed.get(number)
+            if captions is None:
+                # Single item, or the packed answer left this one out
+                captions = generate_captions(content_description, tone, length, hashtag_count)
+            else:
+                caption_cache.set_captions(content_description, tone, length, hashtag_count, captions)
+            generated[content_description] = captions
+
+    return [captions if captions is not None else generated[d] for d, captions in zip(content_descriptions, results)]
+
+
+def caption_image_single_pass(file_path: str, tone: str, length: str, hashtag_count: int,
+                              content_hash: str = None) -> list:
+    """Captions for an image from one vision call; a cached description only needs the caption call"""
+    content_hash = content_hash or file_sha256(file_path)
+    content_description = caption_cache.get_description(content_hash, "image")
+    if content_description is not None:
+        return generate_captions(content_description, tone, length, hashtag_count)
+
+    with stage("image_prep"):
+        prepared = image_preprocessor.prepare(file_path, content_hash)
+    caption_prompt = prompt_registry.render("single_pass", tone=tone, length=length, hashtag_count=hashtag_count)
+    with llm_gate.slot():
+        start = time.perf_counter()
+        response = gemini_model.generate_content(
+            [gemini_image_part(prepared), caption_prompt],
+            generation_config=structured_output("single_pass"),
+        )
+        record_gemini_usage("image_single_pass", response, start, image=True)
+    try:
+        result = parse_json(response.text)
+        captions = normalize_captions(result["captions"], hashtag_count)
+        description = result["description"]
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Single-pass response unusable ({str(e)}); falling back to two passes")
+        content_description = describe_content(file_path, "image", content_hash=content_hash)
+        return generate_captions(content_description, tone, length, hashtag_count)
+
+    # Cached like a two-pass description, so other tones for this image need one text-only call
+    content_description = f"""
+            Image Content Analysis:
+            {description}
+            """
+    caption_cache.set_description(content_hash, "image", content_description)
+    caption_cache.set_captions(content_description, tone, length, hashtag_count, captions)
+    return captions
+
+
+def caption_content(file_path: str, file_type: str, tone: str, length: str, hashtag_count: int,
+                    content_hash: str = None, mode: str = IMAGE_CAPTION_MODE) -> list:
+    """Captions for an upload: one call for images in single-pass mode, analysis then captions otherwise"""
+    # IMAGE_CAPTION_MODE itself is checked at import; this catches a bad explicit mode
+    if mode not in IMAGE_CAPTION_MODES:
+        raise ValueError(f"Unknown caption mode: {mode}")
+    if file_type == "image" and mode == "single-pass":
+        return caption_image_single_pass(file_path, tone, length, hashtag_count, content_hash=content_hash)
+    content_description = describe_content(file_path, file_type, content_hash=content_hash)
+    return generate_captions(content_description, tone, length, hashtag_count)
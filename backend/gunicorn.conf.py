@@ -0,0 +1,71 @@
+"""
+Gunicorn settings for serving the backend in production.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+preload_app imports app.py once in the master, and on_starting then runs the
+model warm-up there (warmup.py) before the listening socket is opened. The
+speech-to-text model and the agent are therefore loaded before the workers
+are forked, and the model weights are shared copy-on-write by all of them.
+Each worker finishes warming up on a background thread: engines that cannot
+cross a fork (faster-whisper) are reloaded and the chunk pool is started;
+/ready turns 200 when that is done.
+
+Each worker is a gthread worker: GUNICORN_THREADS requests at a time, mostly
+waiting on Gemini, the auth service or ffmpeg. On SIGTERM the master stops
+accepting connections and gives in-flight requests GUNICORN_GRACEFUL_TIMEOUT
+seconds to finish.
+
+Each worker writes its metrics to METRICS_DIR (metrics.py), where /metrics
+on any worker adds them up for the pod. The directory is emptied when the
+master starts, and an exited worker's counters are kept in dead.json.
+"""
+import gc
+import os
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+
+# A synchronous caption request for a long video can take minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "120"))
+keepalive = 5
+
+# Heartbeat files on tmpfs: overlay filesystems can stall them and get workers killed
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = "-"
+
+# Set before app.py is preloaded, so metrics.py picks it up
+os.environ.setdefault("METRICS_DIR", os.path.join(worker_tmp_dir or tempfile.gettempdir(), "caption-metrics"))
+
+
+def on_starting(server):
+    from metrics import registry
+    from warmup import model_warmup
+
+    registry.reset()
+    model_warmup.run(["captioning", "speech_to_text"])
+
+
+def when_ready(server):
+    # Everything allocated while preloading moves to a permanent generation, so
+    # the workers' garbage collector never writes to (and copies) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from metrics import registry
+    from warmup import model_warmup
+
+    registry.start_flusher()
+    model_warmup.start()
+
+
+def child_exit(server, worker):
+    from metrics import registry
+
+    registry.process_exited(worker.pid)
@@ -0,0 +1,161 @@
+"""
+Image preprocessing before Gemini vision.
+
+Phone photos are often 10+ MB, and both the upload and the model latency
+scale with the bytes sent. Images are decoded once (JPEGs at a reduced DCT
+scale when possible), rotated according to their EXIF orientation, shrunk so
+the longest edge is at most IMAGE_MAX_EDGE and re-encoded as JPEG or WebP.
+If that would not make the file smaller, the original bytes are sent as they
+are.
+
+Results are cached by the upload's content hash. Prepared images up to
+IMAGE_INLINE_MAX_BYTES are sent inline with the generate request, which skips
+the Files API upload round trip; larger ones are still uploaded.
+"""
+import io
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from service_client import LatencyHistogram
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+# jpeg | webp
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# Gemini accepts up to 20 MB per request inline; stay well below it
+IMAGE_INLINE_MAX_BYTES = int(os.getenv("IMAGE_INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+IMAGE_PREP_CACHE_ENTRIES = int(os.getenv("IMAGE_PREP_CACHE_ENTRIES", "64"))
+IMAGE_PREP_CACHE_TTL = int(os.getenv("IMAGE_PREP_CACHE_TTL", "3600"))
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+}
+
+EXIF_ORIENTATION = 0x0112
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    # JPEG has no alpha channel; composite onto white instead of letting
+    # transparent pixels turn black
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode not in ("RGB", "L") else image
+
+
+def preprocess_image(file_path: str, max_edge: int = IMAGE_MAX_EDGE, image_format: str = IMAGE_FORMAT,
+                     quality: int = IMAGE_QUALITY) -> dict:
+    """Decode, orient, downsize and re-encode an image; returns the bytes to send"""
+    original_bytes = os.path.getsize(file_path)
+    with Image.open(file_path) as image:
+        source_format = image.format
+        if source_format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers max_edge
+            image.draft("RGB", (max_edge, max_edge))
+        rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > max_edge
+        if resized:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        target_format = "WEBP" if image_format == "webp" else "JPEG"
+        if target_format == "JPEG":
+            image = _flatten(image)
+        buffer = io.BytesIO()
+        image.save(buffer, format=target_format, quality=quality, optimize=True)
+        width, height = image.size
+
+    data = buffer.getvalue()
+    mime_type = MIME_TYPES[target_format]
+    if not resized and not rotated and len(data) >= original_bytes and source_format in MIME_TYPES:
+        # Already small: re-encoding would only cost quality
+        with open(file_path, "rb") as f:
+            data = f.read()
+        mime_type = MIME_TYPES[source_format]
+
+    return {
+        "data": data,
+        "mime_type": mime_type,
+        "width": width,
+        "height": height,
+        "original_bytes": original_bytes,
+    }
+
+
+class ImagePreprocessor:
+    """preprocess_image with a content-hash cache and bytes/latency counters"""
+
+    def __init__(self, max_edge: int, image_format: str, quality: int, inline_max_bytes: int,
+                 cache_entries: int, cache_ttl: int):
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.inline_max_bytes = inline_max_bytes
+        self._cache = TTLCache(cache_entries, cache_ttl)
+        self._lock = threading.Lock()
+        self._stats = {
+            "images": 0,
+            "original_bytes": 0,
+            "sent_bytes": 0,
+            "inline": 0,
+            "uploaded": 0,
+        }
+        self._prep_latency = LatencyHistogram()
+        self._vision_latency = LatencyHistogram()
+
+    def prepare(self, file_path: str, content_hash: str = None) -> dict:
+        """Prepared image for file_path; prepared["inline"] says how to send it"""
+        key = f"{content_hash}:{self.max_edge}:{self.image_format}:{self.quality}" if content_hash else None
+        prepared = self._cache.get(key) if key else None
+        if prepared is None:
+            start = time.perf_counter()
+            prepared = preprocess_image(file_path, self.max_edge, self.image_format, self.quality)
+            prepared["inline"] = len(prepared["data"]) <= self.inline_max_bytes
+            self._prep_latency.observe((time.perf_counter() - start) * 1000)
+            if key:
+                self._cache.set(key, prepared)
+
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["original_bytes"] += prepared["original_bytes"]
+            self._stats["sent_bytes"] += len(prepared["data"])
+            self._stats["inline" if prepared["inline"] else "uploaded"] += 1
+        return prepared
+
+    def record_vision_latency(self, elapsed_ms: float):
+        """Time from sending the image (upload included) to the model's answer"""
+        self._vision_latency.observe(elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["bytes_saved_ratio"] = (
+            round(1 - stats["sent_bytes"] / stats["original_bytes"], 4) if stats["original_bytes"] else 0.0
+        )
+        stats["max_edge"] = self.max_edge
+        stats["format"] = self.image_format
+        stats["cache"] = self._cache.stats()
+        stats["prep_latency"] = self._prep_latency.stats()
+        stats["vision_latency"] = self._vision_latency.stats()
+        return stats
+
+
+image_preprocessor = ImagePreprocessor(
+    IMAGE_MAX_EDGE,
+    IMAGE_FORMAT,
+    IMAGE_QUALITY,
+    IMAGE_INLINE_MAX_BYTES,
+    IMAGE_PREP_CACHE_ENTRIES,
+    IMAGE_PREP_CACHE_TTL,
+)
@@ -0,0 +1,233 @@
+"""
+Persistent job queue for long-running caption generation.
+
+Jobs live in a SQLite database under JOBS_DIR so they survive restarts of
+both the web process and the worker pool (worker.py). The web process only
+inserts and reads jobs; worker processes claim them one at a time inside an
+IMMEDIATE transaction, so each job is picked up by exactly one worker.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from auth_client import release_caption_quota
+
+load_dotenv()
+
+JOBS_DIR = os.getenv("JOBS_DIR", "/tmp/caption-jobs")
+JOBS_UPLOAD_DIR = os.path.join(JOBS_DIR, "uploads")
+JOBS_DB_PATH = os.path.join(JOBS_DIR, "jobs.db")
+# Jobs allowed to wait in the queue before new submissions get a 429
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "20"))
+# Finished jobs (and their results) are deleted after this long
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", "86400"))
+# A job whose worker dies this many times (e.g. OOM) is failed instead of retried
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "2"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Fields returned to clients; everything else (user, reservation, paths) stays internal
+PUBLIC_FIELDS = ("id", "status", "file_type", "tone", "length", "hashtag_count",
+                 "result", "error", "created_at", "started_at", "finished_at")
+
+
+class QueueFullError(Exception):
+    """Raised when JOBS_MAX_QUEUED jobs are already waiting"""
+
+
+class JobStore:
+    """SQLite-backed job table shared between the web and worker processes"""
+
+    def __init__(self, db_path: str, max_queued: int):
+        self.db_path = db_path
+        self.max_queued = max_queued
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_type TEXT NOT NULL,
+                    tone TEXT NOT NULL,
+                    length TEXT NOT NULL,
+                    hashtag_count INTEGER NOT NULL,
+                    reservation TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker_pid INTEGER,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+            # Job stores from before quota was released by user ID kept each caller's bearer token
+            if "token" in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("UPDATE jobs SET token = NULL WHERE token IS NOT NULL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row(row) -> dict:
+        if row is None:
+            return None
+        job = dict(row)
+        if job.get("reservation"):
+            job["reservation"] = json.loads(job["reservation"])
+        return job
+
+    def submit(self, user_id: str, reservation: dict, file_path: str,
+               file_type: str, tone: str, length: str, hashtag_count: int, job_id: str = None) -> dict:
+        """Enqueue a job, or raise QueueFullError when the backlog is full"""
+        job_id = job_id or str(uuid.uuid4())
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                raise QueueFullError(f"{queued} jobs already queued")
+            conn.execute(
+                """
+                INSERT INTO jobs (id, user_id, status, file_path, file_type, tone, length,
+                                  hashtag_count, reservation, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, user_id, QUEUED, file_path, file_type, tone, length,
+                 hashtag_count, json.dumps(reservation) if reservation else None, time.time())
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict:
+        with self._connection() as conn:
+            return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def claim(self, worker_pid: int) -> dict:
+        """Mark the oldest queued job as running and return it (None if idle)"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            started_at = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker_pid = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, started_at, worker_pid, row["id"])
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        job = self._row(row)
+        job["status"] = RUNNING
+        job["started_at"] = started_at
+        return job
+
+    def complete(self, job_id: str, result):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (SUCCEEDED, json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+
+    def requeue_running(self, worker_pid: int = None) -> int:
+        """Put jobs interrupted by a worker crash or restart back in the queue
+
+        Jobs that already used up JOBS_MAX_ATTEMPTS are failed instead, and their
+        caption reservation is given back.
+        """
+        where = "status = ?"
+        params = [RUNNING]
+        if worker_pid is not None:
+            where += " AND worker_pid = ?"
+            params.append(worker_pid)
+        conn = self._connect()
+        try:
+            # Select and fail exhausted jobs in one transaction so only this call releases their quota
+            conn.execute("BEGIN IMMEDIATE")
+            exhausted = [self._row(row) for row in conn.execute(
+                f"SELECT * FROM jobs WHERE {where} AND attempts >= ?", params + [JOBS_MAX_ATTEMPTS]
+            ).fetchall()]
+            for job in exhausted:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (FAILED, "Worker exited while processing this job", time.time(), job["id"])
+                )
+            requeued = conn.execute(
+                f"UPDATE jobs SET status = ?, started_at = NULL, worker_pid = NULL WHERE {where}",
+                [QUEUED] + params
+            ).rowcount
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        # Outside the transaction: releases are network calls to the auth service
+        for job in exhausted:
+            if job.get("reservation"):
+                release_caption_quota(job["user_id"], job["reservation"])
+        return requeued
+
+    def purge_finished(self, older_than_seconds: int) -> int:
+        cutoff = time.time() - older_than_seconds
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, cutoff)
+            ).rowcount
+
+    def counts(self) -> dict:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        counts.update({status: n for status, n in rows})
+        counts["max_queued"] = self.max_queued
+        return counts
+
+
+def public_job(job: dict) -> dict:
+    view = {field: job.get(field) for field in PUBLIC_FIELDS}
+    if view["result"] is not None:
+        view["result"] = json.loads(view["result"])
+    return view
+
+
+job_store = JobStore(JOBS_DB_PATH, JOBS_MAX_QUEUED)
@@ -0,0 +1,138 @@
+"""
+Representative keyframes for video analysis.
+
+One ffmpeg run decodes only the stream's keyframes (-skip_frame nokey), keeps
+the first one and every one that starts a new scene, and scales them down to
+VIDEO_KEYFRAME_EDGE. Near-identical frames are dropped by perceptual hash
+(dHash) and at most VIDEO_KEYFRAMES_MAX frames, spread evenly over the
+remaining ones, are returned as JPEG bytes.
+"""
+import glob
+import os
+import subprocess
+import tempfile
+import threading
+
+from dotenv import load_dotenv
+from PIL import Image
+
+load_dotenv()
+
+VIDEO_KEYFRAMES_MAX = int(os.getenv("VIDEO_KEYFRAMES_MAX", "6"))
+# ffmpeg scene score (0-1) above which a keyframe counts as a new scene
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.3"))
+VIDEO_KEYFRAME_EDGE = int(os.getenv("VIDEO_KEYFRAME_EDGE", "768"))
+# Frames whose 64-bit dHashes differ in at most this many bits are duplicates
+VIDEO_KEYFRAME_HASH_DISTANCE = int(os.getenv("VIDEO_KEYFRAME_HASH_DISTANCE", "10"))
+# Only the first N seconds are scanned for scene changes (0 = whole video)
+VIDEO_KEYFRAME_SCAN_SECONDS = float(os.getenv("VIDEO_KEYFRAME_SCAN_SECONDS", "300"))
+
+# Scene candidates kept before deduplication
+CANDIDATE_FACTOR = 4
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale copy"""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def dedupe_frames(frames: list, max_distance: int = VIDEO_KEYFRAME_HASH_DISTANCE) -> list:
+    """Drop frames that look like one already kept; frames are (hash, data) pairs"""
+    kept = []
+    for frame_hash, data in frames:
+        if all(hamming(frame_hash, kept_hash) > max_distance for kept_hash, _ in kept):
+            kept.append((frame_hash, data))
+    return kept
+
+
+def spread(items: list, count: int) -> list:
+    """count items evenly spaced over the list, first and last included"""
+    if len(items) <= count:
+        return items
+    if count == 1:
+        return items[:1]
+    step = (len(items) - 1) / (count - 1)
+    return [items[round(i * step)] for i in range(count)]
+
+
+class KeyframeStats:
+    """Counters for /stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "videos": 0,
+            "candidates": 0,
+            "duplicates_dropped": 0,
+            "frames_sent": 0,
+            "failures": 0,
+        }
+
+    def record(self, candidates: int, unique: int, sent: int):
+        with self._lock:
+            self._stats["videos"] += 1
+            self._stats["candidates"] += candidates
+            self._stats["duplicates_dropped"] += candidates - unique
+            self._stats["frames_sent"] += sent
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+keyframe_stats = KeyframeStats()
+
+
+def extract_keyframes(file_path: str, timeout: float = None, max_frames: int = VIDEO_KEYFRAMES_MAX) -> list:
+    """Up to max_frames distinct scene keyframes as JPEG bytes, in time order"""
+    scale = (f"scale={VIDEO_KEYFRAME_EDGE}:{VIDEO_KEYFRAME_EDGE}:force_original_aspect_ratio=decrease")
+    with tempfile.TemporaryDirectory(prefix="keyframes-") as directory:
+        cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-skip_frame", "nokey", "-i", file_path]
+        if VIDEO_KEYFRAME_SCAN_SECONDS > 0:
+            cmd += ["-t", str(VIDEO_KEYFRAME_SCAN_SECONDS)]
+        cmd += [
+            "-an", "-vf", f"select='eq(n,0)+gt(scene,{VIDEO_SCENE_THRESHOLD})',{scale}",
+            "-fps_mode", "vfr", "-frames:v", str(max_frames * CANDIDATE_FACTOR),
+            "-q:v", "4", os.path.join(directory, "frame_%03d.jpg"),
+        ]
+        try:
+            subprocess.run(cmd, capture_output=True, check=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # Keep whatever was written before the deadline
+            print(f"Keyframe extraction timed out after {timeout:.1f}s")
+        except subprocess.CalledProcessError as e:
+            keyframe_stats.record_failure()
+            print(f"Keyframe extraction failed: {e.stderr.decode(errors='ignore')[-500:]}")
+            return []
+
+        frames = []
+        for path in sorted(glob.glob(os.path.join(directory, "frame_*.jpg"))):
+            try:
+                with Image.open(path) as image:
+                    frame_hash = dhash(image)
+                with open(path, "rb") as f:
+                    frames.append((frame_hash, f.read()))
+            except OSError:
+                # A frame cut short by the timeout
+                continue
+
+    unique = dedupe_frames(frames)
+    selected = [data for _, data in spread(unique, max_frames)]
+    keyframe_stats.record(len(frames), len(unique), len(selected))
+    return selected
@@ -0,0 +1,347 @@
+"""
+Prometheus metrics for /metrics.
+
+The numbers come from the same objects that feed /stats. metrics.py renders
+them in the Prometheus text format without a client library. There are two
+kinds of collector:
+
+- per-process collectors: requests, stages, admission gates, model calls,
+  the auth client, the caption cache. Under gunicorn each worker writes these
+  families to METRICS_DIR every METRICS_FLUSH_SECONDS, and /metrics adds up
+  every worker's file. A scrape that lands on any worker therefore sees the
+  whole pod, and gauges such as queued callers are pod totals. When a worker
+  exits, the master folds its counters and histograms into dead.json so the
+  totals never go backwards. Its gauges are dropped.
+- shared collectors: state every process already sees, such as the job queue
+  in SQLite. These are read once, by the process answering the scrape.
+
+Without METRICS_DIR (the dev server) /metrics only shows the process that
+answers it.
+"""
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEAD_PROCESSES_FILE = "dead.json"
+
+
+def family(name: str, kind: str, help_text: str, samples: list) -> dict:
+    """One metric: samples are [labels, value]; a histogram's value comes from histogram_value()"""
+    return {"name": name, "type": kind, "help": help_text, "samples": samples}
+
+
+def histogram_value(stats: dict) -> dict:
+    """Seconds-based histogram value from LatencyHistogram.stats()"""
+    return {
+        "buckets": {
+            bound if bound == "+Inf" else repr(float(bound) / 1000): count
+            for bound, count in stats["buckets_ms"].items()
+        },
+        "count": stats["count"],
+        "sum": stats["sum_ms"] / 1000,
+    }
+
+
+def merge(snapshots: list, gauges: bool = True) -> list:
+    """Add up the samples of several processes' families, label set by label set"""
+    merged = {}
+    for families in snapshots:
+        for metric in families:
+            if metric["type"] == "gauge" and not gauges:
+                continue
+            target = merged.setdefault(metric["name"], {**metric, "samples": {}})
+            for labels, value in metric["samples"]:
+                key = tuple(sorted(labels.items()))
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = (labels, value)
+                elif isinstance(value, dict):
+                    buckets = dict(current[1]["buckets"])
+                    for bound, count in value["buckets"].items():
+                        buckets[bound] = buckets.get(bound, 0) + count
+                    target["samples"][key] = (labels, {
+                        "buckets": buckets,
+                        "count": current[1]["count"] + value["count"],
+                        "sum": current[1]["sum"] + value["sum"],
+                    })
+                else:
+                    target["samples"][key] = (labels, current[1] + value)
+    return [{**metric, "samples": list(metric["samples"].values())} for metric in merged.values()]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(families: list) -> str:
+    """Prometheus text exposition format (0.0.4)"""
+    lines = []
+    for metric in sorted(families, key=lambda m: m["name"]):
+        name = metric["name"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in metric["samples"]:
+            if metric["type"] == "histogram":
+                for bound, count in value["buckets"].items():
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(float(value['sum']))}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """Collectors for /metrics, added up across the pod's worker processes"""
+
+    def __init__(self, directory: str = METRICS_DIR, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._collectors = []
+        self._shared_collectors = []
+        # The flusher and scrapes both write this process's snapshot
+        self._write_lock = threading.Lock()
+
+    def register(self, collector=None, shared: bool = False):
+        """Add a collector (also usable as a decorator); collector() returns a list of family() dicts"""
+        if collector is None:
+            return lambda fn: self.register(fn, shared=shared)
+        (self._shared_collectors if shared else self._collectors).append(collector)
+        return collector
+
+    def collect(self, collectors: list) -> list:
+        families = []
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector {collector.__name__} failed: {str(e)}")
+        return families
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def _write(self, path: str, families: list):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(families, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> list:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def write_snapshot(self):
+        """Write this process's families for the other workers' scrapes"""
+        if self.directory:
+            with self._write_lock:
+                self._write(self._path(os.getpid()), self.collect(self._collectors))
+
+    def start_flusher(self):
+        """Write a snapshot every flush_seconds on a daemon thread (each worker, after fork)"""
+        if not self.directory:
+            return None
+
+        def flush():
+            while True:
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    print(f"Could not write metrics snapshot: {str(e)}")
+                time.sleep(self.flush_seconds)
+
+        thread = threading.Thread(target=flush, name="metrics-flush", daemon=True)
+        thread.start()
+        return thread
+
+    def reset(self):
+        """Start from an empty METRICS_DIR (gunicorn master, before forking)"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") or name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+
+    def process_exited(self, pid: int):
+        """Keep an exited worker's counters and histograms (gunicorn master, child_exit)"""
+        if not self.directory:
+            return
+        path = self._path(pid)
+        if not os.path.exists(path):
+            return
+        dead_path = os.path.join(self.directory, DEAD_PROCESSES_FILE)
+        dead = merge([self._read(dead_path), self._read(path)], gauges=False)
+        self._write(dead_path, dead)
+        os.remove(path)
+
+    def families(self) -> list:
+        if not self.directory:
+            return self.collect(self._collectors) + self.collect(self._shared_collectors)
+        # Fresh numbers for this process; the other workers' files are at most flush_seconds old
+        self.write_snapshot()
+        snapshots = [
+            self._read(os.path.join(self.directory, name))
+            for name in sorted(os.listdir(self.directory))
+            if name.endswith(".json")
+        ]
+        return merge(snapshots) + self.collect(self._shared_collectors)
+
+    def render(self) -> str:
+        return render(self.families())
+
+
+registry = MetricsRegistry()
+
+
+@registry.register
+def request_families() -> list:
+    from telemetry import request_metrics, stage_timings
+
+    counts, latency = request_metrics.snapshot()
+    return [
+        family("caption_http_requests_total", "counter", "HTTP requests by endpoint, method and status", [
+            [{"endpoint": endpoint, "method": method, "status": status}, count]
+            for (endpoint, method, status), count in sorted(counts.items())
+        ]),
+        family("caption_http_request_duration_seconds", "histogram",
+               "Time from request start until the response was sent, streamed bodies included", [
+                   [{"endpoint": endpoint}, histogram_value(histogram.stats())]
+                   for endpoint, histogram in sorted(latency.items())
+               ]),
+        family("caption_stage_duration_seconds", "histogram", "Time spent in each stage of a request", [
+            [{"stage": name}, histogram_value(stats)] for name, stats in stage_timings.stats().items()
+        ]),
+    ]
+
+
+@registry.register
+def admission_families() -> list:
+    from admission import admission_stats
+
+    gates = admission_stats()
+    return [
+        family("caption_admission_in_use", "gauge", "Slots in use at each admission gate", [
+            [{"resource": name}, gate["in_use"]] for name, gate in gates.items()
+        ]),
+        family("caption_admission_queued", "gauge", "Callers waiting at each admission gate", [
+            [{"resource": name}, gate["queued"]] for name, gate in gates.items()
+        ]),
+        family("caption_admission_limit", "gauge", "Concurrent slots at each admission gate", [
+            [{"resource": name}, gate["limit"]] for name, gate in gates.items()
+        ]),
+        family("caption_admission_queue_limit", "gauge", "Callers allowed to wait at each admission gate", [
+            [{"resource": name}, gate["max_queue"]] for name, gate in gates.items()
+        ]),
+        family("caption_admission_admitted_total", "counter", "Callers given a slot", [
+            [{"resource": name}, gate["admitted"]] for name, gate in gates.items()
+        ]),
+        family("caption_admission_rejected_total", "counter",
+               "Callers turned away: queue_full (429) or timeout (503)", [
+                   [{"resource": name, "reason": reason}, gate[f"rejected_{reason}"]]
+                   for name, gate in gates.items() for reason in ("queue_full", "timeout")
+               ]),
+        family("caption_admission_wait_seconds", "histogram", "Time admitted callers waited for a slot", [
+            [{"resource": name}, histogram_value(gate["wait_ms"])] for name, gate in gates.items()
+        ]),
+    ]
+
+
+@registry.register
+def model_families() -> list:
+    from model_usage import model_usage
+
+    usage = model_usage.stats()
+    return [
+        family("caption_model_calls_total", "counter", "Gemini calls by kind", [
+            [{"kind": kind}, stats["calls"]] for kind, stats in sorted(usage.items())
+        ]),
+        family("caption_model_tokens_total", "counter", "Gemini prompt (input) and response (output) tokens", [
+            [{"kind": kind, "direction": direction}, stats[f"{direction}_tokens"]]
+            for kind, stats in sorted(usage.items()) for direction in ("input", "output")
+        ]),
+    ]
+
+
+@registry.register
+def upstream_families() -> list:
+    from auth_client import auth_service, token_cache
+
+    stats = auth_service.stats()
+    endpoints = stats["endpoints"]
+    cache = token_cache.stats()
+    return [
+        family("caption_upstream_request_duration_seconds", "histogram", "Calls to the auth service by endpoint", [
+            [{"service": "auth", "endpoint": endpoint}, histogram_value(endpoint_stats["latency"])]
+            for endpoint, endpoint_stats in endpoints.items()
+        ]),
+        family("caption_upstream_errors_total", "counter", "Failed calls to the auth service (network or 5xx)", [
+            [{"service": "auth", "endpoint": endpoint}, endpoint_stats["errors"]]
+            for endpoint, endpoint_stats in endpoints.items()
+        ]),
+        family("caption_upstream_circuit_open", "gauge", "Workers whose circuit breaker to the service is open", [
+            [{"service": "auth"}, 1 if stats["circuit_breaker"]["state"] == "open" else 0]
+        ]),
+        family("caption_token_cache_lookups_total", "counter", "Token cache lookups", [
+            [{"result": "hit"}, cache["hits"]], [{"result": "miss"}, cache["misses"]]
+        ]),
+    ]
+
+
+@registry.register
+def pipeline_families() -> list:
+    from batch import batch_stats
+    from caption_cache import caption_cache
+    from streaming import response_timing
+
+    cache = caption_cache.stats()
+    streams = response_timing.stats()
+    batches = batch_stats.stats()
+    return [
+        family("caption_cache_lookups_total", "counter", "Result cache lookups by level", [
+            [{"level": level, "result": result}, cache[f"{level}_{result}"]]
+            for level in ("description", "caption") for result in ("hits", "misses")
+        ]),
+        family("caption_streams_total", "counter", "Streamed caption responses by outcome", [
+            [{"outcome": outcome}, streams[outcome]] for outcome in ("completed", "failed", "disconnected")
+        ]),
+        family("caption_batch_items_total", "counter", "Batch items by outcome", [
+            [{"outcome": outcome}, batches[outcome]] for outcome in ("succeeded", "failed")
+        ]),
+    ]
+
+
+# The job queue is one SQLite database for the whole pod
+@registry.register(shared=True)
+def job_families() -> list:
+    from jobs import job_store
+
+    counts = job_store.counts()
+    return [
+        family("caption_jobs", "gauge", "Caption jobs in the queue by status", [
+            [{"status": status}, count] for status, count in counts.items() if status != "max_queued"
+        ]),
+    ]
+
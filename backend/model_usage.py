@@ -0,0 +1,36 @@
+"""
+Gemini usage per kind of call.
+
+captioning.py records every model call here: latency and the prompt and
+response token counts Gemini reports. /stats shows the totals, and
+benchmarks/caption_mode_benchmark.py diffs them to compare the two-pass and
+single-pass image modes.
+"""
+import threading
+
+
+class ModelUsage:
+    """Calls, latency and tokens per kind of model call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def record(self, kind: str, elapsed_ms: float, input_tokens: int = 0, output_tokens: int = 0):
+        with self._lock:
+            usage = self._kinds.setdefault(kind, {"calls": 0, "total_ms": 0.0, "input_tokens": 0, "output_tokens": 0})
+            usage["calls"] += 1
+            usage["total_ms"] += elapsed_ms
+            usage["input_tokens"] += input_tokens
+            usage["output_tokens"] += output_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = {kind: dict(usage) for kind, usage in self._kinds.items()}
+        for usage in kinds.values():
+            usage["avg_ms"] = round(usage["total_ms"] / usage["calls"], 3) if usage["calls"] else 0.0
+            usage["total_ms"] = round(usage["total_ms"], 3)
+        return kinds
+
+
+model_usage = ModelUsage()
@@ -0,0 +1,100 @@
+"""
+On-demand sampling profiler for single requests.
+
+With PROFILING_ENABLED=1 and a PROFILE_TOKEN set, a request that sends
+`X-Profile: <PROFILE_TOKEN>` is profiled. A sampler thread records the stack
+of every thread working on that request (the handler thread and pool threads
+running in_context work, see telemetry.py) every PROFILE_INTERVAL_MS until
+the response has been sent, streamed bodies included. Other requests are not
+slowed down.
+
+Samples are written in the collapsed-stack format (one
+`thread;frame;frame;... count` line per distinct stack), which flamegraph.pl
+and speedscope read directly, to PROFILE_DIR/<request id>.folded. The request
+ID is in the response's X-Request-ID header.
+"""
+import hmac
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Profile"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# A profile stops here even if the response is still streaming
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "caption-profiles"))
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame) -> str:
+    """Root-first frame labels of one stack, ;-separated"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RequestProfiler:
+    """Samples the stacks of the threads working on one request"""
+
+    def __init__(self, trace, interval_ms: float = PROFILE_INTERVAL_MS,
+                 max_seconds: float = PROFILE_MAX_SECONDS, directory: str = PROFILE_DIR):
+        self.trace = trace
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.directory = directory
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        for thread_id in self.trace.active_threads():
+            frame = frames.get(thread_id)
+            if frame is not None:
+                self.samples[f"{names.get(thread_id, thread_id)};{collapse(frame)}"] += 1
+        self.sample_count += 1
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            self._sample()
+
+    def stop(self) -> str:
+        """Stop sampling and write the profile; returns its path"""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.trace.request_id}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profile of request {self.trace.request_id}: {self.sample_count} samples in {path}")
+        return path
+
+
+def wants_profile(headers) -> bool:
+    """True if profiling is on and the request asks for it with the right token"""
+    if not PROFILING_ENABLED or not PROFILE_TOKEN:
+        return False
+    return hmac.compare_digest(headers.get(PROFILE_HEADER, "").encode(), PROFILE_TOKEN.encode())
@@ -0,0 +1,284 @@
+"""
+Versioned prompt templates and caption request validation.
+
+Every prompt captioning.py sends is a template registered here, along with
+the tone and length guides and the JSON schemas the model answers with. The
+registry is built and checked once at import: the fields each template uses
+must match the ones it declares, every tone needs a style and examples, and
+the instruction block for each tone/length pair is rendered up front.
+A broken template therefore fails at startup, not on a request.
+
+PROMPT_VERSION is part of the caption cache key; bump it whenever a template,
+guide or schema changes so cached captions from the old prompt are not
+served.
+
+caption_options() validates a request's form (fileType, tone, length,
+hashtagCount) before any quota is reserved or model called.
+"""
+import json
+import string
+
+PROMPT_VERSION = "2"
+
+CAPTIONS_PER_REQUEST = 5
+HASHTAG_COUNT_MAX = 30
+FILE_TYPES = ("image", "video")
+
+LENGTH_GUIDES = {
+    "short": "50-80 characters",
+    "medium": "120-150 characters",
+    "long": "200-250 characters",
+}
+
+TONE_GUIDES = {
+    "formal": {
+        "style": "Polished, respectful, and business-like. Focus on professionalism and clear communication.",
+        "note": "Maintain professionalism.",
+        "examples": [
+            "This serene landscape showcases the beauty of nature's harmony.",
+            "An extraordinary event that highlights collaboration and shared success.",
+            "A timeless architectural marvel, exemplifying elegance and precision.",
+        ],
+    },
+    "casual": {
+        "style": "Relaxed, conversational, and relatable. Use light emojis and everyday language.",
+        "note": "",
+        "examples": [
+            "Weekend vibes: A little coffee, a little sunshine, and a lot of good energy! ☀️☕",
+            "Just me, my favorite book, and the sound of rain. Couldn't ask for more 🌧️📚",
+            "When life gives you sunsets, you just sit back and enjoy 🌅",
+        ],
+    },
+    "professional": {
+        "style": "Inspiring, empowering, and goal-oriented. Focus on achievement and growth.",
+        "note": "",
+        "examples": [
+            "Breaking barriers and building a legacy – one step at a time. 💼",
+            "Success begins with a vision and grows through persistence and teamwork.",
+            "Shaping the future by embracing challenges and fostering innovation.",
+        ],
+    },
+    "friendly": {
+        "style": "Warm, engaging, and community-oriented. Encourage interaction and build connection.",
+        "note": "Include an engaging question.",
+        "examples": [
+            "Sharing this little slice of joy with you all! What's bringing you happiness today? 💛",
+            "This place has a piece of my heart ❤️ What's your favorite escape spot? 🌍",
+            "Moments like these are best enjoyed with friends. Who would you bring here? 👫",
+        ],
+    },
+    "humorous": {
+        "style": "Playful, witty, and fun. Use creative wordplay and appropriate emojis.",
+        "note": "Include a witty observation.",
+        "examples": [
+            "When life gives you lemons, trade them for pizza 🍕✨ Priorities, am I right?",
+            "Caught mid-dance move... The floor wasn't ready for my talent 💃🔥",
+            "If at first you don't succeed, order dessert and call it a win 🍰🎉",
+        ],
+    },
+}
+
+# One caption as the model returns it; hashtags without the leading #
+CAPTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "hashtags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["text", "hashtags"],
+}
+
+SCHEMAS = {
+    "captions": {"type": "array", "items": CAPTION_SCHEMA},
+    "packed_captions": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "content": {"type": "integer"},
+                "captions": {"type": "array", "items": CAPTION_SCHEMA},
+            },
+            "required": ["content", "captions"],
+        },
+    },
+    "single_pass": {
+        "type": "object",
+        "properties": {
+            "description": {"type": "string"},
+            "captions": {"type": "array", "items": CAPTION_SCHEMA},
+        },
+        "required": ["description", "captions"],
+    },
+}
+
+# Rendered once per tone/length pair; hashtag_count is filled in per request
+INSTRUCTIONS_TEMPLATE = """Tone: {tone} - {style}
+Examples of the tone:
+{examples}
+Requirements:
+- Each caption {length_guide} long, natural and unique; emojis only where they fit.{note}
+- Exactly {{hashtag_count}} relevant hashtags per caption, in "hashtags" without the # sign, not in "text"."""
+
+# name -> (template, fields it takes)
+TEMPLATES = {
+    "image_description": ("""Analyze this image in detail. Consider:
+1. Main subjects/people
+2. Actions/activities
+3. Setting/location
+4. Mood/atmosphere
+5. Colors and visual elements
+6. Any text or significant details""", set()),
+
+    "video_description": ("""These images are keyframes from one video, in order.
+{speech}
+
+Analyze this video in detail. Consider:
+1. Main subjects/people
+2. Actions/activities and how they develop across the frames
+3. Setting/location
+4. Mood/atmosphere
+5. Any on-screen text or significant details
+6. How the visuals relate to what is said""", {"speech"}),
+
+    "captions": ("""Content:
+{content_description}
+
+Write {caption_count} {tone} social media captions for this content.
+{instructions}""", {"content_description", "caption_count", "tone", "instructions"}),
+
+    "packed_captions": ("""Here are {content_count} separate pieces of content:
+
+{contents}
+
+Write {caption_count} {tone} social media captions for EACH piece of content, only from its own content.
+{instructions}
+Answer with one entry per piece of content, in order, with its number in "content".""",
+                        {"content_count", "contents", "caption_count", "tone", "instructions"}),
+
+    "single_pass": ("""Write {caption_count} {tone} social media captions for this image.
+{instructions}
+Also give "description": a short factual description of the image
+(main subjects, actions, setting, mood, any text), at most 80 words.""",
+                    {"caption_count", "tone", "instructions"}),
+}
+
+
+class InvalidCaptionRequest(ValueError):
+    """A caption request the registry cannot serve; answered with 400"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+def template_fields(template: str) -> set:
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+
+def escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptRegistry:
+    """Templates, guides and schemas, validated and pre-rendered once"""
+
+    def __init__(self, version: str, templates: dict, tones: dict, lengths: dict, schemas: dict):
+        for name, (template, fields) in templates.items():
+            used = template_fields(template)
+            if used != fields:
+                raise ValueError(f"Prompt template {name} uses {sorted(used)} but declares {sorted(fields)}")
+        for tone, guide in tones.items():
+            if not guide.get("style") or not guide.get("examples"):
+                raise ValueError(f"Tone {tone} needs a style and examples")
+        if template_fields(INSTRUCTIONS_TEMPLATE) - {"tone", "style", "examples", "length_guide", "note"}:
+            raise ValueError("Unexpected field in the instructions template")
+
+        self.version = version
+        self.templates = {name: template for name, (template, _) in templates.items()}
+        self.fields = {name: fields for name, (_, fields) in templates.items()}
+        self.schemas = schemas
+        self.tones = tuple(tones)
+        self.lengths = tuple(lengths)
+        self._instructions = {
+            (tone, length): INSTRUCTIONS_TEMPLATE.format(
+                tone=tone.upper(),
+                style=escape_braces(guide["style"]),
+                examples=escape_braces("\n".join(f"- {example}" for example in guide["examples"])),
+                length_guide=escape_braces(lengths[length]),
+                note=escape_braces(f" {guide['note']}" if guide.get("note") else ""),
+            ).rstrip()
+            for tone, guide in tones.items()
+            for length in lengths
+        }
+
+    def instructions(self, tone: str, length: str, hashtag_count: int) -> str:
+        return self._instructions[(tone, length)].format(hashtag_count=hashtag_count)
+
+    def render(self, name: str, **fields) -> str:
+        """Fill a template; tone, length and hashtag_count fill {instructions}"""
+        if "instructions" in self.fields[name]:
+            fields["instructions"] = self.instructions(
+                fields["tone"], fields.pop("length"), fields.pop("hashtag_count")
+            )
+            fields["tone"] = fields["tone"].upper()
+            fields.setdefault("caption_count", CAPTIONS_PER_REQUEST)
+        missing = self.fields[name] - set(fields)
+        if missing:
+            raise ValueError(f"Prompt template {name} is missing {sorted(missing)}")
+        return self.templates[name].format(**fields)
+
+    def validate(self, file_type: str, tone: str, length: str, hashtag_count) -> dict:
+        """Normalized caption options, or InvalidCaptionRequest"""
+        if file_type not in FILE_TYPES:
+            raise InvalidCaptionRequest(f"fileType must be one of: {', '.join(FILE_TYPES)}")
+        if tone not in self.tones:
+            raise InvalidCaptionRequest(f"tone must be one of: {', '.join(self.tones)}")
+        if length not in self.lengths:
+            raise InvalidCaptionRequest(f"length must be one of: {', '.join(self.lengths)}")
+        try:
+            hashtag_count = int(hashtag_count)
+        except (TypeError, ValueError):
+            raise InvalidCaptionRequest("hashtagCount must be a whole number")
+        if not 0 <= hashtag_count <= HASHTAG_COUNT_MAX:
+            raise InvalidCaptionRequest(f"hashtagCount must be between 0 and {HASHTAG_COUNT_MAX}")
+        return {"file_type": file_type, "tone": tone, "length": length, "hashtag_count": hashtag_count}
+
+
+prompt_registry = PromptRegistry(PROMPT_VERSION, TEMPLATES, TONE_GUIDES, LENGTH_GUIDES, SCHEMAS)
+
+
+def caption_options(form, default_file_type: str = "image") -> dict:
+    """Validated fileType, tone, length and hashtagCount from a request form"""
+    return prompt_registry.validate(
+        form.get("fileType", default_file_type),
+        form.get("tone", "casual"),
+        form.get("length", "medium"),
+        form.get("hashtagCount", 5),
+    )
+
+
+def normalize_captions(captions, hashtag_count: int) -> list:
+    """[{text, hashtags}] from a structured response; hashtags without #, at most hashtag_count"""
+    if not isinstance(captions, list):
+        raise ValueError("captions is not a list")
+    normalized = []
+    for caption in captions:
+        if not isinstance(caption, dict) or not str(caption.get("text", "")).strip():
+            continue
+        tags = [str(tag).strip().lstrip("#").replace(" ", "") for tag in caption.get("hashtags") or []]
+        normalized.append({
+            "text": str(caption["text"]).strip(),
+            "hashtags": [tag for tag in tags if tag][:hashtag_count],
+        })
+    if not normalized:
+        raise ValueError("no captions in the response")
+    return normalized
+
+
+def parse_json(text: str):
+    """The JSON in a model response (tolerates a markdown code fence around it)"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("\n") + 1:] if "\n" in text else text
+    return json.loads(text)
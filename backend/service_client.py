@@ -0,0 +1,193 @@
+"""
+Shared HTTP client for backend -> service calls.
+
+One keep-alive requests.Session per upstream service, with a sized connection
+pool, split connect/read timeouts, a circuit breaker that fails fast while the
+upstream is unhealthy, per-endpoint latency histograms, and a hook for headers
+every call carries (the request ID).
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open probe -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # Seconds from an arbitrary origin; tests pass a fake
+        self.clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Let exactly one request through to test the upstream
+                self._probe_in_flight = True
+                return
+            self.rejected += 1
+            raise CircuitOpenError("Circuit open: upstream service is failing")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyHistogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms: float):
+        with self._lock:
+            self.count += 1
+            self.sum_ms += elapsed_ms
+            for i, bound in enumerate(self.buckets_ms):
+                if elapsed_ms <= bound:
+                    self.counts[i] += 1
+                    return
+            self.counts[-1] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, n in zip(list(self.buckets_ms) + ["+Inf"], self.counts):
+                cumulative += n
+                buckets[str(bound)] = cumulative
+            return {
+                "count": self.count,
+                "sum_ms": round(self.sum_ms, 3),
+                "avg_ms": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+                "buckets_ms": buckets,
+            }
+
+
+class ServiceClient:
+    """Connection-pooled client for one upstream service"""
+
+    def __init__(self, base_url: str, pool_size: int, connect_timeout: float,
+                 read_timeout: float, failure_threshold: int, reset_timeout: float, header_hook=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # Returns headers added to every call, e.g. the ID of the request being served
+        self.header_hook = header_hook
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, endpoint: str) -> LatencyHistogram:
+        with self._lock:
+            if endpoint not in self._histograms:
+                self._histograms[endpoint] = LatencyHistogram()
+            return self._histograms[endpoint]
+
+    def _count_error(self, endpoint: str):
+        with self._lock:
+            self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send a request; any exception (connection errors included) and 5xx count against the breaker"""
+        self.breaker.before_call()
+        start = time.perf_counter()
+        try:
+            # Inside the try: whatever raises here must still end a half-open probe
+            kwargs.setdefault("timeout", self.timeout)
+            if self.header_hook:
+                kwargs["headers"] = {**self.header_hook(), **(kwargs.get("headers") or {})}
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except Exception:
+            self._histogram(path).observe((time.perf_counter() - start) * 1000)
+            self._count_error(path)
+            self.breaker.record_failure()
+            raise
+        self._histogram(path).observe((time.perf_counter() - start) * 1000)
+
+        if response.status_code >= 500:
+            self._count_error(path)
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            endpoints = sorted(self._histograms)
+            errors = dict(self._errors)
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "connect_timeout": self.timeout[0],
+            "read_timeout": self.timeout[1],
+            "circuit_breaker": self.breaker.stats(),
+            "endpoints": {
+                endpoint: {
+                    "errors": errors.get(endpoint, 0),
+                    "latency": self._histograms[endpoint].stats(),
+                }
+                for endpoint in endpoints
+            },
+        }
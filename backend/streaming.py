@@ -0,0 +1,127 @@
+"""
+Server-Sent Events for /generate-captions/stream.
+
+The synchronous endpoint answers only once the whole caption response is
+back from Gemini. The streaming variant sends events as the work
+progresses:
+
+    event: status    {"stage": "uploaded" | "analyzed" | "generating"}
+    event: caption   {"index": 0, "text": "...", "hashtags": [...]}  one per caption
+    event: done      {"captions": [{"text": "...", "hashtags": [...]}, ...]}
+    event: error     {"error": "..."}  plus "retry_after" when the pod is saturated
+
+Content analysis runs on STREAM_ANALYSIS_THREADS so the response can send an
+SSE comment every SSE_HEARTBEAT_SECONDS while it waits, which keeps proxies
+from closing an idle connection during a long video. Each yielded event is
+one chunk on the wire.
+
+Captions are sent one by one as soon as each is complete in Gemini's
+streamed JSON (captioning.stream_captions).
+
+ResponseTiming records time to first byte and to first caption for
+streams, next to the total time of synchronous requests, all measured from
+when the view starts (the upload has been received).
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from dotenv import load_dotenv
+
+from admission import Saturated
+from service_client import LatencyHistogram
+from telemetry import in_context
+
+load_dotenv()
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+STREAM_ANALYSIS_THREADS = int(os.getenv("STREAM_ANALYSIS_THREADS", "8"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Ask reverse proxies not to buffer the stream
+    "X-Accel-Buffering": "no",
+}
+
+analysis_executor = ThreadPoolExecutor(max_workers=STREAM_ANALYSIS_THREADS, thread_name_prefix="stream-analysis")
+
+
+class ResponseTiming:
+    """Caption response latencies for /stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"streams": 0, "completed": 0, "failed": 0, "disconnected": 0}
+        self.stream_first_byte = LatencyHistogram()
+        self.stream_first_caption = LatencyHistogram()
+        self.stream_total = LatencyHistogram()
+        self.sync_total = LatencyHistogram()
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counts)
+        stats["stream_first_byte_ms"] = self.stream_first_byte.stats()
+        stats["stream_first_caption_ms"] = self.stream_first_caption.stats()
+        stats["stream_total_ms"] = self.stream_total.stats()
+        stats["sync_total_ms"] = self.sync_total.stats()
+        return stats
+
+
+response_timing = ResponseTiming()
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def caption_events(file_path: str, file_type: str, content_hash: str, tone: str, length: str,
+                   hashtag_count: int, started: float, on_complete=None):
+    """SSE events for one caption request; on_complete(ok) runs once the stream ends"""
+    from captioning import describe_content, stream_captions
+
+    def elapsed_ms():
+        return (time.perf_counter() - started) * 1000
+
+    response_timing.record("streams")
+    outcome = "disconnected"
+    try:
+        response_timing.stream_first_byte.observe(elapsed_ms())
+        yield sse_event("status", {"stage": "uploaded"})
+
+        analysis = analysis_executor.submit(in_context(describe_content), file_path, file_type, content_hash=content_hash)
+        while True:
+            try:
+                content_description = analysis.result(timeout=SSE_HEARTBEAT_SECONDS)
+                break
+            except FuturesTimeoutError:
+                yield ": keep-alive\n\n"
+        yield sse_event("status", {"stage": "analyzed"})
+
+        yield sse_event("status", {"stage": "generating"})
+        captions = []
+        for caption in stream_captions(content_description, tone, length, hashtag_count):
+            if not captions:
+                response_timing.stream_first_caption.observe(elapsed_ms())
+            yield sse_event("caption", {"index": len(captions), **caption})
+            captions.append(caption)
+
+        outcome = "completed"
+        yield sse_event("done", {"captions": captions})
+    except Saturated as e:
+        outcome = "failed"
+        yield sse_event("error", {"error": e.message, "retry_after": e.retry_after})
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        outcome = "failed"
+        yield sse_event("error", {"error": str(e)})
+    finally:
+        response_timing.record(outcome)
+        response_timing.stream_total.observe(elapsed_ms())
+        if on_complete:
+            on_complete(outcome == "completed")
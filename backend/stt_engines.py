@@ -0,0 +1,143 @@
+"""
+Speech-to-text engines behind one interface.
+
+Every engine takes 16 kHz mono float32 audio (see transcription.load_audio)
+and returns plain text, so the chunking and process pool in transcription.py
+work the same whichever engine is selected:
+
+- whisper         openai-whisper on PyTorch (FP32 on CPU)
+- faster-whisper  the same Whisper weights converted for CTranslate2, with
+                  int8 quantization by default; much faster on CPU and about
+                  half the memory
+- stub            returns a fixed transcript without loading a model; for
+                  tests, local development and pipeline benchmarks
+
+Select with STT_ENGINE; model size is WHISPER_MODEL and numeric precision is
+STT_COMPUTE_TYPE.
+"""
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SAMPLE_RATE = 16000
+
+# whisper | faster-whisper | stub
+STT_ENGINE = os.getenv("STT_ENGINE", "whisper").lower()
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
+# faster-whisper: int8 | int8_float32 | float32 ...; whisper: float32 | float16
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "")
+STT_DEVICE = os.getenv("STT_DEVICE", "cpu")
+STT_BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "5"))
+STT_STUB_TEXT = os.getenv("STT_STUB_TEXT", "This is a stub transcript.")
+
+DEFAULT_COMPUTE_TYPES = {
+    "whisper": "float32",
+    "faster-whisper": "int8",
+    "stub": "none",
+}
+
+
+class WhisperEngine:
+    """openai-whisper (PyTorch)"""
+
+    name = "whisper"
+    # Weights are plain tensors: a model loaded before fork is shared copy-on-write
+    fork_safe = True
+
+    def __init__(self, model_size: str, compute_type: str, device: str, threads: int = 0):
+        import whisper
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self._model = whisper.load_model(model_size, device=device)
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        result = self._model.transcribe(audio, fp16=self.compute_type == "float16")
+        return result["text"].strip()
+
+
+class FasterWhisperEngine:
+    """faster-whisper (CTranslate2), int8-quantized by default"""
+
+    name = "faster-whisper"
+    # CTranslate2 keeps native thread pools that do not survive fork
+    fork_safe = False
+
+    def __init__(self, model_size: str, compute_type: str, device: str, threads: int = 0):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("STT_ENGINE=faster-whisper requires the 'faster-whisper' package")
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self._model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=threads)
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        # segments is a generator; decoding happens while it is consumed
+        segments, _ = self._model.transcribe(audio, beam_size=STT_BEAM_SIZE)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class StubEngine:
+    """No model; returns STT_STUB_TEXT"""
+
+    name = "stub"
+    fork_safe = True
+
+    def __init__(self, model_size: str = "none", compute_type: str = "none", device: str = "cpu", threads: int = 0):
+        self.model_size = model_size
+        self.compute_type = compute_type
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        return STT_STUB_TEXT if len(audio) else ""
+
+
+ENGINES = {
+    WhisperEngine.name: WhisperEngine,
+    FasterWhisperEngine.name: FasterWhisperEngine,
+    StubEngine.name: StubEngine,
+}
+
+
+def create_engine(kind: str = STT_ENGINE, model_size: str = WHISPER_MODEL_NAME,
+                  compute_type: str = STT_COMPUTE_TYPE, device: str = STT_DEVICE, threads: int = 0):
+    """Load a speech-to-text engine; threads=0 lets the runtime pick"""
+    if kind not in ENGINES:
+        raise ValueError(f"Unknown STT_ENGINE: {kind}")
+    return ENGINES[kind](model_size, compute_type or DEFAULT_COMPUTE_TYPES[kind], device, threads)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(threads: int = 0):
+    """The configured engine, loaded once per process"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(threads=threads)
+    return _engine
+
+
+def loaded_engine():
+    """The engine if this process has loaded it, else None"""
+    return _engine
+
+
+def _reset_after_fork():
+    global _engine, _engine_lock
+    _engine_lock = threading.Lock()
+    if _engine is not None and not _engine.fork_safe:
+        _engine = None
+
+
+# Pre-fork servers (gunicorn --preload) load the engine in the master
+os.register_at_fork(after_in_child=_reset_after_fork)
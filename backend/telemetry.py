@@ -0,0 +1,220 @@
+"""
+Request IDs and per-stage timing.
+
+Every request gets an ID: the caller's X-Request-ID when it sends a usable
+one, a new one otherwise. It is echoed in the response, sent to the auth
+service with every call made on the request's behalf (auth_client.py), and
+printed with slow requests.
+
+stage(name) times one step of a request: auth, upload, quota_reserve,
+audio_decode, speech_to_text, keyframes, image_prep, gemini_upload_file,
+gemini_<kind> for each model call, admission_<resource> for time spent queued
+at an admission gate, ... Each timing goes to a per-stage histogram (exported
+on /metrics) and to the trace of the request it ran for. The trace becomes the
+response's Server-Timing header and the breakdown printed for requests slower
+than SLOW_REQUEST_MS.
+
+The trace follows the request through contextvars. Work handed to a thread
+pool stays attributed to the request only when it is submitted through
+in_context().
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from service_client import LatencyHistogram
+
+load_dotenv()
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Requests slower than this are printed with their stage breakdown; 0 turns it off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "10000"))
+
+# Stages range from a cache lookup to a whole-file transcription
+STAGE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+
+# Anything else from the caller (too long, odd characters) is replaced, not echoed
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+class RequestTrace:
+    """Stages timed for one request, and the threads currently working on it"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages = []
+        # Pool threads join and leave while the profiler reads it; only touch under _lock
+        self.threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, elapsed_ms: float):
+        with self._lock:
+            self.stages.append((name, elapsed_ms))
+
+    def enter_thread(self, thread_id: int):
+        with self._lock:
+            self.threads.add(thread_id)
+
+    def leave_thread(self, thread_id: int):
+        with self._lock:
+            self.threads.discard(thread_id)
+
+    def active_threads(self) -> set:
+        """Snapshot of the threads working on this request"""
+        with self._lock:
+            return set(self.threads)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def totals(self) -> dict:
+        """Stage -> (total ms, times run), in the order the stages first ran"""
+        totals = {}
+        with self._lock:
+            for name, elapsed_ms in self.stages:
+                total, count = totals.get(name, (0.0, 0))
+                totals[name] = (total + elapsed_ms, count + 1)
+        return totals
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={total:.1f}" for name, (total, _) in self.totals().items())
+
+    def summary(self) -> str:
+        return " ".join(
+            f"{name}={total:.0f}ms" + (f"x{count}" if count > 1 else "")
+            for name, (total, count) in self.totals().items()
+        )
+
+
+class StageTimings:
+    """Latency histogram per stage, across all requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name: str, elapsed_ms: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram(STAGE_BUCKETS_MS)
+        histogram.observe(elapsed_ms)
+
+    def histograms(self) -> dict:
+        with self._lock:
+            return dict(self._histograms)
+
+    def stats(self) -> dict:
+        return {name: histogram.stats() for name, histogram in sorted(self.histograms().items())}
+
+
+class RequestMetrics:
+    """Request counts by endpoint, method and status, and latency by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.latency = {}
+
+    def observe(self, endpoint: str, method: str, status: int, elapsed_ms: float):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = LatencyHistogram(STAGE_BUCKETS_MS)
+        histogram.observe(elapsed_ms)
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return dict(self.counts), dict(self.latency)
+
+
+stage_timings = StageTimings()
+request_metrics = RequestMetrics()
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def new_request_id(incoming: str = None) -> str:
+    """The caller's request ID if it is usable, a fresh one otherwise"""
+    if incoming and _REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id: str) -> RequestTrace:
+    """Make a new trace the current one for this thread (and work submitted in_context)"""
+    trace = RequestTrace(request_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def request_headers() -> dict:
+    """Headers that carry the current request ID to another service"""
+    request_id = current_request_id()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+def record_stage(name: str, elapsed_ms: float):
+    stage_timings.observe(name, elapsed_ms)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, elapsed_ms)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as one run of a stage (also when it raises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def in_context(fn):
+    """Wrap fn to run in a copy of the caller's context, e.g. for executor.submit
+
+    The thread running it counts as working on the caller's request while it
+    does (the profiler samples those threads).
+    """
+    context = contextvars.copy_context()
+    trace = context.get(_current_trace)
+
+    def run(*args, **kwargs):
+        if trace is None:
+            return context.run(fn, *args, **kwargs)
+        thread_id = threading.get_ident()
+        trace.enter_thread(thread_id)
+        try:
+            return context.run(fn, *args, **kwargs)
+        finally:
+            trace.leave_thread(thread_id)
+
+    return run
+
+
+def finish_request(trace: RequestTrace, endpoint: str, method: str, status: int):
+    """Record a request once its response has been sent (streamed bodies included)"""
+    elapsed_ms = trace.elapsed_ms()
+    request_metrics.observe(endpoint, method, status, elapsed_ms)
+    if SLOW_REQUEST_MS and elapsed_ms >= SLOW_REQUEST_MS:
+        print(f"Slow request {trace.request_id} {method} {endpoint} {status}: "
+              f"{elapsed_ms:.0f}ms {trace.summary()}")
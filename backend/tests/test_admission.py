@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+
+import admission
+import captioning
+from admission import AdmissionGate, Saturated, check_admission
+
+
+class Holder:
+    """Holds a gate slot on another thread until released"""
+
+    def __init__(self, gate: AdmissionGate):
+        self.gate = gate
+        self.acquired = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            with self.gate.slot():
+                self.acquired.set()
+                self.done.wait(5)
+        except Saturated as e:
+            self.error = e
+
+    def release(self):
+        self.done.set()
+        self.thread.join(5)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def gate():
+    return AdmissionGate("test", limit=1, max_queue=1, queue_timeout=0.2)
+
+
+def test_admits_up_to_the_limit_without_waiting():
+    gate = AdmissionGate("test", limit=2, max_queue=0, queue_timeout=1)
+    gate.acquire()
+    gate.acquire()
+    assert gate.stats()["in_use"] == 2
+    gate.release()
+    gate.release()
+    assert gate.stats()["admitted"] == 2
+
+
+def test_full_queue_is_rejected_at_once_with_429(gate):
+    holder = Holder(gate)
+    holder.acquired.wait(2)
+    waiter = Holder(gate)
+    wait_until(lambda: gate.waiting == 1)
+    assert gate.saturated()
+
+    started = time.monotonic()
+    with pytest.raises(Saturated) as rejected:
+        gate.acquire()
+    assert time.monotonic() - started < 0.1
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 1
+    assert gate.stats()["rejected_queue_full"] == 1
+
+    holder.release()
+    waiter.acquired.wait(2)
+    waiter.release()
+    assert waiter.error is None
+
+
+def test_queued_caller_times_out_with_503(gate):
+    holder = Holder(gate)
+    holder.acquired.wait(2)
+    started = time.monotonic()
+    with pytest.raises(Saturated) as timed_out:
+        gate.acquire()
+    assert 0.2 <= time.monotonic() - started < 1
+    assert timed_out.value.status_code == 503
+    stats = gate.stats()
+    assert (stats["rejected_timeout"], stats["queued"], stats["in_use"]) == (1, 0, 1)
+    holder.release()
+    assert gate.stats()["in_use"] == 0
+
+
+def test_queued_caller_gets_the_released_slot(gate):
+    holder = Holder(gate)
+    holder.acquired.wait(2)
+    threading.Timer(0.05, holder.release).start()
+    gate.acquire()
+    gate.release()
+    assert gate.stats()["admitted"] == 2
+    assert gate.stats()["wait_ms"]["count"] == 2
+
+
+def test_retry_after_rounds_the_queue_timeout_up():
+    assert AdmissionGate("test", 1, 1, queue_timeout=0.2).retry_after == 1
+    assert AdmissionGate("test", 1, 1, queue_timeout=30.5).retry_after == 31
+
+
+def test_check_admission_only_gates_videos_on_transcription(monkeypatch):
+    transcription = AdmissionGate("transcription", limit=0, max_queue=0, queue_timeout=5)
+    monkeypatch.setattr(admission, "transcription_gate", transcription)
+    monkeypatch.setattr(admission, "llm_gate", AdmissionGate("llm", limit=1, max_queue=0, queue_timeout=5))
+    check_admission("image")
+    with pytest.raises(Saturated) as rejected:
+        check_admission("video")
+    assert (rejected.value.resource, rejected.value.status_code, rejected.value.retry_after) == ("transcription", 429, 5)
+
+
+def test_saturated_response_carries_retry_after():
+    import app as backend_app
+
+    with backend_app.app.test_request_context():
+        response, status_code = backend_app.saturated(Saturated("llm", 503, 30))
+    assert status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert "llm" in response.get_json()["error"]
+
+
+def test_timed_out_transcription_keeps_its_slot_until_it_finishes(monkeypatch):
+    gate = AdmissionGate("transcription", limit=1, max_queue=0, queue_timeout=0.05)
+    finish = threading.Event()
+    finished = threading.Event()
+
+    def slow_transcribe(file_path):
+        finish.wait(5)
+        finished.set()
+        return {"text": "late"}
+
+    monkeypatch.setattr(captioning, "transcription_gate", gate)
+    monkeypatch.setattr(captioning, "VIDEO_ANALYSIS_BUDGET_SECONDS", 0.1)
+    monkeypatch.setattr(captioning.transcriber, "transcribe", slow_transcribe)
+    monkeypatch.setattr(captioning, "timed_keyframes", lambda file_path: [])
+
+    # No keyframes and no transcript in time: the request fails...
+    with pytest.raises(TimeoutError):
+        captioning.describe_video("/tmp/clip.mp4")
+    # ...but the transcription is still running, so its memory is still in use and the slot stays taken
+    assert gate.stats()["in_use"] == 1
+    with pytest.raises(Saturated):
+        gate.acquire()
+
+    finish.set()
+    finished.wait(2)
+    wait_until(lambda: gate.stats()["in_use"] == 0)
+    gate.acquire()
+    gate.release()
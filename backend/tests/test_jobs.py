@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+import jobs
+from jobs import FAILED, QUEUED, JobStore
+
+RESERVATION = {"reserved": 1, "period_start": "2026-10-01T00:00:00"}
+
+
+@pytest.fixture
+def released(monkeypatch):
+    calls = []
+    monkeypatch.setattr(jobs, "release_caption_quota", lambda user_id, reservation: calls.append((user_id, reservation)))
+    return calls
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"), max_queued=10)
+
+
+def submit(store, user_id="user-1"):
+    return store.submit(user_id, RESERVATION, "/tmp/upload", "video", "casual", "short", 3)
+
+
+def test_requeue_retries_until_max_attempts_then_fails_and_releases(store, released, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_MAX_ATTEMPTS", 2)
+    job = submit(store)
+
+    store.claim(worker_pid=1)
+    assert store.requeue_running(worker_pid=1) == 1
+    assert store.get(job["id"])["status"] == QUEUED
+    assert released == []
+
+    store.claim(worker_pid=2)
+    assert store.requeue_running() == 0
+    assert store.get(job["id"])["status"] == FAILED
+    assert released == [("user-1", RESERVATION)]
+
+    # Already failed: a later requeue must not release it again
+    store.requeue_running()
+    assert len(released) == 1
+
+
+def test_requeue_only_touches_the_given_worker(store, released):
+    first, second = submit(store, "user-1"), submit(store, "user-2")
+    store.claim(worker_pid=1)
+    store.claim(worker_pid=2)
+    assert store.requeue_running(worker_pid=2) == 1
+    assert store.get(first["id"])["status"] == "running"
+    assert store.get(second["id"])["status"] == QUEUED
+
+
+def test_no_bearer_token_is_stored(store):
+    job = submit(store)
+    assert "token" not in job
+
+
+def test_tokens_left_by_older_stores_are_cleared(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, status TEXT NOT NULL, file_path TEXT NOT NULL, "
+        "file_type TEXT NOT NULL, tone TEXT NOT NULL, length TEXT NOT NULL, hashtag_count INTEGER NOT NULL, "
+        "token TEXT, reservation TEXT, result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, "
+        "finished_at REAL, worker_pid INTEGER, attempts INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute(
+        "INSERT INTO jobs (id, user_id, status, file_path, file_type, tone, length, hashtag_count, token, created_at) "
+        "VALUES ('a', 'user-1', 'queued', '/tmp/upload', 'video', 'casual', 'short', 3, 'header.payload.sig', 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    JobStore(path, max_queued=10)
+    assert sqlite3.connect(path).execute("SELECT token FROM jobs").fetchall() == [(None,)]
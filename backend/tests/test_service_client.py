@@ -0,0 +1,175 @@
+import pytest
+import requests
+
+from service_client import CircuitBreaker, CircuitOpenError, ServiceClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeSession:
+    """Answers each request with the next item: a status code, or an exception to raise"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+
+
+def client_with(breaker, *outcomes, header_hook=None):
+    client = ServiceClient("http://auth", pool_size=1, connect_timeout=0.1, read_timeout=0.1,
+                           failure_threshold=breaker.failure_threshold, reset_timeout=breaker.reset_timeout,
+                           header_hook=header_hook)
+    client.breaker = breaker
+    client.session = FakeSession(*outcomes)
+    return client
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_stays_closed_below_threshold_and_success_resets_count(breaker):
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_opens_after_consecutive_failures_and_rejects(breaker):
+    trip(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_stays_open_until_reset_timeout(breaker, clock):
+    trip(breaker)
+    clock.advance(9.9)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.advance(0.1)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_probe_closes(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["consecutive_failures"] == 0
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_for_another_full_timeout(breaker, clock):
+    trip(breaker)
+    clock.advance(10)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["times_opened"] == 2
+    clock.advance(9)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.advance(1)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_request_counts_5xx_and_connection_errors_but_not_4xx(breaker):
+    client = client_with(breaker, 404, 500, requests.exceptions.ConnectionError("refused"), 503)
+    assert client.get("/validate-token").status_code == 404
+    assert client.get("/validate-token").status_code == 500
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get("/validate-token")
+    client.get("/validate-token")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.get("/validate-token")
+    assert client.session.calls == 4
+    assert client.stats()["endpoints"]["/validate-token"]["errors"] == 3
+
+
+@pytest.mark.parametrize("error", [ValueError("bad JSON"), RuntimeError("boom"), KeyError("x")])
+def test_probe_raising_non_requests_exception_reopens_and_probes_again(breaker, clock, error):
+    client = client_with(breaker, error, 200)
+    trip(breaker)
+    clock.advance(10)
+    with pytest.raises(type(error)):
+        client.get("/caption/reserve")
+    # The probe ended: the breaker is open again rather than stuck half-open with a probe in flight
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.advance(10)
+    assert client.get("/caption/reserve").status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_header_hook_error_ends_the_probe(breaker, clock):
+    def broken_hook():
+        raise RuntimeError("no request context")
+
+    client = client_with(breaker, 200, header_hook=broken_hook)
+    trip(breaker)
+    clock.advance(10)
+    with pytest.raises(RuntimeError):
+        client.get("/caption/reserve")
+    assert client.session.calls == 0
+    clock.advance(10)
+    client.header_hook = None
+    assert client.get("/caption/reserve").status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_non_requests_exceptions_count_towards_opening(breaker):
+    client = client_with(breaker, *[ValueError("x")] * 3)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            client.get("/caption/reserve")
+    assert breaker.state == CircuitBreaker.OPEN
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+import captioning
+import streaming
+from caption_cache import NullBackend
+from captioning import iter_json_array
+from streaming import caption_events
+
+CAPTIONS = [
+    {"text": 'She said "hello" and left', "hashtags": ["quote"]},
+    {"text": "Braces {inside} and [brackets], too", "hashtags": ["json", "edge"]},
+    {"text": "Back\\slash \\\\ and unicode é中", "hashtags": []},
+    {"text": "Nested", "hashtags": ["a"], "meta": {"score": [1, 2.5, {"deep": "}]"}]}},
+]
+PAYLOAD = json.dumps(CAPTIONS, indent=1, ensure_ascii=False)
+
+
+def chunked(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16, 64, len(PAYLOAD)])
+def test_iter_json_array_matches_json_loads_for_any_chunk_size(size):
+    assert list(iter_json_array(chunked(PAYLOAD, size))) == CAPTIONS
+
+
+def test_iter_json_array_handles_every_split_point():
+    text = json.dumps(CAPTIONS)
+    for cut in range(len(text) + 1):
+        assert list(iter_json_array([text[:cut], text[cut:]])) == CAPTIONS, cut
+
+
+@pytest.mark.parametrize("chunks, expected", [
+    # Escaped quote right at the boundary: the string must not end there
+    (['[{"text": "a \\', '"quoted\\" b"}]'], [{"text": 'a "quoted" b'}]),
+    # A closing brace inside a string does not end the element
+    (['[{"text": "x }', '", "n": 1}]'], [{"text": "x }", "n": 1}]),
+    (['["[not an', ' array]", "x"]'], ["[not an array]", "x"]),
+    # Preamble before the array (a code fence) and whitespace between elements
+    (["```json\n", "[ {\"a\": 1} ,\n\n {\"a\": 2} ]\n```"], [{"a": 1}, {"a": 2}]),
+    # Numbers split across chunks are not yielded early
+    (["[12", "3, 4.", "5, 6e", "2]"], [123, 4.5, 600.0]),
+    (["[true", ", nu", "ll]"], [True, None]),
+    (["[]"], []),
+    ([], []),
+], ids=["escaped-quote", "brace-in-string", "bracket-in-string", "preamble", "split-numbers", "literals",
+        "empty-array", "no-chunks"])
+def test_iter_json_array_edge_cases(chunks, expected):
+    assert list(iter_json_array(chunks)) == expected
+
+
+def test_iter_json_array_yields_each_element_before_reading_further():
+    read = []
+
+    def response():
+        for chunk in ['[{"text": "one"}', ', {"text": "tw', 'o"}]']:
+            read.append(chunk)
+            yield chunk
+
+    elements = iter_json_array(response())
+    assert next(elements) == {"text": "one"}
+    assert len(read) == 1
+    assert next(elements) == {"text": "two"}
+    assert len(read) == 3
+
+
+def test_iter_json_array_drops_a_truncated_last_element():
+    assert list(iter_json_array(['[{"text": "one"}, {"text": "tr'])) == [{"text": "one"}]
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Answers generate_content(stream=True) with the given text split into chunks"""
+
+    def __init__(self, text: str, size: int):
+        self.chunks = [FakeChunk(part) for part in chunked(text, size)]
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        assert stream
+        return iter(self.chunks)
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(captioning.caption_cache, "backend", NullBackend())
+    monkeypatch.setattr(captioning, "record_gemini_usage", lambda *args, **kwargs: None)
+
+
+@pytest.mark.parametrize("size", [1, 4, 9])
+def test_stream_captions_over_a_chunked_response(monkeypatch, no_cache, size):
+    monkeypatch.setattr(captioning, "gemini_model", FakeModel(PAYLOAD, size))
+    captions = list(captioning.stream_captions("A beach at sunset", "casual", "short", 1))
+    assert [caption["text"] for caption in captions] == [caption["text"] for caption in CAPTIONS]
+    assert captions[1]["hashtags"] == ["json"]
+
+
+def test_stream_captions_without_any_caption_raises(monkeypatch, no_cache):
+    monkeypatch.setattr(captioning, "gemini_model", FakeModel('[{"text": "  "}]', 3))
+    with pytest.raises(ValueError):
+        list(captioning.stream_captions("A beach at sunset", "casual", "short", 1))
+
+
+def parse_events(chunks) -> list:
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            continue
+        event, data = chunk.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def run_stream(monkeypatch, captions):
+    monkeypatch.setattr(captioning, "describe_content", lambda path, file_type, content_hash=None: "description")
+    monkeypatch.setattr(captioning, "stream_captions", lambda *args: captions())
+    outcomes = []
+    chunks = list(caption_events("/tmp/upload", "image", "hash", "casual", "short", 1, 0.0,
+                                 on_complete=outcomes.append))
+    return parse_events(chunks), outcomes
+
+
+def test_caption_events_sends_each_caption_then_done(monkeypatch):
+    def captions():
+        yield {"text": "one", "hashtags": []}
+        yield {"text": "two", "hashtags": ["x"]}
+
+    events, outcomes = run_stream(monkeypatch, captions)
+    assert [name for name, _ in events] == ["status", "status", "status", "caption", "caption", "done"]
+    assert events[4][1] == {"index": 1, "text": "two", "hashtags": ["x"]}
+    assert events[-1][1]["captions"][0]["text"] == "one"
+    assert outcomes == [True]
+
+
+def test_caption_events_reports_errors_and_completes_unsuccessfully(monkeypatch):
+    def captions():
+        yield {"text": "one", "hashtags": []}
+        raise ValueError("model went away")
+
+    events, outcomes = run_stream(monkeypatch, captions)
+    assert events[-1] == ("error", {"error": "model went away"})
+    assert outcomes == [False]
+
+
+def test_caption_events_counts_a_closed_stream_as_disconnected(monkeypatch):
+    monkeypatch.setattr(captioning, "describe_content", lambda path, file_type, content_hash=None: "description")
+    outcomes = []
+    events = caption_events("/tmp/upload", "image", "hash", "casual", "short", 1, 0.0, on_complete=outcomes.append)
+    next(events)
+    before = streaming.response_timing.stats()["disconnected"]
+    events.close()
+    assert outcomes == [False]
+    assert streaming.response_timing.stats()["disconnected"] == before + 1
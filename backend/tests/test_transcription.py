@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from stt_engines import SAMPLE_RATE
+from transcription import find_silences, plan_chunks
+
+# find_silences works in 30 ms frames; boundaries are exact to within one frame
+FRAME = int(0.03 * SAMPLE_RATE)
+
+
+def clip(*segments) -> np.ndarray:
+    """Concatenate ("tone" | "silence", seconds) segments into 16 kHz audio"""
+    parts = []
+    for kind, seconds in segments:
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        parts.append(0.3 * np.sin(2 * np.pi * 440 * t) if kind == "tone" else np.zeros_like(t))
+    return np.concatenate(parts).astype(np.float32)
+
+
+@pytest.mark.parametrize("segments, expected_seconds", [
+    ([("tone", 3)], []),
+    ([("silence", 1), ("tone", 2)], [(0, 1)]),
+    ([("tone", 2), ("silence", 1)], [(2, 3)]),
+    ([("tone", 1), ("silence", 0.5), ("tone", 1), ("silence", 0.5), ("tone", 1)], [(1, 1.5), (2.5, 3)]),
+    ([("silence", 2)], [(0, 2)]),
+    # Shorter than TRANSCRIBE_SILENCE_MIN_SECONDS (0.3 s): not a place to cut
+    ([("tone", 1), ("silence", 0.2), ("tone", 1)], []),
+], ids=["no-silence", "silence-at-start", "silence-at-end", "two-gaps", "all-silence", "gap-too-short"])
+def test_find_silences(segments, expected_seconds):
+    silences = find_silences(clip(*segments), min_seconds=0.3)
+    assert len(silences) == len(expected_seconds)
+    for (start, end), (expected_start, expected_end) in zip(silences, expected_seconds):
+        assert abs(start - expected_start * SAMPLE_RATE) <= FRAME
+        assert abs(end - expected_end * SAMPLE_RATE) <= FRAME
+        assert start < end
+
+
+def test_find_silences_on_a_clip_shorter_than_one_frame():
+    assert find_silences(np.zeros(FRAME - 1, dtype=np.float32)) == []
+
+
+TARGET = SAMPLE_RATE  # chunk_seconds=1 below
+
+
+@pytest.mark.parametrize("total, silences, expected", [
+    # Shorter than one chunk, and up to 1.5 chunks: never split
+    (TARGET // 2, [], [(0, TARGET // 2)]),
+    (TARGET * 3 // 2, [(10000, 14000)], [(0, TARGET * 3 // 2)]),
+    # No silence: cut at the target length, the remainder goes to the last chunk
+    (3 * TARGET, [], [(0, 16000), (16000, 32000), (32000, 48000)]),
+    (3 * TARGET + 5000, [], [(0, 16000), (16000, 32000), (32000, 53000)]),
+    # Silence at offset 0 or at the very end is outside every cut window
+    (3 * TARGET, [(0, 4000)], [(0, 16000), (16000, 32000), (32000, 48000)]),
+    (3 * TARGET, [(44000, 48000)], [(0, 16000), (16000, 32000), (32000, 48000)]),
+    # A silence within half a chunk of the target: cut in its middle, the next chunk starts there
+    (3 * TARGET, [(18000, 22000)], [(0, 20000), (20000, 36000), (36000, 48000)]),
+    # Of several candidates the one nearest the target wins
+    (30000, [(9000, 11000), (14000, 16000)], [(0, 15000), (15000, 30000)]),
+], ids=["shorter-than-chunk", "under-1.5-chunks", "no-silence", "no-silence-remainder",
+        "silence-at-start", "silence-at-end", "silence-near-target", "nearest-candidate"])
+def test_plan_chunks(total, silences, expected):
+    assert plan_chunks(total, silences, chunk_seconds=1) == expected
+
+
+@pytest.mark.parametrize("total", [1, TARGET, 7 * TARGET + 123, 40 * TARGET])
+def test_plan_chunks_covers_the_clip_without_gaps(total):
+    chunks = plan_chunks(total, [(s, s + 4000) for s in range(5000, total, 23000)], chunk_seconds=1)
+    assert chunks[0][0] == 0 and chunks[-1][1] == total
+    assert all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:]))
+    assert all(TARGET // 2 <= end - start <= TARGET * 3 // 2 for start, end in chunks[:-1])
+
+
+def test_clip_is_cut_in_its_silences():
+    audio = clip(("tone", 0.9), ("silence", 0.4), ("tone", 0.9), ("silence", 0.4), ("tone", 0.9))
+    chunks = plan_chunks(len(audio), find_silences(audio), chunk_seconds=1)
+    assert len(chunks) == 3
+    for (_, cut), gap_start in zip(chunks, (0.9, 2.2)):
+        assert gap_start * SAMPLE_RATE < cut < (gap_start + 0.4) * SAMPLE_RATE
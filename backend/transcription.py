@@ -0,0 +1,210 @@
+"""
+Chunked, parallel speech-to-text.
+
+The audio track is decoded once with ffmpeg to 16 kHz mono, split at silence
+boundaries into chunks of roughly TRANSCRIBE_CHUNK_SECONDS, and the chunks
+are transcribed on a process pool (one STT engine per process, see
+stt_engines.py) sized to the container's CPU limit. Texts are stitched back
+together in order.
+
+Captions rarely need a full transcript, so TRANSCRIBE_MAX_AUDIO_SECONDS stops
+decoding after that much audio; ffmpeg never reads the rest of the file.
+"""
+import atexit
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from stt_engines import SAMPLE_RATE, STT_COMPUTE_TYPE, STT_ENGINE, WHISPER_MODEL_NAME, get_engine, loaded_engine
+from telemetry import stage
+
+load_dotenv()
+
+# 0 = size the pool to the container CPU limit
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "0"))
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "30"))
+# 0 = transcribe the whole file
+TRANSCRIBE_MAX_AUDIO_SECONDS = float(os.getenv("TRANSCRIBE_MAX_AUDIO_SECONDS", "0"))
+SILENCE_THRESHOLD_DB = float(os.getenv("TRANSCRIBE_SILENCE_THRESHOLD_DB", "-35"))
+SILENCE_MIN_SECONDS = float(os.getenv("TRANSCRIBE_SILENCE_MIN_SECONDS", "0.3"))
+
+def cpu_limit() -> int:
+    """CPUs available to this container (cgroup quota), at least 1"""
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def load_audio(file_path: str, max_seconds: float = 0) -> np.ndarray:
+    """Decode the audio track to 16 kHz mono float32 with a single ffmpeg run"""
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", file_path]
+    if max_seconds and max_seconds > 0:
+        cmd += ["-t", str(max_seconds)]
+    cmd += ["-vn", "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode(errors='ignore')[-500:]}")
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+def find_silences(audio: np.ndarray, threshold_db: float = SILENCE_THRESHOLD_DB,
+                  min_seconds: float = SILENCE_MIN_SECONDS, frame_seconds: float = 0.03) -> list:
+    """(start, end) sample ranges where the signal stays below threshold_db"""
+    frame = int(frame_seconds * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10
+    silent = 20 * np.log10(rms) < threshold_db
+
+    silences = []
+    min_frames = max(1, int(min_seconds / frame_seconds))
+    run_start = None
+    for i, is_silent in enumerate(np.append(silent, False)):
+        if is_silent and run_start is None:
+            run_start = i
+        elif not is_silent and run_start is not None:
+            if i - run_start >= min_frames:
+                silences.append((run_start * frame, i * frame))
+            run_start = None
+    return silences
+
+
+def plan_chunks(total_samples: int, silences: list, chunk_seconds: float = TRANSCRIBE_CHUNK_SECONDS) -> list:
+    """Split [0, total_samples) into ~chunk_seconds pieces, cutting in silences where possible"""
+    target = int(chunk_seconds * SAMPLE_RATE)
+    if total_samples <= target * 1.5:
+        return [(0, total_samples)]
+
+    # Cut points are the middles of silent stretches
+    candidates = [(start + end) // 2 for start, end in silences]
+    chunks = []
+    start = 0
+    while total_samples - start > target * 1.5:
+        ideal = start + target
+        window = [c for c in candidates if start + target // 2 <= c <= start + target * 3 // 2]
+        cut = min(window, key=lambda c: abs(c - ideal)) if window else ideal
+        chunks.append((start, cut))
+        start = cut
+    chunks.append((start, total_samples))
+    return chunks
+
+
+def _init_pool_worker():
+    # One engine per pool process, each on one thread so N processes on N
+    # CPUs do not oversubscribe
+    get_engine(threads=1)
+
+
+def _pool_ready(hold_seconds: float) -> int:
+    # Runs after the initializer; holding the process busy makes the pool
+    # start a separate process for every warm-up task
+    time.sleep(hold_seconds)
+    return os.getpid()
+
+
+def _transcribe_chunk(audio: np.ndarray) -> str:
+    return get_engine().transcribe(audio)
+
+
+class ChunkedTranscriber:
+    """Transcribes a media file chunk by chunk, in parallel when workers > 1"""
+
+    def __init__(self, workers: int = TRANSCRIBE_WORKERS, chunk_seconds: float = TRANSCRIBE_CHUNK_SECONDS,
+                 max_audio_seconds: float = TRANSCRIBE_MAX_AUDIO_SECONDS):
+        self.workers = workers or cpu_limit()
+        self.chunk_seconds = chunk_seconds
+        self.max_audio_seconds = max_audio_seconds
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_pool_worker,
+                )
+            return self._pool
+
+    def warm_up(self, pool: bool = True):
+        """Load the model in this process and, with pool=True, in every pool process"""
+        get_engine()
+        if pool and self.workers > 1:
+            list(self._executor().map(_pool_ready, [0.5] * self.workers))
+
+    def _reset_after_fork(self):
+        # The parent's pool (its management thread and pipes) is unusable in a
+        # forked child; the child starts its own on first use
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def stats(self) -> dict:
+        # Never loads the engine: /stats must stay cheap while warming up
+        engine = loaded_engine()
+        return {
+            "engine": engine.name if engine else STT_ENGINE,
+            "model": engine.model_size if engine else WHISPER_MODEL_NAME,
+            "compute_type": engine.compute_type if engine else STT_COMPUTE_TYPE,
+            "loaded": engine is not None,
+            "workers": self.workers,
+            "chunk_seconds": self.chunk_seconds,
+            "max_audio_seconds": self.max_audio_seconds,
+        }
+
+    def transcribe(self, file_path: str, max_audio_seconds: float = None) -> dict:
+        limit = self.max_audio_seconds if max_audio_seconds is None else max_audio_seconds
+        with stage("audio_decode"):
+            audio = load_audio(file_path, limit)
+            chunks = plan_chunks(len(audio), find_silences(audio), self.chunk_seconds)
+        pieces = [audio[start:end] for start, end in chunks]
+
+        with stage("speech_to_text"):
+            if self.workers <= 1 or len(pieces) == 1:
+                texts = [_transcribe_chunk(piece) for piece in pieces]
+            else:
+                # map() preserves input order, so stitching is just a join
+                texts = list(self._executor().map(_transcribe_chunk, pieces))
+
+        return {
+            "text": " ".join(text for text in texts if text),
+            "chunks": len(pieces),
+            "audio_seconds": round(len(audio) / SAMPLE_RATE, 2),
+            "truncated": bool(limit) and len(audio) >= int(limit * SAMPLE_RATE) - SAMPLE_RATE // 10,
+        }
+
+
+transcriber = ChunkedTranscriber()
+atexit.register(transcriber.shutdown)
+os.register_at_fork(after_in_child=transcriber._reset_after_fork)
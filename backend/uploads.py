@@ -0,0 +1,161 @@
+"""
+Streaming multipart uploads.
+
+Werkzeug normally spools each uploaded file to an anonymous temp file, which
+the handlers then copied with file.save() before ffmpeg or Gemini read it a
+third time. UploadRequest replaces that spool file with SpooledUpload: the
+body is written once, straight to a named file under UPLOAD_SPOOL_DIR, and
+hashed and size-checked chunk by chunk as it arrives. Handlers pass
+upload.path to the pipeline and reuse upload.sha256 as the cache key.
+
+Requests whose Content-Length is over the limit are rejected by Flask
+(MAX_CONTENT_LENGTH, or the endpoint's entry in
+UploadRequest.endpoint_max_content_length) before the body is read;
+chunked uploads are cut off as soon as a file passes UPLOAD_MAX_BYTES.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from dotenv import load_dotenv
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from telemetry import stage
+
+load_dotenv()
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "caption-uploads"))
+# Room for the multipart boundaries and the small form fields
+UPLOAD_FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadStats:
+    """Upload counters for /stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "uploads": 0,
+            "bytes_received": 0,
+            "largest_bytes": 0,
+            "rejected_too_large": 0,
+        }
+
+    def record(self, size: int):
+        with self._lock:
+            self._stats["uploads"] += 1
+            self._stats["bytes_received"] += size
+            self._stats["largest_bytes"] = max(self._stats["largest_bytes"], size)
+
+    def record_rejected(self):
+        with self._lock:
+            self._stats["rejected_too_large"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_bytes"] = UPLOAD_MAX_BYTES
+        return stats
+
+
+upload_stats = UploadStats()
+
+
+class SpooledUpload:
+    """Writable file that hashes and counts bytes as werkzeug streams them in"""
+
+    def __init__(self, filename: str = None, directory: str = UPLOAD_SPOOL_DIR, max_bytes: int = UPLOAD_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        # Keep the extension: Gemini's upload_file guesses the MIME type from it
+        suffix = os.path.splitext(secure_filename(filename or ""))[1]
+        fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=directory)
+        self.name = self.path
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.moved = False
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"File is larger than {self.max_bytes} bytes")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def move_to(self, destination: str):
+        """Hand the file over to another owner (e.g. the job queue) without copying when possible"""
+        self._file.close()
+        try:
+            os.replace(self.path, destination)
+        except OSError:
+            # Different filesystem
+            shutil.move(self.path, destination)
+        self.path = self.name = destination
+        self.moved = True
+
+    def discard(self):
+        self._file.close()
+        if self.moved:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class UploadRequest(Request):
+    """Request that spools file parts through SpooledUpload"""
+
+    # Endpoint -> request body limit, for views that take more than one file
+    endpoint_max_content_length = {}
+
+    @property
+    def max_content_length(self):
+        limit = self.endpoint_max_content_length.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+    def _load_form_data(self):
+        # The first access to request.form/files receives and spools the whole body
+        if "form" in self.__dict__:
+            return super()._load_form_data()
+        with stage("upload"):
+            return super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = SpooledUpload(filename)
+        if not hasattr(self, "spooled_uploads"):
+            self.spooled_uploads = []
+        self.spooled_uploads.append(upload)
+        return upload
+
+    def detach_uploads(self) -> list:
+        """Take the spool files away from teardown, for a streamed response that outlives the view"""
+        uploads = getattr(self, "spooled_uploads", [])
+        self.spooled_uploads = []
+        return uploads
+
+    def discard_uploads(self):
+        """Delete spool files that were not moved elsewhere"""
+        for upload in getattr(self, "spooled_uploads", []):
+            upload.discard()
+
+
+def get_upload(file_storage) -> SpooledUpload:
+    """The spooled file behind a request.files entry, with its size recorded"""
+    upload = file_storage.stream
+    upload.flush()
+    upload_stats.record(upload.size)
+    return upload
@@ -0,0 +1,82 @@
+"""
+Model warm-up and readiness state.
+
+app.py imports only light modules so the process starts serving (and
+answering liveness probes) right away. The heavy work - phidata and
+google-generativeai behind captioning.py, the speech-to-text engine (torch
+for whisper) and the chunk pool - happens here, step by step:
+
+- dev server and gunicorn workers: on a background thread (start)
+- gunicorn master: synchronously before forking, so the weights are shared
+  copy-on-write (run, from gunicorn.conf.py)
+
+/ready reports each step's state and only returns 200 once all are ready.
+"""
+import threading
+import time
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+def _load_captioning():
+    import captioning  # noqa: F401
+
+
+def _load_speech_to_text():
+    from transcription import transcriber
+    transcriber.warm_up(pool=False)
+
+
+def _start_chunk_pool():
+    from transcription import transcriber
+    transcriber.warm_up()
+
+
+class ModelWarmup:
+    """Runs named loading steps in order and records how each one went"""
+
+    def __init__(self, steps: dict):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._state = {name: {"state": PENDING, "seconds": None, "error": None} for name in steps}
+
+    def _set(self, name: str, **fields):
+        with self._lock:
+            self._state[name].update(fields)
+
+    def run(self, names: list = None):
+        """Run the given steps (all by default) in this thread"""
+        for name in names or list(self.steps):
+            self._set(name, state=LOADING, error=None)
+            start = time.perf_counter()
+            try:
+                self.steps[name]()
+            except Exception as e:
+                print(f"Warm-up step {name} failed: {str(e)}")
+                self._set(name, state=FAILED, seconds=round(time.perf_counter() - start, 3), error=str(e))
+                continue
+            self._set(name, state=READY, seconds=round(time.perf_counter() - start, 3))
+
+    def start(self) -> threading.Thread:
+        """Run every step on a daemon thread; steps already done in this process finish at once"""
+        thread = threading.Thread(target=self.run, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(step["state"] == READY for step in self._state.values())
+
+    def status(self) -> dict:
+        with self._lock:
+            return {name: dict(step) for name, step in self._state.items()}
+
+
+model_warmup = ModelWarmup({
+    "captioning": _load_captioning,
+    "speech_to_text": _load_speech_to_text,
+    "chunk_pool": _start_chunk_pool,
+})
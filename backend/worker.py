@@ -0,0 +1,109 @@
+"""
+Worker pool for queued caption jobs (see jobs.py).
+
+Runs JOBS_WORKERS separate processes so CPU-bound transcriptions run
+in parallel instead of contending for one interpreter. Each process loads
+the models once, then claims and processes jobs until it is told to stop.
+On SIGTERM/SIGINT the pool stops claiming new jobs and waits for in-flight
+ones to finish.
+
+    python worker.py
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+
+from dotenv import load_dotenv
+
+from jobs import JOBS_DB_PATH, JOBS_MAX_QUEUED, JOBS_RETENTION_SECONDS, JobStore
+
+load_dotenv()
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1.0"))
+
+
+def process_job(store: JobStore, job: dict):
+    """Run the caption pipeline for one claimed job and record the outcome"""
+    # Imported here so only worker processes pay for loading the models
+    from auth_client import release_caption_quota
+    from captioning import caption_content
+
+    try:
+        captions = caption_content(
+            job["file_path"], job["file_type"], job["tone"], job["length"], job["hashtag_count"]
+        )
+        store.complete(job["id"], {"captions": captions})
+    except Exception as e:
+        print(f"Job {job['id']} failed: {str(e)}")
+        store.fail(job["id"], str(e))
+        if job.get("reservation"):
+            release_caption_quota(job["user_id"], job["reservation"])
+    finally:
+        shutil.rmtree(os.path.dirname(job["file_path"]), ignore_errors=True)
+
+
+def worker_loop(index: int, stop_event):
+    # The parent handles signals and sets stop_event; finish the current job first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from warmup import model_warmup
+    model_warmup.run()
+
+    store = JobStore(JOBS_DB_PATH, JOBS_MAX_QUEUED)
+    print(f"Worker {index} (pid {os.getpid()}) ready")
+    while not stop_event.is_set():
+        job = store.claim(os.getpid())
+        if job is None:
+            stop_event.wait(JOBS_POLL_INTERVAL)
+            continue
+        process_job(store, job)
+    print(f"Worker {index} stopped")
+
+
+def main():
+    store = JobStore(JOBS_DB_PATH, JOBS_MAX_QUEUED)
+    requeued = store.requeue_running()
+    if requeued:
+        print(f"Requeued {requeued} interrupted job(s)")
+
+    # spawn rather than fork: each worker gets a clean interpreter and its own model copy
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping workers after in-flight jobs finish...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    processes = []
+    for index in range(JOBS_WORKERS):
+        process = ctx.Process(target=worker_loop, args=(index, stop_event), name=f"caption-worker-{index}")
+        process.start()
+        processes.append(process)
+
+    last_purge = 0.0
+    while not stop_event.is_set():
+        if time.monotonic() - last_purge > 3600:
+            store.purge_finished(JOBS_RETENTION_SECONDS)
+            last_purge = time.monotonic()
+        # Replace workers that died (e.g. OOM-killed) so capacity stays constant
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stop_event.is_set():
+                print(f"Worker {i} exited with code {process.exitcode}; restarting")
+                store.requeue_running(worker_pid=process.pid)
+                processes[i] = ctx.Process(target=worker_loop, args=(i, stop_event), name=f"caption-worker-{i}")
+                processes[i].start()
+        stop_event.wait(JOBS_POLL_INTERVAL)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
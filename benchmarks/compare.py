@@ -0,0 +1,120 @@
+"""
+Compare two suite.py results files and flag regressions.
+
+    python benchmarks/compare.py baseline.json bench.json [--tolerance 0.25]
+
+For every endpoint in both files (run alone, and within the mix) a
+regression is any of:
+
+- p50, p95 or p99 latency up by more than --tolerance (relative), and by at
+  least MIN_LATENCY_DELTA_MS, so microsecond endpoints do not flap
+- throughput down by more than --tolerance
+- error rate up by more than MAX_ERROR_RATE_INCREASE (absolute)
+- peak RSS or PSS of either service up by more than --memory-tolerance
+
+Exits 1 if there is any. Results from different fake latencies or server
+settings are compared anyway, with a warning.
+"""
+import argparse
+import json
+import sys
+
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.15
+MIN_LATENCY_DELTA_MS = 5.0
+MAX_ERROR_RATE_INCREASE = 0.01
+
+LATENCIES = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def sections(results: dict) -> dict:
+    """(section, endpoint) -> endpoint results, for the lone runs and the mix"""
+    found = {("alone", name): data for name, data in results.get("endpoints", {}).items()}
+    mix = results.get("mix")
+    if mix:
+        found.update({("mix", name): data for name, data in mix.get("endpoints", {}).items()})
+        found[("mix", "total")] = mix
+    return found
+
+
+def relative(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def check(old: dict, new: dict, tolerance: float, memory_tolerance: float) -> list:
+    """Descriptions of the ways new is worse than old"""
+    problems = []
+    for key in LATENCIES:
+        if (relative(old[key], new[key]) > tolerance
+                and new[key] - old[key] >= MIN_LATENCY_DELTA_MS):
+            problems.append(f"{key} {old[key]} -> {new[key]} ({relative(old[key], new[key]):+.0%})")
+    if relative(old["throughput_rps"], new["throughput_rps"]) < -tolerance:
+        problems.append(f"throughput {old['throughput_rps']} -> {new['throughput_rps']} rps "
+                        f"({relative(old['throughput_rps'], new['throughput_rps']):+.0%})")
+    if new["error_rate"] - old["error_rate"] > MAX_ERROR_RATE_INCREASE:
+        problems.append(f"error rate {old['error_rate']:.2%} -> {new['error_rate']:.2%}")
+    for service, memory in new.get("memory", {}).items():
+        old_memory = old.get("memory", {}).get(service)
+        if not old_memory:
+            continue
+        for key in ("peak_rss_mb", "peak_pss_mb"):
+            if relative(old_memory[key], memory[key]) > memory_tolerance:
+                problems.append(f"{service} {key} {old_memory[key]} -> {memory[key]} "
+                                f"({relative(old_memory[key], memory[key]):+.0%})")
+    return problems
+
+
+def compare(baseline: dict, current: dict, tolerance: float = DEFAULT_TOLERANCE,
+            memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE) -> list:
+    """[(section, endpoint, [problems])] for every endpoint that regressed"""
+    old_sections, new_sections = sections(baseline), sections(current)
+    regressions = []
+    for key in sorted(old_sections.keys() & new_sections.keys()):
+        problems = check(old_sections[key], new_sections[key], tolerance, memory_tolerance)
+        if problems:
+            regressions.append((*key, problems))
+    return regressions
+
+
+def table(results: dict) -> str:
+    lines = [f"{'':6} {'endpoint':16} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} "
+             f"{'p99 ms':>9}  peak RSS/PSS MB"]
+    for (section, name), data in sections(results).items():
+        memory = " ".join(f"{service}={m['peak_rss_mb']:.0f}/{m['peak_pss_mb']:.0f}"
+                          for service, m in data.get("memory", {}).items())
+        lines.append(f"{section:6} {name:16} {data['requests']:>6} {data['errors']:>5} {data['throughput_rps']:>8} "
+                     f"{data['p50_ms']:>9} {data['p95_ms']:>9} {data['p99_ms']:>9}  {memory}")
+    return "\n".join(lines)
+
+
+def report(baseline: dict, current: dict, tolerance: float = DEFAULT_TOLERANCE,
+           memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE, file=sys.stdout) -> list:
+    """Print the comparison; returns the regressions"""
+    if baseline.get("config") != current.get("config"):
+        print("Warning: the runs used different settings; differences may not be regressions", file=file)
+    regressions = compare(baseline, current, tolerance, memory_tolerance)
+    if not regressions:
+        print(f"No regressions against the baseline (tolerance {tolerance:.0%}, "
+              f"memory {memory_tolerance:.0%})", file=file)
+    for section, name, problems in regressions:
+        print(f"REGRESSION {section} {name}: " + "; ".join(problems), file=file)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    sys.exit(1 if report(baseline, current, args.tolerance, args.memory_tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Offline stand-ins for everything the backend calls out to, for benchmarks.
+
+install() must run before captioning.py is imported (serve_backend.py does
+it before gunicorn preloads app.py). It puts fake `google.generativeai` and
+`phi` modules in sys.modules and replaces speech-to-text and keyframe
+extraction, so the backend runs end to end with no API key, model weights or
+ffmpeg:
+
+- GenerativeModel.generate_content answers after FAKE_GEMINI_LATENCY_MS
+  (FAKE_GEMINI_VISION_LATENCY_MS when the request has an image). Structured
+  requests get JSON that matches the schema from prompts.py, with as many
+  captions and hashtags as the prompt asks for; stream=True yields it in
+  FAKE_GEMINI_STREAM_CHUNKS pieces spread over the latency.
+- genai.upload_file takes FAKE_UPLOAD_FILE_LATENCY_MS.
+- Agent.run (video descriptions) takes FAKE_GEMINI_VISION_LATENCY_MS.
+- transcriber.transcribe takes FAKE_TRANSCRIBE_MS, timed as the usual
+  audio_decode and speech_to_text stages, and holds no audio in memory.
+- extract_keyframes takes FAKE_KEYFRAMES_MS and returns FAKE_KEYFRAMES small
+  JPEGs.
+
+Every latency varies by up to +/-FAKE_LATENCY_JITTER (a fraction). Token
+counts are estimated from text length so model usage metrics move as usual.
+Everything else (uploads, image preparation, the caches, admission gates,
+the auth service) is the real code.
+"""
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+import types
+import uuid
+
+FAKE_GEMINI_LATENCY_MS = float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800"))
+FAKE_GEMINI_VISION_LATENCY_MS = float(os.getenv("FAKE_GEMINI_VISION_LATENCY_MS", "1500"))
+FAKE_GEMINI_STREAM_CHUNKS = int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", "6"))
+FAKE_UPLOAD_FILE_LATENCY_MS = float(os.getenv("FAKE_UPLOAD_FILE_LATENCY_MS", "400"))
+FAKE_TRANSCRIBE_MS = float(os.getenv("FAKE_TRANSCRIBE_MS", "2000"))
+FAKE_KEYFRAMES_MS = float(os.getenv("FAKE_KEYFRAMES_MS", "300"))
+FAKE_KEYFRAMES = int(os.getenv("FAKE_KEYFRAMES", "6"))
+FAKE_LATENCY_JITTER = float(os.getenv("FAKE_LATENCY_JITTER", "0.25"))
+
+# Gemini's flat cost of one image part
+IMAGE_TOKENS = 258
+
+DESCRIPTION = (
+    "A person in a yellow raincoat walks a small dog along a wet city street at dusk. Shop windows glow "
+    "warm orange behind them and reflections of the lights stretch across the pavement. The mood is calm "
+    "and a little nostalgic; the colors are mostly deep blues with bright yellow accents. A cafe sign in "
+    "the background reads 'Open Late'. Light rain is still falling and a few passers-by carry umbrellas."
+)
+TRANSCRIPT = (
+    "Welcome back to the channel. Today we're walking through the old town after the rain, grabbing a "
+    "coffee and finding the best spots for evening photos."
+)
+CAPTION_TEXT = (
+    "Rainy evening strolls hit different when the whole street glows like this. Coffee in hand, "
+    "puppy in tow, no rush at all"
+)
+HASHTAGS = ["rainyday", "citywalk", "dogsofinstagram", "goldenhour", "streetphotography", "cozyvibes",
+            "eveningwalk", "coffeetime", "urbanexplorer", "moodygrams"]
+
+
+def pause(latency_ms: float):
+    if latency_ms > 0:
+        time.sleep(latency_ms * random.uniform(1 - FAKE_LATENCY_JITTER, 1 + FAKE_LATENCY_JITTER) / 1000)
+
+
+def tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def fake_captions(count: int, hashtag_count: int, tag: str = "") -> list:
+    return [
+        {"text": f"{CAPTION_TEXT} {tag}#{number}".strip(),
+         "hashtags": [f"{HASHTAGS[k % len(HASHTAGS)]}{k // len(HASHTAGS) or ''}" for k in range(hashtag_count)]}
+        for number in range(1, count + 1)
+    ]
+
+
+def prompt_number(pattern: str, prompt: str, default: int) -> int:
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def answer(prompt: str, schema) -> str:
+    """Response text for a prompt: plain text, or JSON for one of the registry's schemas"""
+    from prompts import SCHEMAS
+
+    if schema is None:
+        return DESCRIPTION
+    count = prompt_number(r"Write (\d+) ", prompt, 5)
+    hashtag_count = prompt_number(r"Exactly (\d+) relevant hashtags", prompt, 5)
+    if schema == SCHEMAS["packed_captions"]:
+        contents = prompt_number(r"Here are (\d+) separate", prompt, 1)
+        return json.dumps([
+            {"content": number, "captions": fake_captions(count, hashtag_count, tag=f"({number})")}
+            for number in range(1, contents + 1)
+        ])
+    if schema == SCHEMAS["single_pass"]:
+        return json.dumps({"description": DESCRIPTION, "captions": fake_captions(count, hashtag_count)})
+    return json.dumps(fake_captions(count, hashtag_count))
+
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class GenerateContentResponse:
+    """Complete response, or an iterator of chunks when streamed"""
+
+    def __init__(self, text: str, prompt_tokens: int, latency_ms: float, stream: bool = False):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt_tokens, tokens(text))
+        self._latency_ms = latency_ms
+        if not stream:
+            pause(latency_ms)
+
+    def __iter__(self):
+        pieces = max(1, FAKE_GEMINI_STREAM_CHUNKS)
+        size = -(-len(self.text) // pieces)
+        for start in range(0, len(self.text), size):
+            pause(self._latency_ms / pieces)
+            yield Chunk(self.text[start:start + size])
+
+
+class GenerationConfig:
+    def __init__(self, response_mime_type: str = None, response_schema=None, **kwargs):
+        self.response_mime_type = response_mime_type
+        self.response_schema = response_schema
+
+
+class UploadedFile:
+    def __init__(self, mime_type: str):
+        self.name = f"files/fake-{uuid.uuid4().hex[:12]}"
+        self.uri = f"https://generativelanguage.googleapis.com/v1beta/{self.name}"
+        self.mime_type = mime_type
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = "\n".join(part for part in parts if isinstance(part, str))
+        images = len(parts) - sum(isinstance(part, str) for part in parts)
+        schema = generation_config.response_schema if generation_config is not None else None
+        latency_ms = FAKE_GEMINI_VISION_LATENCY_MS if images else FAKE_GEMINI_LATENCY_MS
+        return GenerateContentResponse(
+            answer(prompt, schema), tokens(prompt) + images * IMAGE_TOKENS, latency_ms, stream=stream
+        )
+
+
+def configure(**kwargs):
+    pass
+
+
+def upload_file(path, mime_type: str = None, **kwargs):
+    if hasattr(path, "read"):
+        path.read()
+    pause(FAKE_UPLOAD_FILE_LATENCY_MS)
+    return UploadedFile(mime_type)
+
+
+class RunResponse:
+    def __init__(self, content: str, input_tokens: int):
+        self.content = content
+        self.metrics = {"input_tokens": [input_tokens], "output_tokens": [tokens(content)]}
+
+
+class Gemini:
+    def __init__(self, id: str = None, **kwargs):
+        self.id = id
+
+
+class Agent:
+    def __init__(self, name: str = None, model=None, markdown: bool = False, **kwargs):
+        self.name = name
+        self.model = model
+
+    def run(self, message: str, images: list = None, **kwargs) -> RunResponse:
+        pause(FAKE_GEMINI_VISION_LATENCY_MS)
+        return RunResponse(DESCRIPTION, tokens(message) + len(images or []) * IMAGE_TOKENS)
+
+
+def jpeg(color=(40, 90, 160), size=(320, 180)) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Replace Gemini, phidata, speech-to-text and keyframe extraction in this process"""
+    # No weights to load for the warm-up; one process, since the stub never uses the chunk pool
+    os.environ.setdefault("STT_ENGINE", "stub")
+    os.environ.setdefault("TRANSCRIBE_WORKERS", "1")
+
+    try:
+        import google
+    except ImportError:
+        google = _module("google")
+        google.__path__ = []
+    google.generativeai = _module(
+        "google.generativeai", configure=configure, upload_file=upload_file,
+        GenerativeModel=GenerativeModel, GenerationConfig=GenerationConfig,
+    )
+    phi = _module("phi")
+    phi.__path__ = []
+    phi.agent = _module("phi.agent", Agent=Agent)
+    phi.model = _module("phi.model")
+    phi.model.__path__ = []
+    phi.model.google = _module("phi.model.google", Gemini=Gemini)
+
+    import keyframes
+    import transcription
+    from telemetry import stage
+
+    frames = [jpeg((40 + 30 * i, 90, 160)) for i in range(FAKE_KEYFRAMES)]
+
+    def extract_keyframes(file_path: str, timeout: float = None, max_frames: int = FAKE_KEYFRAMES) -> list:
+        pause(FAKE_KEYFRAMES_MS)
+        return frames[:max_frames]
+
+    def transcribe(file_path: str, max_audio_seconds: float = None) -> dict:
+        # Decoding is roughly a tenth of a CPU transcription
+        with stage("audio_decode"):
+            pause(FAKE_TRANSCRIBE_MS * 0.1)
+        with stage("speech_to_text"):
+            pause(FAKE_TRANSCRIBE_MS * 0.9)
+        return {"text": TRANSCRIPT, "chunks": 1, "audio_seconds": 30.0, "truncated": False}
+
+    # captioning.py binds extract_keyframes when it is imported, after this
+    keyframes.extract_keyframes = extract_keyframes
+    transcription.transcriber.transcribe = transcribe
@@ -0,0 +1,294 @@
+"""
+Query-plan regression check for the auth service's quota hot path.
+
+Creates a database from infrastructure/db/init.sql (and any migration it does
+not include yet), seeds a large synthetic dataset, then runs the real data-access
+functions from services/auth/repository.py against it:
+
+- Every statement they send is EXPLAINed first. No scan of users,
+  subscriptions or caption_usage may be a sequential scan. Each check also
+  names the index it must use, e.g. an index-only scan of
+  idx_subscriptions_user_active, and the upserts must resolve conflicts with
+  uq_caption_usage_user_period_start.
+- Each function is then called --samples times for random users, and its p95
+  latency (pool checkout and commit included) must stay within its budget,
+  scaled by --budget-scale for slower machines.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/query_plans.py --users 100000 --output query-plans.json
+
+Exit status is 1 on any violation, so it can run in CI (make check-query-plans).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import suite
+
+# Tables that grow with the user base; sequential scans of them are regressions
+LARGE_TABLES = ("users", "subscriptions", "caption_usage")
+
+INDEX = ("Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+INDEX_ONLY = ("Index Only Scan",)
+ACTIVE_SUBSCRIPTION = ("subscriptions", "idx_subscriptions_user_active", INDEX_ONLY)
+PERIOD_USAGE = ("caption_usage", "uq_caption_usage_user_period_start", INDEX)
+USAGE_ARBITER = "uq_caption_usage_user_period_start"
+
+# p95 budgets in milliseconds, before --budget-scale
+READ_BUDGET_MS = 5.0
+WRITE_BUDGET_MS = 10.0
+BATCH_BUDGET_MS = 150.0
+
+# Any bcrypt hash will do; nobody logs in
+PASSWORD_HASH = "$2b$12$7EqJtq98hPqEX7fNZaFWoOhi5BWX4Z3ZPYxvNLnhBKJDTmHQJT0cm"
+
+SEED_SQL = """
+ALTER TABLE subscriptions DISABLE TRIGGER USER;
+
+INSERT INTO users (email, password_hash, full_name)
+SELECT 'user' || n || '@example.com', %(password_hash)s, 'User ' || n
+FROM generate_series(1, %(users)s) AS n;
+
+-- Everyone started on an older subscription that has since been cancelled
+INSERT INTO subscriptions (user_id, plan_id, status, start_date, end_date)
+SELECT u.id, p.id, 'cancelled', NOW() - INTERVAL '400 days', NOW() - INTERVAL '40 days'
+FROM users u, plans p
+WHERE p.name = 'Free';
+
+-- 95%% are on an active plan now, spread over all plans; the rest churned
+INSERT INTO subscriptions (user_id, plan_id, status, start_date)
+SELECT u.id, plans.ids[1 + abs(hashtext(u.email)) %% array_length(plans.ids, 1)], 'active',
+       NOW() - INTERVAL '40 days'
+FROM users u, (SELECT array_agg(id ORDER BY caption_limit) AS ids FROM plans) AS plans
+WHERE abs(hashtext(u.email)) %% 20 <> 0;
+
+-- --periods months of usage history per user, the current month included
+INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
+SELECT u.id, m.period_start, m.period_start + INTERVAL '1 month', abs(hashtext(u.email || m.k)) %% 10,
+       m.period_start + INTERVAL '1 day'
+FROM users u,
+     (SELECT k, DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') - k * INTERVAL '1 month' AS period_start
+      FROM generate_series(0, %(periods)s - 1) AS k) AS m;
+
+ALTER TABLE subscriptions ENABLE TRIGGER USER;
+"""
+
+
+def seed(db_params: dict, users: int, periods: int):
+    import psycopg2
+
+    conn = psycopg2.connect(**db_params)
+    with conn, conn.cursor() as cur:
+        cur.execute(SEED_SQL, {"password_hash": PASSWORD_HASH, "users": users, "periods": periods})
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # Fresh statistics, and a visibility map so index-only scans skip the heap
+        cur.execute("VACUUM ANALYZE")
+        cur.execute("SELECT relname, n_live_tup FROM pg_stat_user_tables WHERE relname = ANY(%s)",
+                    (list(LARGE_TABLES),))
+        counts = dict(cur.fetchall())
+    conn.close()
+    return counts
+
+
+def sample_users(db_params: dict, count: int) -> list:
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(**db_params)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT id::text AS id, email FROM users ORDER BY random() LIMIT %s", (count,))
+        users = cur.fetchall()
+    conn.close()
+    return users
+
+
+def import_repository(db_params: dict):
+    """services/auth's repository and connection pool, pointed at the seeded database"""
+    os.environ.update(
+        DB_HOST=db_params.get("host", "localhost"),
+        DB_PORT=str(db_params.get("port", "5432")),
+        DB_NAME=db_params["dbname"],
+        DB_USER=db_params.get("user", "postgres"),
+        DB_PASSWORD=db_params.get("password", ""),
+    )
+    sys.path.insert(0, suite.AUTH_DIR)
+    import db
+    import repository
+    return db, repository
+
+
+def explaining_cursor(base, plans: list):
+    """A cursor class that EXPLAINs each statement into plans while plans is recording"""
+
+    class ExplainingCursor(base):
+        def execute(self, query, vars=None):
+            if plans.recording:
+                prefix = "EXPLAIN (FORMAT JSON) "
+                super().execute(prefix.encode() + query if isinstance(query, bytes) else prefix + query, vars)
+                plans.append(self.fetchone()["QUERY PLAN"][0]["Plan"])
+            return super().execute(query, vars)
+
+    return ExplainingCursor
+
+
+class PlanLog(list):
+    recording = False
+
+
+def nodes(plan: dict) -> list:
+    """Every node of an EXPLAIN (FORMAT JSON) plan tree, init plans and CTEs included"""
+    found = [plan]
+    for child in plan.get("Plans", []):
+        found.extend(nodes(child))
+    return found
+
+
+def check_plan(plans: list, expect: list, arbiter: str = None) -> list:
+    """Descriptions of the ways the plans break the expectations"""
+    problems = []
+    scans = [node for plan in plans for node in nodes(plan)]
+    for node in scans:
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES:
+            problems.append(f"sequential scan of {node['Relation Name']}")
+    for table, index, node_types in expect:
+        used = [node for node in scans if node.get("Relation Name") == table and node["Node Type"] in node_types
+                and (index is None or node.get("Index Name") == index
+                     or any(child.get("Index Name") == index for child in node.get("Plans", [])))]
+        if not used:
+            problems.append(f"no {' / '.join(node_types)} of {table}" + (f" using {index}" if index else ""))
+    if arbiter:
+        arbiters = [name for node in scans for name in node.get("Conflict Arbiter Indexes", [])]
+        if arbiter not in arbiters:
+            problems.append(f"ON CONFLICT resolved with {arbiters or 'no index'} instead of {arbiter}")
+    return problems
+
+
+def cases(repository, users: list) -> list:
+    period_start, period_end = repository.current_period(datetime.utcnow())
+
+    def batch():
+        return sorted((user["id"], period_start, period_end, 1, datetime.utcnow())
+                      for user in random.sample(users, min(500, len(users))))
+
+    return [
+        {"name": "get_user_credentials", "fn": repository.get_user_credentials,
+         "args": lambda user: (user["email"],), "expect": [("users", None, INDEX)], "budget_ms": READ_BUDGET_MS},
+        {"name": "get_user", "fn": repository.get_user,
+         "args": lambda user: (user["id"],), "expect": [("users", "users_pkey", INDEX)], "budget_ms": READ_BUDGET_MS},
+        {"name": "get_active_subscription", "fn": repository.get_active_subscription,
+         "args": lambda user: (user["id"],), "expect": [ACTIVE_SUBSCRIPTION], "budget_ms": READ_BUDGET_MS},
+        {"name": "get_period_usage", "fn": repository.get_period_usage,
+         "args": lambda user: (user["id"],), "expect": [PERIOD_USAGE], "budget_ms": READ_BUDGET_MS},
+        {"name": "get_active_subscription_usage", "fn": repository.get_active_subscription_usage,
+         "args": lambda user: (user["id"],), "expect": [ACTIVE_SUBSCRIPTION, PERIOD_USAGE],
+         "budget_ms": READ_BUDGET_MS},
+        {"name": "reserve_captions", "fn": repository.reserve_captions,
+         "args": lambda user: (user["id"], 1), "expect": [ACTIVE_SUBSCRIPTION], "arbiter": USAGE_ARBITER,
+         "budget_ms": WRITE_BUDGET_MS},
+        {"name": "reserve_captions (cached limit)", "fn": repository.reserve_captions,
+         "args": lambda user: (user["id"], 1, 1_000_000), "expect": [], "arbiter": USAGE_ARBITER,
+         "budget_ms": WRITE_BUDGET_MS},
+        {"name": "release_captions", "fn": repository.release_captions,
+         "args": lambda user: (user["id"], 1, period_start), "expect": [PERIOD_USAGE],
+         "budget_ms": WRITE_BUDGET_MS},
+        {"name": "increment_caption_usage", "fn": repository.increment_caption_usage,
+         "args": lambda user: (user["id"],), "expect": [], "arbiter": USAGE_ARBITER,
+         "budget_ms": WRITE_BUDGET_MS},
+        {"name": "add_caption_usage (500 rows)", "fn": repository.add_caption_usage,
+         "args": lambda user: (batch(),), "expect": [], "arbiter": USAGE_ARBITER,
+         "budget_ms": BATCH_BUDGET_MS, "samples": 20},
+    ]
+
+
+def run_case(case: dict, users: list, samples: int, plans: PlanLog, budget_scale: float) -> dict:
+    plans.clear()
+    plans.recording = True
+    try:
+        case["fn"](*case["args"](users[0]))
+    finally:
+        plans.recording = False
+    problems = check_plan(plans, case["expect"], case.get("arbiter"))
+
+    latencies = []
+    for i in range(case.get("samples", samples)):
+        args = case["args"](users[i % len(users)])
+        start = time.perf_counter()
+        case["fn"](*args)
+        latencies.append(time.perf_counter() - start)
+    summary = suite.summarize(latencies, {}, sum(latencies))
+    budget = case["budget_ms"] * budget_scale
+    if summary["p95_ms"] > budget:
+        problems.append(f"p95 {summary['p95_ms']} ms over the {budget:g} ms budget")
+    return {
+        "p50_ms": summary["p50_ms"],
+        "p95_ms": summary["p95_ms"],
+        "p99_ms": summary["p99_ms"],
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "budget_ms": budget,
+        "plans": [plan["Node Type"] for plan in plans],
+        "scans": sorted({" ".join(filter(None, (node["Node Type"], node.get("Relation Name"), node.get("Index Name"))))
+                         for plan in plans for node in nodes(plan) if "Scan" in node["Node Type"]}),
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Postgres server to use instead of a pgserver one "
+                        "(the --database-name database on it is dropped and recreated)")
+    parser.add_argument("--pgdata", default=os.path.join(tempfile.gettempdir(), "caption-bench-pgdata"),
+                        help="Data directory of the pgserver Postgres")
+    parser.add_argument("--database-name", default="caption_query_plans", help="Recreated for every run")
+    parser.add_argument("--users", type=int, default=100_000, help="Synthetic users to seed")
+    parser.add_argument("--periods", type=int, default=12, help="Months of usage history per user")
+    parser.add_argument("--samples", type=int, default=300, help="Timed calls per function")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every latency budget")
+    parser.add_argument("--output", help="Also write the results as JSON here")
+    args = parser.parse_args()
+
+    admin_uri, database_server = suite.start_database(args)
+    try:
+        db_params = suite.create_database(admin_uri, args.database_name)
+        start = time.perf_counter()
+        counts = seed(db_params, args.users, args.periods)
+        print(f"Seeded {counts} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        db, repository = import_repository(db_params)
+        plans = PlanLog()
+        db.db_pool.connect_kwargs["cursor_factory"] = explaining_cursor(
+            db.db_pool.connect_kwargs["cursor_factory"], plans)
+        users = sample_users(db_params, args.samples)
+
+        results = {}
+        for case in cases(repository, users):
+            results[case["name"]] = run_case(case, users, args.samples, plans, args.budget_scale)
+        db.db_pool.close()
+    finally:
+        if database_server is not None:
+            database_server.cleanup()
+
+    failed = 0
+    print(f"{'query':32} {'p50 ms':>8} {'p95 ms':>8} {'budget':>8}  plan")
+    for name, result in results.items():
+        print(f"{name:32} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['budget_ms']:>8g}  "
+              + "; ".join(result["scans"]))
+        for problem in result["problems"]:
+            failed += 1
+            print(f"  FAIL {problem}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": {"users": args.users, "periods": args.periods, "samples": args.samples,
+                                  "tables": counts}, "queries": results}, f, indent=2)
+    print(f"{failed} problem(s)" if failed else "All query plans and latency budgets OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
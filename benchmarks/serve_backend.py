@@ -0,0 +1,30 @@
+"""
+Run the backend with gunicorn.conf.py, as in production, but with the offline
+fakes from fake_models.py installed (no API key, model weights or ffmpeg):
+
+    python benchmarks/serve_backend.py [extra gunicorn options]
+
+The fakes are installed in the master before app.py is preloaded, so every
+worker inherits them. suite.py starts the backend this way.
+"""
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "backend")
+
+
+def main():
+    sys.path[:0] = [BACKEND_DIR, BENCHMARKS_DIR]
+    os.chdir(BACKEND_DIR)
+
+    import fake_models
+    fake_models.install()
+
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ["gunicorn", "-c", "gunicorn.conf.py", *sys.argv[1:], "app:app"]
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,625 @@
+"""
+Offline benchmark and load test for the backend and the auth service.
+
+Starts everything locally and needs no network or API key:
+
+- Postgres: a throwaway server from the `pgserver` package (data kept in
+  --pgdata between runs), or any server given with --database-url. A fresh
+  --database-name database is created from infrastructure/db/init.sql, plus
+  any migration in infrastructure/db/migrations that init.sql does not yet
+  include.
+- the auth service under uvicorn, one process, as in its Dockerfile
+- the backend under gunicorn with gunicorn.conf.py, with Gemini, phidata,
+  speech-to-text and keyframe extraction replaced by the fakes in
+  fake_models.py (latencies set with the --*-ms options)
+
+It signs up --users accounts (moved to the Enterprise plan so quota never
+runs out), then drives each endpoint alone at --concurrency for --duration
+seconds, then a weighted --mix of all of them for --mix-duration seconds:
+
+    signup          POST auth /signup, a new account each time
+    login           POST auth /login
+    validate        POST auth /validate-token
+    check-limit     GET  auth /caption/check-limit
+    generate        POST backend /generate-captions, an image
+    generate-video  POST backend /generate-captions, a video
+    generate-stream POST backend /generate-captions/stream, an image, read to the end
+
+Every upload has different bytes, so the caption cache never answers for the
+model. Each endpoint gets request counts, errors by status, throughput,
+p50/p95/p99 latency and the peak memory of each service's process tree
+(RSS, and PSS, which counts pages shared copy-on-write between gunicorn
+workers once). Results are written as JSON to --output; with --baseline they
+are compared to an earlier run (compare.py) and the exit status is 1 on a
+regression, for CI:
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/suite.py --output bench.json
+    python benchmarks/suite.py --output bench.json --baseline baseline.json
+
+Linux only (memory is read from /proc).
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import compare
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+AUTH_DIR = os.path.join(ROOT_DIR, "services", "auth")
+DB_DIR = os.path.join(ROOT_DIR, "infrastructure", "db")
+INIT_SQL = os.path.join(DB_DIR, "init.sql")
+
+RESULTS_VERSION = 1
+PASSWORD = "bench-password-123"
+JWT_SECRET = "offline-benchmark-secret"
+INTERNAL_SERVICE_TOKEN = "offline-benchmark-internal-token"
+
+DEFAULT_MIX = "signup=1,login=3,validate=12,check-limit=8,generate=6,generate-video=1,generate-stream=3"
+
+# Server settings recorded with the results; runs are only comparable when these match
+SERVER_SETTINGS = ("GUNICORN_WORKERS", "GUNICORN_THREADS", "BCRYPT_ROUNDS", "PASSWORD_HASH_WORKERS",
+                   "DB_POOL_MAX_SIZE", "USAGE_ACCOUNTING", "PLAN_CACHE_ENABLED", "LLM_CONCURRENCY",
+                   "TRANSCRIBE_CONCURRENCY", "IMAGE_CAPTION_MODE")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http(url: str, method: str = "GET", body: bytes = None, content_type: str = None, token: str = None,
+         timeout: float = 300) -> tuple:
+    """(status, body); status 0 when the request did not get a response"""
+    req = urllib.request.Request(url, data=body, method=method)
+    if content_type:
+        req.add_header("Content-Type", content_type)
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except (urllib.error.URLError, OSError):
+        return 0, b""
+
+
+def post_json(url: str, payload: dict) -> tuple:
+    return http(url, "POST", json.dumps(payload).encode("utf-8"), "application/json")
+
+
+def multipart_body(fields: dict, filename: str, content_type: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    parts = [
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode("utf-8")
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + data + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def photo(width: int = 1600, height: int = 1200) -> bytes:
+    """A camera-sized JPEG with enough detail to compress like a photo"""
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buffer = io.BytesIO()
+    Image.blend(noise, gradient, 0.6).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def start_database(args) -> tuple:
+    """(admin connection URI, server to clean up or None)"""
+    if args.database_url:
+        return args.database_url, None
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("Install pgserver (benchmarks/requirements.txt) or pass --database-url")
+    server = pgserver.get_server(args.pgdata, cleanup_mode="stop")
+    return server.get_uri("postgres"), server
+
+
+def create_database(admin_uri: str, name: str) -> dict:
+    """Recreate the benchmark database from init.sql and the migrations; its connection parameters"""
+    import psycopg2
+    from psycopg2.extensions import parse_dsn
+
+    sys.path.insert(0, DB_DIR)
+    import migrate
+
+    conn = psycopg2.connect(admin_uri)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+
+    params = parse_dsn(admin_uri)
+    params["dbname"] = name
+    with open(INIT_SQL) as f:
+        schema = f.read()
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'uuid-ossp'")
+        if cur.fetchone() is None:
+            # pgserver's build has no contrib extensions; gen_random_uuid is built in since Postgres 13
+            schema = schema.replace('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";', "")
+            cur.execute("CREATE FUNCTION uuid_generate_v4() RETURNS uuid LANGUAGE sql AS 'SELECT gen_random_uuid()'")
+        cur.execute(schema)
+    applied = migrate.migrate(conn)
+    if applied:
+        print(f"init.sql does not include migrations {', '.join(applied)}; applied them", file=sys.stderr)
+    conn.close()
+    return params
+
+
+def upgrade_users(db_params: dict, emails: list, plan: str = "Enterprise"):
+    import psycopg2
+
+    conn = psycopg2.connect(**db_params)
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE subscriptions SET plan_id = (SELECT id FROM plans WHERE name = %s)
+            WHERE user_id IN (SELECT id FROM users WHERE email = ANY(%s))
+            """,
+            (plan, emails),
+        )
+    conn.close()
+
+
+class Service:
+    """A server subprocess with its output in a log file"""
+
+    def __init__(self, name: str, cmd: list, cwd: str, env: dict, log_dir: str):
+        self.name = name
+        self.log_path = os.path.join(log_dir, f"{name}.log")
+        self._log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def wait_ready(self, url: str, timeout: float = 120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f"{self.name} exited with {self.process.returncode}; see {self.log_path}")
+            if http(url, timeout=2)[0] == 200:
+                return
+            time.sleep(0.5)
+        raise SystemExit(f"{self.name} not ready after {timeout:.0f}s; see {self.log_path}")
+
+    def stop(self, timeout: float = 30):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+def start_services(args, db_params: dict, log_dir: str) -> tuple:
+    auth_port, backend_port = free_port(), free_port()
+    env = dict(os.environ, JWT_SECRET=JWT_SECRET, INTERNAL_SERVICE_TOKEN=INTERNAL_SERVICE_TOKEN,
+               PYTHONUNBUFFERED="1")
+    env.update(
+        FAKE_GEMINI_LATENCY_MS=str(args.gemini_latency_ms),
+        FAKE_GEMINI_VISION_LATENCY_MS=str(args.vision_latency_ms),
+        FAKE_UPLOAD_FILE_LATENCY_MS=str(args.upload_file_latency_ms),
+        FAKE_TRANSCRIBE_MS=str(args.transcribe_ms),
+        FAKE_KEYFRAMES_MS=str(args.keyframes_ms),
+    )
+
+    auth_env = dict(
+        env,
+        DB_HOST=db_params.get("host", "localhost"),
+        DB_PORT=str(db_params.get("port", "5432")),
+        DB_NAME=db_params["dbname"],
+        DB_USER=db_params.get("user", "postgres"),
+        DB_PASSWORD=db_params.get("password", ""),
+    )
+    auth = Service("auth", [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                            "--port", str(auth_port), "--workers", "1", "--no-access-log"],
+                   AUTH_DIR, auth_env, log_dir)
+
+    backend_env = dict(
+        env,
+        GUNICORN_BIND=f"127.0.0.1:{backend_port}",
+        AUTH_SERVICE_URL=f"http://127.0.0.1:{auth_port}",
+        METRICS_DIR=os.path.join(log_dir, "metrics"),
+    )
+    backend = Service("backend", [sys.executable, os.path.join(BENCHMARKS_DIR, "serve_backend.py"),
+                                  "--access-logfile", "/dev/null"],
+                      ROOT_DIR, backend_env, log_dir)
+
+    auth_url, backend_url = f"http://127.0.0.1:{auth_port}", f"http://127.0.0.1:{backend_port}"
+    auth.wait_ready(f"{auth_url}/health")
+    backend.wait_ready(f"{backend_url}/ready")
+    return auth, backend, auth_url, backend_url
+
+
+def process_tree(pid: int) -> list:
+    """pid and all its descendants"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def memory_kb(pid: int) -> tuple:
+    """(RSS, PSS) of one process; PSS is RSS where smaps_rollup is unavailable"""
+    values = {}
+    for path in (f"/proc/{pid}/smaps_rollup", f"/proc/{pid}/status"):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, rest = line.partition(":")
+                    if key in ("Rss", "Pss", "VmRSS"):
+                        values[key] = int(rest.split()[0])
+        except (OSError, ValueError):
+            continue
+        if values:
+            break
+    rss = values.get("Rss", values.get("VmRSS", 0))
+    return rss, values.get("Pss", rss)
+
+
+class MemorySampler:
+    """Peak RSS and PSS of each service's process tree, per phase"""
+
+    def __init__(self, services: dict, interval: float = 0.25):
+        self.services = services
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def sample(self):
+        for name, pid in self.services.items():
+            rss = pss = 0
+            for member in process_tree(pid):
+                member_rss, member_pss = memory_kb(member)
+                rss += member_rss
+                pss += member_pss
+            with self._lock:
+                peak_rss, peak_pss = self._peaks.get(name, (0, 0))
+                self._peaks[name] = (max(peak_rss, rss), max(peak_pss, pss))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def take_peaks(self) -> dict:
+        """Peaks since the last call, in MB"""
+        self.sample()
+        with self._lock:
+            peaks, self._peaks = self._peaks, {}
+        return {
+            name: {"peak_rss_mb": round(rss / 1024, 1), "peak_pss_mb": round(pss / 1024, 1)}
+            for name, (rss, pss) in sorted(peaks.items())
+        }
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class Traffic:
+    """The benchmark's operations against running services"""
+
+    def __init__(self, auth_url: str, backend_url: str, users: list, image: bytes, video_bytes: int):
+        self.auth_url = auth_url
+        self.backend_url = backend_url
+        self.users = users
+        self.image = image
+        self.video_bytes = video_bytes
+        self.operations = {
+            "signup": (self.signup, "auth"),
+            "login": (self.login, "auth"),
+            "validate": (self.validate, "auth"),
+            "check-limit": (self.check_limit, "auth"),
+            "generate": (self.generate, "backend"),
+            "generate-video": (self.generate_video, "backend"),
+            "generate-stream": (self.generate_stream, "backend"),
+        }
+
+    def signup(self) -> int:
+        email = f"bench-{uuid.uuid4().hex[:16]}@example.com"
+        return post_json(f"{self.auth_url}/signup",
+                         {"email": email, "password": PASSWORD, "full_name": "Bench User"})[0]
+
+    def login(self) -> int:
+        email, _ = random.choice(self.users)
+        return post_json(f"{self.auth_url}/login", {"email": email, "password": PASSWORD})[0]
+
+    def validate(self) -> int:
+        _, token = random.choice(self.users)
+        return post_json(f"{self.auth_url}/validate-token", {"token": token})[0]
+
+    def check_limit(self) -> int:
+        _, token = random.choice(self.users)
+        return http(f"{self.auth_url}/caption/check-limit", token=token)[0]
+
+    def upload(self, path: str, file_type: str, filename: str, content_type: str, data: bytes) -> tuple:
+        _, token = random.choice(self.users)
+        body, multipart_type = multipart_body(
+            {"fileType": file_type, "tone": random.choice(["casual", "formal", "friendly"]),
+             "length": "medium", "hashtagCount": "5"},
+            filename, content_type, data,
+        )
+        return http(f"{self.backend_url}{path}", "POST", body, multipart_type, token)
+
+    def unique_image(self) -> bytes:
+        # Bytes after the JPEG end marker change the hash, not the picture
+        return self.image + os.urandom(16)
+
+    def generate(self) -> int:
+        return self.upload("/generate-captions", "image", "photo.jpg", "image/jpeg", self.unique_image())[0]
+
+    def generate_video(self) -> int:
+        return self.upload("/generate-captions", "video", "clip.mp4", "video/mp4", os.urandom(self.video_bytes))[0]
+
+    def generate_stream(self) -> int:
+        status, body = self.upload("/generate-captions/stream", "image", "photo.jpg", "image/jpeg",
+                                   self.unique_image())
+        # Failures after the stream has started arrive as an error event on a 200
+        if status == 200 and (b"event: error" in body or b"event: done" not in body):
+            return 599
+        return status
+
+
+def summarize(latencies: list, statuses: dict, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def pct(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    errors = sum(count for status, count in statuses.items() if not 200 <= int(status) < 400)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def run_phase(traffic: Traffic, weights: dict, concurrency: int, duration: float) -> tuple:
+    """({operation: summary}, total summary) for `concurrency` clients picking operations by weight"""
+    names = list(weights)
+    shares = list(weights.values())
+    deadline = time.monotonic() + duration
+    latencies = {name: [] for name in names}
+    statuses = {name: {} for name in names}
+    lock = threading.Lock()
+
+    def worker():
+        local_latencies = {name: [] for name in names}
+        local_statuses = {name: {} for name in names}
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights=shares)[0]
+            start = time.perf_counter()
+            status = str(traffic.operations[name][0]())
+            local_latencies[name].append(time.perf_counter() - start)
+            local_statuses[name][status] = local_statuses[name].get(status, 0) + 1
+        with lock:
+            for name in names:
+                latencies[name].extend(local_latencies[name])
+                for status, count in local_statuses[name].items():
+                    statuses[name][status] = statuses[name].get(status, 0) + count
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.monotonic() - started
+
+    per_operation = {name: summarize(latencies[name], statuses[name], elapsed) for name in names}
+    all_statuses = {}
+    for name in names:
+        for status, count in statuses[name].items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+    total = summarize([value for name in names for value in latencies[name]], all_statuses, elapsed)
+    return per_operation, total
+
+
+def seed_users(auth_url: str, db_params: dict, count: int) -> list:
+    """[(email, token)] for new accounts on the Enterprise plan"""
+
+    def create(_):
+        email = f"bench-user-{uuid.uuid4().hex[:12]}@example.com"
+        status, body = post_json(f"{auth_url}/signup",
+                                 {"email": email, "password": PASSWORD, "full_name": "Bench User"})
+        if status != 201:
+            raise SystemExit(f"Seeding users failed: signup returned {status} {body[:200]!r}")
+        return email, json.loads(body)["access_token"]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        users = list(pool.map(create, range(count)))
+    upgrade_users(db_params, [email for email, _ in users])
+    return users
+
+
+def parse_mix(text: str) -> dict:
+    weights = {}
+    for pair in text.split(","):
+        if pair.strip():
+            name, _, weight = pair.partition("=")
+            weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Postgres server to use instead of a pgserver one "
+                                               "(a database it can create and drop, e.g. .../postgres)")
+    parser.add_argument("--pgdata", default=os.path.join(tempfile.gettempdir(), "caption-bench-pgdata"),
+                        help="Data directory of the pgserver Postgres")
+    parser.add_argument("--database-name", default="caption_bench", help="Recreated for every run")
+    parser.add_argument("--users", type=int, default=20, help="Accounts used by login/validate/generate")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds per endpoint alone; 0 skips")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted operations for the mixed phase")
+    parser.add_argument("--mix-duration", type=float, default=60.0, help="Seconds of mixed traffic; 0 skips")
+    parser.add_argument("--endpoints", help="Comma-separated operations to run alone (default: all in --mix)")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds of unmeasured mixed traffic first")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--vision-latency-ms", type=float, default=1500)
+    parser.add_argument("--upload-file-latency-ms", type=float, default=400)
+    parser.add_argument("--transcribe-ms", type=float, default=2000)
+    parser.add_argument("--keyframes-ms", type=float, default=300)
+    parser.add_argument("--video-bytes", type=int, default=2 * 1024 * 1024, help="Size of each video upload")
+    parser.add_argument("--image", help="JPEG to upload (default: a generated 1600x1200 photo)")
+    parser.add_argument("--log-dir", help="Server logs (default: a new temporary directory)")
+    parser.add_argument("--output", help="Write the results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Compare with this results JSON; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=compare.DEFAULT_TOLERANCE,
+                        help="Allowed relative latency/throughput change against --baseline")
+    parser.add_argument("--memory-tolerance", type=float, default=compare.DEFAULT_MEMORY_TOLERANCE,
+                        help="Allowed relative peak memory growth against --baseline")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    endpoints = [name.strip() for name in args.endpoints.split(",")] if args.endpoints else list(weights)
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="caption-bench-")
+    os.makedirs(log_dir, exist_ok=True)
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = f.read()
+    else:
+        image = photo()
+
+    admin_uri, database_server = start_database(args)
+    auth = backend = sampler = None
+    try:
+        db_params = create_database(admin_uri, args.database_name)
+        auth, backend, auth_url, backend_url = start_services(args, db_params, log_dir)
+        users = seed_users(auth_url, db_params, args.users)
+        traffic = Traffic(auth_url, backend_url, users, image, args.video_bytes)
+        unknown = (set(weights) | set(endpoints)) - set(traffic.operations)
+        if unknown:
+            raise SystemExit(f"Unknown operations: {', '.join(sorted(unknown))}")
+        print(f"Services up (logs in {log_dir}); {len(users)} users", file=sys.stderr)
+
+        sampler = MemorySampler({"auth": auth.pid, "backend": backend.pid}).start()
+        if args.warmup:
+            run_phase(traffic, weights, args.concurrency, args.warmup)
+
+        results = {
+            "version": RESULTS_VERSION,
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "config": {
+                "concurrency": args.concurrency,
+                "duration_seconds": args.duration,
+                "mix": weights,
+                "mix_duration_seconds": args.mix_duration,
+                "users": args.users,
+                "image_bytes": len(image),
+                "video_bytes": args.video_bytes,
+                "fake_latency_ms": {
+                    "gemini": args.gemini_latency_ms,
+                    "vision": args.vision_latency_ms,
+                    "upload_file": args.upload_file_latency_ms,
+                    "transcribe": args.transcribe_ms,
+                    "keyframes": args.keyframes_ms,
+                },
+                "server": {name: os.environ[name] for name in SERVER_SETTINGS if name in os.environ},
+            },
+            "endpoints": {},
+        }
+        sampler.take_peaks()
+
+        if args.duration:
+            for name in endpoints:
+                print(f"{name}: {args.duration:.0f}s at concurrency {args.concurrency}", file=sys.stderr)
+                per_operation, _ = run_phase(traffic, {name: 1}, args.concurrency, args.duration)
+                results["endpoints"][name] = dict(per_operation[name], memory=sampler.take_peaks())
+
+        if args.mix_duration:
+            print(f"mix: {args.mix_duration:.0f}s at concurrency {args.concurrency}", file=sys.stderr)
+            per_operation, total = run_phase(traffic, weights, args.concurrency, args.mix_duration)
+            results["mix"] = dict(total, memory=sampler.take_peaks(), endpoints=per_operation)
+    finally:
+        if sampler:
+            sampler.stop()
+        for service in (backend, auth):
+            if service:
+                service.stop()
+        if database_server:
+            database_server.cleanup()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    print(compare.table(results), file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare.report(baseline, results, args.tolerance, args.memory_tolerance, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,7 @@ import { Switch } from "@/components/ui/switch";
 import { Textarea } from "@/components/ui/textarea";
 import { Upload, Image, Video } from "lucide-react";
 import { useToast } from "@/components/ui/use-toast";
-import { apiClient } from "@/lib/api-client";
+import { apiClient, Caption, CaptionStage, formatCaption } from "@/lib/api-client";
 
 export default function CaptionGeneratorForm() {
   const [isVideo, setIsVideo] = useState(false);
@@ -26,8 +26,9 @@ export default function CaptionGeneratorForm() {
   const [tone, setTone] = useState("casual");
   const [length, setLength] = useState("medium");
   const [hashtagCount, setHashtagCount] = useState(5);
-  const [captions, setCaptions] = useState("");
+  const [captions, setCaptions] = useState<Caption[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [stage, setStage] = useState<CaptionStage | null>(null);
   const { toast } = useToast();
 
   // Create a reference for the file input
@@ -71,15 +72,26 @@ export default function CaptionGeneratorForm() {
     }
 
     setIsLoading(true);
+    setCaptions([]);
+    setStage(null);
 
     try {
-      // Use the API client to generate captions
-      const data = await apiClient.generateCaptions(
+      // Captions appear one by one as they are generated; the final list replaces them
+      const data = await apiClient.generateCaptionsStream(
         file,
         isVideo ? "video" : "image",
         tone,
         length,
-        hashtagCount
+        hashtagCount,
+        {
+          onStage: setStage,
+          onCaption: (caption, index) =>
+            setCaptions((current) => {
+              const next = [...current];
+              next[index] = caption;
+              return next;
+            }),
+        }
       );
 
       setCaptions(data.captions);
@@ -88,6 +100,8 @@ export default function CaptionGeneratorForm() {
         description: "Captions generated successfully!",
       });
     } catch (error) {
+      // Drop partial captions from a stream that failed midway
+      setCaptions([]);
       toast({
         title: "Error",
         description:
@@ -98,13 +112,26 @@ export default function CaptionGeneratorForm() {
       });
     } finally {
       setIsLoading(false);
+      setStage(null);
+    }
+  };
+
+  const loadingLabel = () => {
+    switch (stage) {
+      case "uploaded":
+        return `Analyzing ${isVideo ? "video" : "image"}...`;
+      case "analyzed":
+      case "generating":
+        return "Writing captions...";
+      default:
+        return "Uploading...";
     }
   };
 
   const handleCopy = async () => {
-    if (captions) {
+    if (captions.length) {
       try {
-        await navigator.clipboard.writeText(captions);
+        await navigator.clipboard.writeText(captions.map(formatCaption).join("\n\n"));
         toast({
           title: "Success",
           description: "Captions copied to clipboard!",
@@ -279,11 +306,11 @@ export default function CaptionGeneratorForm() {
               className="w-full bg-sky-blue hover:bg-sky-blue/80 text-charcoal"
               disabled={isLoading}
             >
-              {isLoading ? "Generating..." : "Generate Captions"}
+              {isLoading ? loadingLabel() : "Generate Captions"}
             </Button>
 
             <Textarea
-              value={captions}
+              value={captions.filter(Boolean).map(formatCaption).join("\n\n")}
               placeholder="Your generated captions will appear here..."
               className="h-40"
               readOnly
@@ -294,7 +321,7 @@ export default function CaptionGeneratorForm() {
                 type="button"
                 variant="outline"
                 onClick={handleCopy}
-                disabled={!captions}
+                disabled={!captions.length}
               >
                 Copy
               </Button>
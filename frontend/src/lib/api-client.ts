@@ -200,6 +200,22 @@ export interface CaptionLimitCheck {
   captions_used: number;
 }
 
+export interface Caption {
+  text: string;
+  hashtags: string[]; // without the leading #
+}
+
+export type CaptionStage = 'uploaded' | 'analyzed' | 'generating';
+
+export interface CaptionStreamHandlers {
+  onStage?: (stage: CaptionStage) => void;
+  onCaption?: (caption: Caption, index: number) => void;
+}
+
+// One caption as a ready-to-post line
+export const formatCaption = (caption: Caption): string =>
+  [caption.text, ...caption.hashtags.map((tag) => `#${tag}`)].join(' ');
+
 class ApiClient {
   private authToken: string | null = null;
 
@@ -367,7 +383,7 @@ class ApiClient {
     tone: string,
     length: string,
     hashtagCount: number
-  ): Promise<{ captions: string }> {
+  ): Promise<{ captions: Caption[] }> {
     // Check caption limit first
     const limitCheck = await this.checkCaptionLimit();
     if (!limitCheck.has_remaining) {
@@ -404,6 +420,101 @@ class ApiClient {
     return response.json();
   }
 
+  /**
+   * Same as generateCaptions, but over Server-Sent Events: reports progress
+   * stages and each caption as soon as it is generated, then resolves with
+   * all captions. EventSource cannot POST a file, so the stream is read with
+   * fetch.
+   */
+  async generateCaptionsStream(
+    file: File,
+    fileType: 'image' | 'video',
+    tone: string,
+    length: string,
+    hashtagCount: number,
+    handlers: CaptionStreamHandlers = {}
+  ): Promise<{ captions: Caption[] }> {
+    const limitCheck = await this.checkCaptionLimit();
+    if (!limitCheck.has_remaining) {
+      throw new Error('You have reached your caption generation limit for this period');
+    }
+
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('fileType', fileType);
+    formData.append('tone', tone);
+    formData.append('length', length);
+    formData.append('hashtagCount', hashtagCount.toString());
+
+    const headers: HeadersInit = { Accept: 'text/event-stream' };
+    if (this.authToken) {
+      headers['Authorization'] = `Bearer ${this.authToken}`;
+    }
+
+    const response = await fetch(`${getBackendUrl()}/generate-captions/stream`, {
+      method: 'POST',
+      headers,
+      body: formData,
+    });
+
+    if (!response.ok) {
+      if (response.status === 401) {
+        this.clearAuthToken();
+        throw new Error('Authentication required. Please login again.');
+      }
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to generate captions');
+    }
+    if (!response.body) {
+      throw new Error('Streaming is not supported by this browser');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line; the last piece may be incomplete
+      const events = buffer.split('\n\n');
+      buffer = events.pop() ?? '';
+
+      for (const rawEvent of events) {
+        let event = 'message';
+        let data = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith('data:')) {
+            data += line.slice(5).trim();
+          }
+        }
+        // Comment-only events (keep-alives) carry no data
+        if (!data) {
+          continue;
+        }
+
+        const payload = JSON.parse(data);
+        if (event === 'status') {
+          handlers.onStage?.(payload.stage);
+        } else if (event === 'caption') {
+          handlers.onCaption?.({ text: payload.text, hashtags: payload.hashtags }, payload.index);
+        } else if (event === 'done') {
+          return { captions: payload.captions };
+        } else if (event === 'error') {
+          throw new Error(payload.error || 'Failed to generate captions');
+        }
+      }
+    }
+
+    throw new Error('Connection closed before captions were complete');
+  }
+
   async healthCheck(): Promise<{ status: string }> {
     const response = await fetch(`${getBackendUrl()}/health`);
     return response.json();
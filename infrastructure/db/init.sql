@@ -45,7 +45,12 @@ CREATE TABLE IF NOT EXISTS subscriptions (
 
 -- Create indexes for faster queries
 CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status);
+
+-- Latest active subscription per user, answered from the index alone
+-- (index-only scan) for the plan lookups and the reservation query
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_active
+    ON subscriptions(user_id, start_date DESC) INCLUDE (plan_id, status)
+    WHERE status = 'active';
 
 -- Caption usage tracking table
 CREATE TABLE IF NOT EXISTS caption_usage (
@@ -58,8 +63,11 @@ CREATE TABLE IF NOT EXISTS caption_usage (
     created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
--- Create composite index for efficient usage queries
-CREATE INDEX IF NOT EXISTS idx_caption_usage_user_period ON caption_usage(user_id, period_start, period_end);
+-- One usage row per user per billing period; the atomic reserve/decrement
+-- queries rely on it for INSERT ... ON CONFLICT (user_id, period_start), and
+-- usage is only ever looked up by (user_id, period_start). captions_generated
+-- stays out of every index so the per-caption updates remain HOT.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_caption_usage_user_period_start ON caption_usage(user_id, period_start);
 
 -- Payment history table (for future use)
 CREATE TABLE IF NOT EXISTS payment_history (
@@ -108,7 +116,8 @@ DECLARE
     period_start_date TIMESTAMP;
     period_end_date TIMESTAMP;
 BEGIN
-    period_start_date := DATE_TRUNC('month', NOW());
+    -- The UTC month, as repository.current_period() in the auth service
+    period_start_date := DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC');
     period_end_date := period_start_date + INTERVAL '1 month';
     
     INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated)
@@ -123,6 +132,32 @@ $$ language 'plpgsql';
 CREATE TRIGGER create_usage_on_subscription AFTER INSERT ON subscriptions
     FOR EACH ROW EXECUTE FUNCTION create_initial_usage_record();
 
+-- Tell auth service plan caches (services/auth/plan_cache.py) what changed.
+-- Payloads: "<user id> <epoch seconds>" and "<epoch seconds>"; NOTIFY is
+-- delivered on commit.
+CREATE OR REPLACE FUNCTION notify_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('subscription_changes',
+        COALESCE(NEW.user_id, OLD.user_id)::text || ' ' || EXTRACT(EPOCH FROM clock_timestamp())::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_subscriptions_change AFTER INSERT OR UPDATE OR DELETE ON subscriptions
+    FOR EACH ROW EXECUTE FUNCTION notify_subscription_change();
+
+CREATE OR REPLACE FUNCTION notify_plan_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('plan_changes', EXTRACT(EPOCH FROM clock_timestamp())::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_plans_change AFTER INSERT OR UPDATE OR DELETE ON plans
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_plan_change();
+
 -- Create view for easy subscription queries
 CREATE OR REPLACE VIEW active_subscriptions AS
 SELECT 
@@ -145,6 +180,19 @@ LEFT JOIN caption_usage cu ON cu.user_id = s.user_id
     AND cu.period_end >= NOW()
 WHERE s.status = 'active';
 
+-- Schema migrations (migrate.py) for databases created from an older
+-- init.sql. This file already contains all of them.
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO schema_migrations (version) VALUES
+    ('001_caption_usage_unique_period'),
+    ('002_quota_hot_path_indexes'),
+    ('003_plan_change_notifications')
+ON CONFLICT (version) DO NOTHING;
+
 -- Grant permissions (adjust as needed for production)
 -- GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA public TO caption_app_user;
 -- GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO caption_app_user;
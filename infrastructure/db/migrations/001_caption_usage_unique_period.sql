@@ -0,0 +1,27 @@
+-- One caption_usage row per user per billing period. The auth service's
+-- reserve, release and increment queries upsert with
+-- ON CONFLICT (user_id, period_start), so duplicate rows have to be merged
+-- before the unique index can be built. The old non-atomic increments could
+-- land on any of a user's duplicate rows, so the period's usage is the sum of
+-- them all: it is written to one of them and the others are deleted.
+WITH ranked AS (
+    SELECT id,
+           ROW_NUMBER() OVER (PARTITION BY user_id, period_start ORDER BY captions_generated DESC, id DESC) AS rank,
+           COUNT(*) OVER (PARTITION BY user_id, period_start) AS copies,
+           SUM(captions_generated) OVER (PARTITION BY user_id, period_start) AS total,
+           MAX(period_end) OVER (PARTITION BY user_id, period_start) AS period_end,
+           MAX(last_generated_at) OVER (PARTITION BY user_id, period_start) AS last_generated_at
+    FROM caption_usage
+),
+merged AS (
+    UPDATE caption_usage u
+    SET captions_generated = r.total,
+        period_end = r.period_end,
+        last_generated_at = r.last_generated_at
+    FROM ranked r
+    WHERE u.id = r.id AND r.rank = 1 AND r.copies > 1
+)
+DELETE FROM caption_usage u USING ranked r
+WHERE u.id = r.id AND r.rank > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_caption_usage_user_period_start ON caption_usage(user_id, period_start);
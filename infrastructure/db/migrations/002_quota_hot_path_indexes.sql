@@ -0,0 +1,35 @@
+-- Indexes for the quota hot path: a user's latest active subscription, and
+-- their usage row for the current period.
+
+-- Latest active subscription per user, answered from the index alone
+-- (index-only scan) for the plan lookups and the reservation query
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_active
+    ON subscriptions(user_id, start_date DESC) INCLUDE (plan_id, status)
+    WHERE status = 'active';
+
+-- Nothing filters on status alone; the partial index serves status = 'active'
+DROP INDEX IF EXISTS idx_subscriptions_status;
+
+-- Usage is read and written by (user_id, period_start), which the unique
+-- index covers. captions_generated stays out of every index so the
+-- per-caption updates remain HOT (no index writes).
+DROP INDEX IF EXISTS idx_caption_usage_user_period;
+
+-- Start the first usage row at the UTC month, the period_start the auth
+-- service computes (repository.current_period), whatever the server timezone
+CREATE OR REPLACE FUNCTION create_initial_usage_record()
+RETURNS TRIGGER AS $$
+DECLARE
+    period_start_date TIMESTAMP;
+    period_end_date TIMESTAMP;
+BEGIN
+    period_start_date := DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC');
+    period_end_date := period_start_date + INTERVAL '1 month';
+    
+    INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated)
+    VALUES (NEW.user_id, period_start_date, period_end_date, 0)
+    ON CONFLICT DO NOTHING;
+    
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
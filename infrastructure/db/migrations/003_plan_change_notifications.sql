@@ -0,0 +1,29 @@
+-- NOTIFY triggers the auth service plan cache (services/auth/plan_cache.py)
+-- listens for. Without them the cache stays off; the listener picks them up
+-- within PLAN_CACHE_RECONNECT_SECONDS of this migration, no restart needed.
+-- Payloads: "<user id> <epoch seconds>" and "<epoch seconds>"; NOTIFY is
+-- delivered on commit.
+CREATE OR REPLACE FUNCTION notify_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('subscription_changes',
+        COALESCE(NEW.user_id, OLD.user_id)::text || ' ' || EXTRACT(EPOCH FROM clock_timestamp())::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_subscriptions_change ON subscriptions;
+CREATE TRIGGER notify_subscriptions_change AFTER INSERT OR UPDATE OR DELETE ON subscriptions
+    FOR EACH ROW EXECUTE FUNCTION notify_subscription_change();
+
+CREATE OR REPLACE FUNCTION notify_plan_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('plan_changes', EXTRACT(EPOCH FROM clock_timestamp())::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_plans_change ON plans;
+CREATE TRIGGER notify_plans_change AFTER INSERT OR UPDATE OR DELETE ON plans
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_plan_change();
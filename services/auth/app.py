@@ -1,16 +1,25 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional
 from datetime import datetime, timedelta
+import hmac
 import os
+import time
 import jwt
-import bcrypt
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from contextlib import contextmanager
+from db import db_pool, run_db
+import repository
+from passwords import password_hasher
+from plan_cache import plan_cache, plan_cache_stats
+from usage import (
+    increment_captions, release_captions, reserve_captions, subscription_usage, usage_counter, usage_stats
+)
+from telemetry import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, REQUEST_ID_HEADER, new_request_id, record_request, render_metrics,
+    set_request_id
+)
 
 # Load environment variables
 load_dotenv()
@@ -41,36 +50,61 @@ app.add_middleware(
 )
 
 # Configuration
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME", "caption_gen")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
+# Shared with the caption backend. /caption/release and /caption/decrement only accept
+# calls that carry it, so users cannot change their own usage; unset, both are refused.
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN")
+INTERNAL_TOKEN_HEADER = "X-Internal-Token"
 
 security = HTTPBearer()
 
-# Database connection helper
-@contextmanager
-def get_db_connection():
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        database=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        cursor_factory=RealDictCursor
-    )
+# Request ID (from the caller or new) and per-endpoint timing for every request
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+    set_request_id(request_id)
+    start = time.perf_counter()
+    response = None
     try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
+        response = await call_next(request)
+        return response
     finally:
-        conn.close()
+        endpoint = request.scope.get("endpoint")
+        record_request(
+            endpoint.__name__ if endpoint else "unmatched",
+            request.method,
+            response.status_code if response is not None else 500,
+            time.perf_counter() - start
+        )
+        if response is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+
+# Database pool lifecycle (one pool per worker process)
+@app.on_event("startup")
+def open_db_pool():
+    try:
+        db_pool.open()
+    except Exception as e:
+        # Keep serving; the pool retries on first use and /health reports the failure
+        print(f"Database pool could not be opened: {str(e)}")
+    if not INTERNAL_SERVICE_TOKEN:
+        print("INTERNAL_SERVICE_TOKEN is not set; /caption/release and /caption/decrement will refuse every call")
+    if usage_counter:
+        usage_counter.start()
+    if plan_cache:
+        plan_cache.start()
+
+@app.on_event("shutdown")
+def close_db_pool():
+    password_hasher.shutdown()
+    if plan_cache:
+        plan_cache.close()
+    # Counted captions are written before the pool goes away
+    if usage_counter:
+        usage_counter.close()
+    db_pool.close()
 
 # Pydantic models
 class SignupRequest(BaseModel):
@@ -106,22 +140,23 @@ class ValidateTokenRequest(BaseModel):
 class DecrementCaptionRequest(BaseModel):
     user_id: str
 
-# Helper functions
-def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+class ReserveCaptionRequest(BaseModel):
+    count: int = Field(1, ge=1)
 
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+class ReleaseCaptionRequest(BaseModel):
+    user_id: str
+    count: int = Field(1, ge=1)
+    period_start: datetime
 
-def create_jwt_token(user_id: str, email: str) -> dict:
+# Helper functions
+def create_jwt_token(user_id: str, email: str, full_name: str) -> dict:
     """Create JWT token for user"""
     expiration = datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
     payload = {
         "sub": user_id,
         "email": email,
+        # Lets the backend build the same user as /validate-token without asking
+        "full_name": full_name,
         "exp": expiration,
         "iat": datetime.utcnow()
     }
@@ -154,86 +189,88 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     payload = decode_jwt_token(token)
     return payload
 
+async def require_internal_service(x_internal_token: Optional[str] = Header(None, alias=INTERNAL_TOKEN_HEADER)):
+    """Dependency for endpoints only the caption backend may call"""
+    if not INTERNAL_SERVICE_TOKEN or not x_internal_token or not hmac.compare_digest(
+        x_internal_token.encode(), INTERNAL_SERVICE_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Internal service credential required"
+        )
+
 # Routes
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
+        await run_db(repository.ping)
         return {"status": "healthy", "service": "auth"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Database connection failed: {str(e)}"
         )
 
+@app.get("/stats")
+async def stats():
+    """Connection pool and password hashing saturation counters, usage accounting and plan cache state"""
+    return {
+        "db_pool": db_pool.stats(),
+        "password_hashing": password_hasher.stats(),
+        "usage": usage_stats(),
+        "plan_cache": plan_cache_stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Request, query, password hashing, usage flush and plan cache timings and counters for Prometheus"""
+    return Response(
+        render_metrics(db_pool.stats(), password_hasher.stats(), usage_stats(), plan_cache_stats()),
+        media_type=METRICS_CONTENT_TYPE
+    )
+
 @app.post("/signup", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
 async def signup(request: SignupRequest):
     """Register a new user"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Check if user already exists
-            cursor.execute(
-                "SELECT id FROM users WHERE email = %s",
-                (request.email,)
-            )
-            if cursor.fetchone():
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email already registered"
-                )
-            
-            # Hash password
-            password_hash = hash_password(request.password)
-            
-            # Create user
-            cursor.execute(
-                """
-                INSERT INTO users (email, password_hash, full_name, created_at)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, email, full_name, created_at
-                """,
-                (request.email, password_hash, request.full_name, datetime.utcnow())
-            )
-            user = cursor.fetchone()
-            
-            # Get free plan
-            cursor.execute(
-                "SELECT id FROM plans WHERE name = %s",
-                ("Free",)
-            )
-            plan = cursor.fetchone()
-            
-            if not plan:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Default plan not found"
-                )
-            
-            # Create subscription
-            cursor.execute(
-                """
-                INSERT INTO subscriptions (user_id, plan_id, status, start_date)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (user['id'], plan['id'], 'active', datetime.utcnow())
+        # Check if user already exists
+        if await run_db(repository.email_exists, request.email):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
             )
-            
-            # Create JWT token
-            token_data = create_jwt_token(user['id'], user['email'])
-            
-            return TokenResponse(
-                **token_data,
-                user={
-                    "id": user['id'],
-                    "email": user['email'],
-                    "full_name": user['full_name']
-                }
+        
+        # Hash password on the bcrypt pool
+        password_hash = await password_hasher.hash(request.password)
+        
+        # Create user and Free subscription
+        user = await run_db(
+            repository.create_user_with_free_plan,
+            request.email,
+            password_hash,
+            request.full_name
+        )
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Default plan not found"
             )
+        
+        # Create JWT token
+        token_data = create_jwt_token(user['id'], user['email'], user['full_name'])
+        
+        return TokenResponse(
+            **token_data,
+            user={
+                "id": user['id'],
+                "email": user['email'],
+                "full_name": user['full_name']
+            }
+        )
             
     except HTTPException:
         raise
@@ -247,33 +284,25 @@ async def signup(request: SignupRequest):
 async def login(request: LoginRequest):
     """Authenticate user and return token"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get user
-            cursor.execute(
-                "SELECT id, email, password_hash, full_name FROM users WHERE email = %s",
-                (request.email,)
-            )
-            user = cursor.fetchone()
-            
-            if not user or not verify_password(request.password, user['password_hash']):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid email or password"
-                )
-            
-            # Create JWT token
-            token_data = create_jwt_token(user['id'], user['email'])
-            
-            return TokenResponse(
-                **token_data,
-                user={
-                    "id": user['id'],
-                    "email": user['email'],
-                    "full_name": user['full_name']
-                }
+        user = await run_db(repository.get_user_credentials, request.email)
+        
+        if not user or not await password_hasher.verify(request.password, user['password_hash']):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
             )
+        
+        # Create JWT token
+        token_data = create_jwt_token(user['id'], user['email'], user['full_name'])
+        
+        return TokenResponse(
+            **token_data,
+            user={
+                "id": user['id'],
+                "email": user['email'],
+                "full_name": user['full_name']
+            }
+        )
             
     except HTTPException:
         raise
@@ -289,28 +318,22 @@ async def validate_token(request: ValidateTokenRequest):
     try:
         payload = decode_jwt_token(request.token)
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, email, full_name FROM users WHERE id = %s",
-                (payload['sub'],)
+        user = await run_db(repository.get_user, payload['sub'])
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
             )
-            user = cursor.fetchone()
-            
-            if not user:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="User not found"
-                )
-            
-            return {
-                "valid": True,
-                "user": {
-                    "id": user['id'],
-                    "email": user['email'],
-                    "full_name": user['full_name']
-                }
+        
+        return {
+            "valid": True,
+            "user": {
+                "id": user['id'],
+                "email": user['email'],
+                "full_name": user['full_name']
             }
+        }
             
     except HTTPException:
         raise
@@ -324,21 +347,15 @@ async def validate_token(request: ValidateTokenRequest):
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """Get current authenticated user information"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, email, full_name, created_at FROM users WHERE id = %s",
-                (current_user['sub'],)
+        user = await run_db(repository.get_user, current_user['sub'])
+        
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
             )
-            user = cursor.fetchone()
-            
-            if not user:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User not found"
-                )
-            
-            return UserResponse(**user)
+        
+        return UserResponse(**user)
             
     except HTTPException:
         raise
@@ -352,43 +369,22 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 async def get_subscription(current_user: dict = Depends(get_current_user)):
     """Get user's current subscription and usage"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get subscription with plan details
-            cursor.execute(
-                """
-                SELECT 
-                    p.name as plan_name,
-                    s.status,
-                    p.caption_limit,
-                    COALESCE(cu.captions_generated, 0) as captions_generated
-                FROM subscriptions s
-                JOIN plans p ON s.plan_id = p.id
-                LEFT JOIN caption_usage cu ON cu.user_id = s.user_id 
-                    AND cu.period_start <= %s AND cu.period_end >= %s
-                WHERE s.user_id = %s AND s.status = 'active'
-                ORDER BY s.start_date DESC
-                LIMIT 1
-                """,
-                (datetime.utcnow(), datetime.utcnow(), current_user['sub'])
-            )
-            subscription = cursor.fetchone()
-            
-            if not subscription:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="No active subscription found"
-                )
-            
-            captions_remaining = subscription['caption_limit'] - subscription['captions_generated']
-            
-            return SubscriptionResponse(
-                plan_name=subscription['plan_name'],
-                status=subscription['status'],
-                captions_remaining=captions_remaining,
-                captions_limit=subscription['caption_limit']
+        subscription = await subscription_usage(current_user['sub'])
+        
+        if not subscription:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No active subscription found"
             )
+        
+        captions_remaining = subscription['caption_limit'] - subscription['captions_generated']
+        
+        return SubscriptionResponse(
+            plan_name=subscription['plan_name'],
+            status=subscription['status'],
+            captions_remaining=captions_remaining,
+            captions_limit=subscription['caption_limit']
+        )
             
     except HTTPException:
         raise
@@ -398,61 +394,19 @@ async def get_subscription(current_user: dict = Depends(get_current_user)):
             detail=f"Failed to fetch subscription: {str(e)}"
         )
 
-@app.post("/caption/decrement")
-async def decrement_caption_usage(
-    request: DecrementCaptionRequest,
-    current_user: dict = Depends(get_current_user)
-):
+@app.post("/caption/decrement", dependencies=[Depends(require_internal_service)])
+async def decrement_caption_usage(request: DecrementCaptionRequest):
     """Decrement caption usage for a user (internal service call)"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get current period usage
-            now = datetime.utcnow()
-            period_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            next_month = period_start.replace(month=period_start.month + 1) if period_start.month < 12 else period_start.replace(year=period_start.year + 1, month=1)
-            
-            cursor.execute(
-                """
-                SELECT id, captions_generated 
-                FROM caption_usage 
-                WHERE user_id = %s AND period_start = %s
-                """,
-                (request.user_id, period_start)
-            )
-            usage = cursor.fetchone()
-            
-            if usage:
-                # Update existing usage
-                cursor.execute(
-                    """
-                    UPDATE caption_usage 
-                    SET captions_generated = captions_generated + 1,
-                        last_generated_at = %s
-                    WHERE id = %s
-                    RETURNING captions_generated
-                    """,
-                    (now, usage['id'])
-                )
-            else:
-                # Create new usage record
-                cursor.execute(
-                    """
-                    INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
-                    VALUES (%s, %s, %s, 1, %s)
-                    RETURNING captions_generated
-                    """,
-                    (request.user_id, period_start, next_month, now)
-                )
-            
-            result = cursor.fetchone()
-            
-            return {
-                "success": True,
-                "captions_generated": result['captions_generated']
-            }
+        captions_generated = await increment_captions(request.user_id)
+        
+        return {
+            "success": True,
+            "captions_generated": captions_generated
+        }
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -463,49 +417,103 @@ async def decrement_caption_usage(
 async def check_caption_limit(current_user: dict = Depends(get_current_user)):
     """Check if user has remaining captions"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get subscription and usage
-            cursor.execute(
-                """
-                SELECT 
-                    p.caption_limit,
-                    COALESCE(cu.captions_generated, 0) as captions_generated
-                FROM subscriptions s
-                JOIN plans p ON s.plan_id = p.id
-                LEFT JOIN caption_usage cu ON cu.user_id = s.user_id 
-                    AND cu.period_start <= %s AND cu.period_end >= %s
-                WHERE s.user_id = %s AND s.status = 'active'
-                ORDER BY s.start_date DESC
-                LIMIT 1
-                """,
-                (datetime.utcnow(), datetime.utcnow(), current_user['sub'])
+        result = await subscription_usage(current_user['sub'])
+        
+        if not result:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No active subscription found"
             )
-            result = cursor.fetchone()
+        
+        captions_generated = result['captions_generated']
+        has_remaining = captions_generated < result['caption_limit']
+        captions_remaining = result['caption_limit'] - captions_generated
+        
+        return {
+            "has_remaining": has_remaining,
+            "captions_remaining": captions_remaining,
+            "captions_limit": result['caption_limit'],
+            "captions_used": captions_generated
+        }
             
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to check limit: {str(e)}"
+        )
+
+@app.post("/caption/reserve")
+async def reserve_caption(
+    request: ReserveCaptionRequest = ReserveCaptionRequest(),
+    current_user: dict = Depends(get_current_user)
+):
+    """Atomically check the limit and reserve captions for the current period"""
+    try:
+        reservation = await reserve_captions(current_user['sub'], request.count)
+        
+        if not reservation:
+            # Nothing was reserved; find out whether the user is over the limit
+            # or has no subscription at all (rare path, so an extra query is fine)
+            result = await subscription_usage(current_user['sub'])
             if not result:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="No active subscription found"
                 )
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Caption generation limit reached"
+            )
+        
+        return {
+            "reserved": request.count,
+            "period_start": reservation['period_start'],
+            "captions_remaining": reservation['caption_limit'] - reservation['captions_generated'],
+            "captions_limit": reservation['caption_limit'],
+            "captions_used": reservation['captions_generated']
+        }
             
-            has_remaining = result['captions_generated'] < result['caption_limit']
-            captions_remaining = result['caption_limit'] - result['captions_generated']
-            
-            return {
-                "has_remaining": has_remaining,
-                "captions_remaining": captions_remaining,
-                "captions_limit": result['caption_limit'],
-                "captions_used": result['captions_generated']
-            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to reserve caption: {str(e)}"
+        )
+
+@app.post("/caption/release", dependencies=[Depends(require_internal_service)])
+async def release_caption(request: ReleaseCaptionRequest):
+    """Return captions reserved by /caption/reserve when generation failed (caption backend only)
+
+    The user comes from the body, not a Bearer token: jobs and long streams
+    release after the user's token may have expired.
+    """
+    try:
+        captions_generated = await release_captions(
+            request.user_id,
+            request.count,
+            request.period_start
+        )
+        
+        if captions_generated is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No usage found for that period"
+            )
+        
+        return {
+            "released": request.count,
+            "captions_used": captions_generated
+        }
             
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to check limit: {str(e)}"
+            detail=f"Failed to release caption: {str(e)}"
         )
 
 if __name__ == "__main__":
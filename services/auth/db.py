@@ -0,0 +1,212 @@
+"""
+PostgreSQL connection pool for the auth service.
+
+Each uvicorn worker process owns one pool. The pool is opened on startup,
+re-created if the process was forked after it was opened, and hands out
+connections through the get_db_connection() context manager used by the
+routes in app.py. Handlers reach the database through run_db(), which runs
+the blocking psycopg2 work on the threadpool so a slow query never stalls the
+event loop, and times it (telemetry.py).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from telemetry import timed_query
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "caption_gen")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# How long a request may wait for a free connection before getting a 503
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "0.5"))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_IDLE_CHECK_SECONDS = float(os.getenv("DB_POOL_IDLE_CHECK_SECONDS", "30"))
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection became free within the acquire timeout"""
+
+
+class ConnectionPool:
+    """Bounded, health-checked wrapper around psycopg2's ThreadedConnectionPool"""
+
+    def __init__(self, minconn: int, maxconn: int, acquire_timeout: float,
+                 idle_check_seconds: float, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.idle_check_seconds = idle_check_seconds
+        self.connect_kwargs = connect_kwargs
+        self._pool = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            "acquired": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+            "exhausted": 0,
+            "wait_seconds_total": 0.0,
+            "health_check_failures": 0,
+            "discarded": 0,
+        }
+
+    def open(self):
+        """Create the underlying pool for the current process"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                return
+            # A pool inherited across fork shares sockets with the parent;
+            # drop it without closing and start fresh in this process.
+            self._pool = pg_pool.ThreadedConnectionPool(
+                self.minconn, self.maxconn, **self.connect_kwargs
+            )
+            self._pid = os.getpid()
+            self._slots = threading.BoundedSemaphore(self.maxconn)
+            self._last_used = {}
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pid = None
+
+    def _checkout(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats["exhausted"] += 1
+            raise PoolExhaustedError(
+                f"All {self.maxconn} database connections are busy"
+            )
+        waited = time.monotonic() - start
+
+        try:
+            conn = self._pool.getconn()
+            conn = self._ensure_healthy(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+        return conn
+
+    def _ensure_healthy(self, conn):
+        """Ping connections that sat idle long enough to have been dropped"""
+        last_used = self._last_used.get(id(conn))
+        idle_for = time.monotonic() - last_used if last_used is not None else 0
+        if not conn.closed and idle_for < self.idle_check_seconds:
+            return conn
+
+        if not conn.closed:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except psycopg2.Error:
+                pass
+
+        with self._lock:
+            self._stats["health_check_failures"] += 1
+            self._stats["discarded"] += 1
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        return self._pool.getconn()
+
+    def _checkin(self, conn, discard: bool = False):
+        discard = discard or conn.closed or conn.status != psycopg2.extensions.STATUS_READY
+        try:
+            if discard:
+                self._last_used.pop(id(conn), None)
+                with self._lock:
+                    self._stats["discarded"] += 1
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=discard)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error"""
+        if self._pool is None or self._pid != os.getpid():
+            self.open()
+        conn = self._checkout()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self._checkin(conn, discard=discard)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        stats["saturation"] = round(stats["in_use"] / self.maxconn, 4) if self.maxconn else 0.0
+        stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 6)
+        return stats
+
+
+db_pool = ConnectionPool(
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_IDLE_CHECK_SECONDS,
+    host=DB_HOST,
+    port=DB_PORT,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    cursor_factory=RealDictCursor,
+)
+
+
+@contextmanager
+def get_db_connection():
+    """Pooled database connection; pool exhaustion becomes a 503"""
+    try:
+        with db_pool.connection() as conn:
+            yield conn
+    except PoolExhaustedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Database busy, please retry: {str(e)}",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking data-access function off the event loop, timed as a query named after it"""
+    return await run_in_threadpool(timed_query, fn, *args, **kwargs)
@@ -0,0 +1,152 @@
+"""
+Concurrency load test for the auth service.
+
+Drives one endpoint at increasing concurrency levels and reports throughput
+and latency for each level. When handlers block the event loop, throughput
+stays flat as concurrency grows; with database work on the threadpool it
+should scale until the connection pool or CPU saturates.
+
+Run against a single worker so the numbers are per-worker:
+
+    uvicorn app:app --port 4000 --workers 1
+    python loadtest.py --endpoint check-limit --concurrency 1,2,4,8,16
+
+Only the standard library is used so it runs from any Python 3 environment.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = {
+    "health": ("GET", "/health", False),
+    "validate-token": ("POST", "/validate-token", False),
+    "me": ("GET", "/me", True),
+    "subscription": ("GET", "/subscription", True),
+    "check-limit": ("GET", "/caption/check-limit", True),
+}
+
+
+def call(base_url: str, method: str, path: str, token: str = None, body: dict = None) -> int:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(f"{base_url}{path}", data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def get_token(base_url: str, email: str, password: str) -> str:
+    """Log in, creating the account first if it does not exist yet"""
+    for path, body in (
+        ("/login", {"email": email, "password": password}),
+        ("/signup", {"email": email, "password": password, "full_name": "Load Test"}),
+    ):
+        req = urllib.request.Request(
+            f"{base_url}{path}",
+            data=json.dumps(body).encode("utf-8"),
+            method="POST",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                return json.loads(resp.read())["access_token"]
+        except urllib.error.HTTPError:
+            continue
+    raise SystemExit("Could not log in or sign up the load test user")
+
+
+def run_level(base_url: str, endpoint: str, token: str, concurrency: int, duration: float) -> dict:
+    method, path, needs_auth = ENDPOINTS[endpoint]
+    body = {"token": token} if endpoint == "validate-token" else None
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            code = call(base_url, method, path, token if needs_auth else None, body)
+            local_latencies.append(time.perf_counter() - start)
+            if code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def pct(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:4000")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="check-limit")
+    parser.add_argument("--concurrency", default="1,2,4,8,16",
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Seconds to run each level")
+    parser.add_argument("--email", default=f"loadtest-{uuid.uuid4().hex[:8]}@example.com")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    token = get_token(args.url, args.email, args.password)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    results = [run_level(args.url, args.endpoint, token, level, args.duration) for level in levels]
+
+    # Scaling relative to the lowest concurrency level: 1.0 means requests
+    # serialized, values approaching the concurrency ratio mean they overlap.
+    baseline = results[0]["throughput_rps"] or 1.0
+    for result in results:
+        result["speedup"] = round(result["throughput_rps"] / baseline, 2)
+
+    if args.json:
+        print(json.dumps({"endpoint": args.endpoint, "results": results}, indent=2))
+        return
+
+    print(f"Endpoint: {args.endpoint}  ({args.duration:.0f}s per level)")
+    print(f"{'conc':>5} {'reqs':>7} {'err':>5} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>5} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['speedup']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Password hashing for the auth service.
+
+bcrypt costs on the order of 100-300 ms of CPU per call at the default work
+factor. Running it inside an async handler freezes the whole worker, so all
+hashing goes through a small dedicated thread pool (bcrypt releases the GIL
+while it works). The pool has a bounded backlog; once it is full new
+signups/logins are shed with a 429 instead of queueing behind each other and
+starving cheap endpoints such as /validate-token.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+from telemetry import password_hash_timings
+
+load_dotenv()
+
+# bcrypt work factor for new hashes; existing hashes keep the cost they were created with
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads doing bcrypt work; keep below the pod's CPU count so other requests still get CPU
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash operations allowed to wait for a free thread before new ones get a 429
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "16"))
+
+
+def hash_password(password: str) -> str:
+    """Hash password using bcrypt"""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    """Verify password against hash"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Bounded executor for bcrypt calls with load shedding and counters"""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "completed": 0,
+            "rejected": 0,
+            "peak_in_flight": 0,
+            "cpu_seconds_total": 0.0,
+            "queue_wait_seconds_total": 0.0,
+        }
+
+    def _reserve(self):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._stats["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many concurrent sign-ins, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._in_flight += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _timed(self, fn, submitted_at: float, *args):
+        started = time.monotonic()
+        cpu_start = time.thread_time()
+        try:
+            return fn(*args)
+        finally:
+            password_hash_timings.observe(fn.__name__, time.monotonic() - started)
+            cpu = time.thread_time() - cpu_start
+            with self._lock:
+                # Only calls that actually ran count, so the averages are per bcrypt call
+                self._stats["completed"] += 1
+                self._stats["cpu_seconds_total"] += cpu
+                self._stats["queue_wait_seconds_total"] += started - submitted_at
+
+    async def run(self, fn, *args):
+        self._reserve()
+        try:
+            future = self._executor.submit(self._timed, fn, time.monotonic(), *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is freed when the bcrypt call is done, not when the caller stops waiting:
+        # a cancelled request (client gone) must not let more work pile up behind one still running.
+        # A call still queued when its caller is cancelled is cancelled too, which also frees it.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(verify_password, password, hashed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        completed = stats["completed"] or 1
+        stats.update({
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "in_flight": in_flight,
+            "queue_depth": max(0, in_flight - self.workers),
+            "avg_cpu_ms": round(stats["cpu_seconds_total"] / completed * 1000, 2),
+            "avg_queue_wait_ms": round(stats["queue_wait_seconds_total"] / completed * 1000, 2),
+        })
+        stats["cpu_seconds_total"] = round(stats["cpu_seconds_total"], 4)
+        stats["queue_wait_seconds_total"] = round(stats["queue_wait_seconds_total"], 4)
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
@@ -0,0 +1,248 @@
+"""
+In-process cache of plans and each user's active subscription.
+
+/caption/check-limit, /subscription and /caption/reserve all need the user's
+plan and caption limit. Plans almost never change and subscriptions change
+rarely, so each process keeps:
+
+- every row of `plans`, loaded at startup and reloaded when plans change
+- each user's latest active subscription (plan and status, or "none"),
+  loaded on first use
+
+Entries are dropped when the database says they changed. Triggers on
+`subscriptions` and `plans` (infrastructure/db/init.sql) NOTIFY
+`subscription_changes` (with the user ID) and `plan_changes`, and a listener
+thread here holds one dedicated connection that LISTENs on both channels.
+With the cache warm, check-limit costs one usage lookup, or none when
+write-behind usage (usage.py) already knows the total.
+
+The cache only answers while the listener is connected. When the connection
+drops, everything is cleared and lookups go to the database until the
+listener is back. Reconnecting clears the cache again, because notifications
+sent in between are lost. The listener checks that the triggers are installed
+before each connection and, while they are missing or the database is
+unreachable, retries every PLAN_CACHE_RECONNECT_SECONDS with the cache off.
+PLAN_CACHE_TTL_SECONDS bounds how long any entry is used, as a backstop.
+
+/stats and /metrics report hits and misses, entries, whether the listener is
+connected, invalidations by reason, the age of the entries served, and the
+lag from a subscription write to its invalidation here.
+"""
+import os
+import select
+import threading
+import time
+from typing import Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+import repository
+from db import db_pool, run_db
+from telemetry import plan_cache_entry_age, plan_cache_notification_lag
+
+load_dotenv()
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+# Longest time an entry is used, notification or not
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", "300"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "100000"))
+# Wait between attempts to reconnect the listener
+PLAN_CACHE_RECONNECT_SECONDS = float(os.getenv("PLAN_CACHE_RECONNECT_SECONDS", "5"))
+
+SUBSCRIPTION_CHANNEL = "subscription_changes"
+PLAN_CHANNEL = "plan_changes"
+
+_MISS = object()
+
+
+class PlanCache:
+    """Plans by ID and active subscriptions by user, invalidated by LISTEN/NOTIFY"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int, reconnect_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.reconnect_seconds = reconnect_seconds
+        self._lock = threading.Lock()
+        self._plans = {}
+        # user_id -> (subscription row or None, loaded at)
+        self._subscriptions = {}
+        # Bumped by every invalidation; a load that raced one is not stored
+        self._generation = 0
+        self.listening = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0}
+        self._invalidations = {}
+
+    def start(self):
+        """Start the listener thread; until it is connected every lookup goes to the database"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="plan-cache-listener", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _invalidate(self, reason: str, user_id: str = None):
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._subscriptions.clear()
+            else:
+                self._subscriptions.pop(user_id, None)
+            self._invalidations[reason] = self._invalidations.get(reason, 0) + 1
+
+    def _reload_plans(self):
+        plans = {str(plan['id']): plan for plan in repository.list_plans()}
+        with self._lock:
+            self._plans = plans
+
+    def _triggers_installed(self) -> Optional[str]:
+        """None when the NOTIFY triggers are in place, else why the cache has to stay off"""
+        try:
+            if repository.change_notifications_installed():
+                return None
+        except Exception as e:
+            return f"could not check for change notification triggers: {str(e)}"
+        return "the subscriptions/plans NOTIFY triggers are not installed"
+
+    def _listen(self):
+        last_problem = None
+        while not self._stop.is_set():
+            problem = self._triggers_installed()
+            if problem is not None:
+                # Printed once per change, not on every retry
+                if problem != last_problem:
+                    print(f"Plan cache off: {problem}; retrying every {self.reconnect_seconds:g}s")
+                last_problem = problem
+                self._stop.wait(self.reconnect_seconds)
+                continue
+            if last_problem is not None:
+                print("Plan cache: change notification triggers found, connecting the listener")
+                last_problem = None
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_pool.connect_kwargs)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {SUBSCRIPTION_CHANNEL}; LISTEN {PLAN_CHANNEL}")
+                # Anything cached may have changed while nobody was listening
+                self._reload_plans()
+                self._invalidate("reconnect")
+                self.listening = True
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        self._handle(conn.notifies)
+                        conn.notifies.clear()
+            except Exception as e:
+                if self.listening:
+                    print(f"Plan cache listener lost its connection: {str(e)}")
+                else:
+                    print(f"Plan cache listener could not connect: {str(e)}")
+            finally:
+                self.listening = False
+                self._invalidate("disconnect")
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(self.reconnect_seconds)
+
+    def _handle(self, notifications: list):
+        now = time.time()
+        for notification in notifications:
+            # "<user id> <epoch seconds>" / "<epoch seconds>", written by the triggers
+            fields = notification.payload.split()
+            if notification.channel == PLAN_CHANNEL:
+                self._reload_plans()
+                self._invalidate("plan")
+            else:
+                self._invalidate("subscription", fields[0] if fields else None)
+            try:
+                plan_cache_notification_lag.observe(notification.channel, max(0.0, now - float(fields[-1])))
+            except (IndexError, ValueError):
+                pass
+
+    def lookup(self, user_id: str):
+        """The user's cached active plan (None: no active subscription), or _MISS"""
+        with self._lock:
+            if not self.listening:
+                self._stats["bypassed"] += 1
+                return _MISS
+            cached = self._subscriptions.get(user_id)
+            if cached is not None:
+                subscription, loaded_at = cached
+                age = time.monotonic() - loaded_at
+                plan = self._plans.get(str(subscription['plan_id'])) if subscription else None
+                if age < self.ttl_seconds and (subscription is None or plan is not None):
+                    self._stats["hits"] += 1
+                    plan_cache_entry_age.observe(age)
+                    return self._active_plan(subscription, plan)
+                if age >= self.ttl_seconds:
+                    del self._subscriptions[user_id]
+                    self._invalidations["ttl"] = self._invalidations.get("ttl", 0) + 1
+            self._stats["misses"] += 1
+            return _MISS
+
+    @staticmethod
+    def _active_plan(subscription: Optional[dict], plan: Optional[dict]) -> Optional[dict]:
+        if subscription is None:
+            return None
+        return {"plan_name": plan['name'], "status": subscription['status'], "caption_limit": plan['caption_limit']}
+
+    def load_active_plan(self, user_id: str) -> Optional[dict]:
+        """Read the user's active plan from the database and cache it if nothing changed meanwhile"""
+        generation = self._generation
+        subscription = repository.get_active_subscription(user_id)
+        with self._lock:
+            plan = self._plans.get(str(subscription['plan_id'])) if subscription else None
+        if subscription is not None and plan is None:
+            # A plan added after the last reload
+            self._reload_plans()
+            with self._lock:
+                plan = self._plans.get(str(subscription['plan_id']))
+            if plan is None:
+                return None
+        with self._lock:
+            if self.listening and generation == self._generation:
+                if len(self._subscriptions) >= self.max_entries:
+                    self._subscriptions.pop(next(iter(self._subscriptions)))
+                self._subscriptions[user_id] = (subscription, time.monotonic())
+        return self._active_plan(subscription, plan)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._subscriptions), plans=len(self._plans),
+                         invalidations=dict(self._invalidations))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["listening"] = self.listening
+        stats["ttl_seconds"] = self.ttl_seconds
+        _, served, age_total = plan_cache_entry_age.snapshot()
+        stats["mean_entry_age_seconds"] = round(age_total / served, 3) if served else 0.0
+        stats["notification_lag_seconds"] = {
+            channel: round(histogram.sum / histogram.count, 4) if histogram.count else 0.0
+            for channel, histogram in plan_cache_notification_lag.items()
+        }
+        return stats
+
+
+plan_cache = PlanCache(PLAN_CACHE_TTL_SECONDS, PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_RECONNECT_SECONDS) \
+    if PLAN_CACHE_ENABLED else None
+
+
+async def active_plan(user_id: str) -> Optional[dict]:
+    """Plan name, subscription status and caption limit of the user's active subscription, or None"""
+    cached = plan_cache.lookup(user_id)
+    if cached is not _MISS:
+        return cached
+    return await run_db(plan_cache.load_active_plan, user_id)
+
+
+def plan_cache_stats() -> dict:
+    stats = plan_cache.stats() if plan_cache is not None else {}
+    return {"enabled": plan_cache is not None, **stats}
@@ -0,0 +1,297 @@
+"""
+Data access for the auth service.
+
+Every function here is synchronous and borrows one pooled connection for the
+duration of a single unit of work. Route handlers must not call them directly
+from the event loop; use ``await run_db(fn, ...)`` so the blocking psycopg2
+calls run on the threadpool.
+"""
+from datetime import datetime
+from typing import Optional
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+
+
+def current_period(now: datetime) -> tuple:
+    """Start and end of the monthly billing period containing ``now``"""
+    period_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    next_month = period_start.replace(month=period_start.month + 1) if period_start.month < 12 else period_start.replace(year=period_start.year + 1, month=1)
+    return period_start, next_month
+
+
+def ping():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+
+
+def email_exists(email: str) -> bool:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id FROM users WHERE email = %s",
+            (email,)
+        )
+        return cursor.fetchone() is not None
+
+
+def create_user_with_free_plan(email: str, password_hash: str, full_name: str) -> Optional[dict]:
+    """Insert a user and their Free subscription in one transaction.
+
+    Returns None (and rolls back) when the Free plan is missing.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT id FROM plans WHERE name = %s",
+            ("Free",)
+        )
+        plan = cursor.fetchone()
+        if not plan:
+            return None
+
+        cursor.execute(
+            """
+            INSERT INTO users (email, password_hash, full_name, created_at)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id, email, full_name, created_at
+            """,
+            (email, password_hash, full_name, datetime.utcnow())
+        )
+        user = cursor.fetchone()
+
+        cursor.execute(
+            """
+            INSERT INTO subscriptions (user_id, plan_id, status, start_date)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (user['id'], plan['id'], 'active', datetime.utcnow())
+        )
+        return user
+
+
+def get_user_credentials(email: str) -> Optional[dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, email, password_hash, full_name FROM users WHERE email = %s",
+            (email,)
+        )
+        return cursor.fetchone()
+
+
+def get_user(user_id: str) -> Optional[dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, email, full_name, created_at FROM users WHERE id = %s",
+            (user_id,)
+        )
+        return cursor.fetchone()
+
+
+def list_plans() -> list:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, caption_limit FROM plans")
+        return cursor.fetchall()
+
+
+def get_active_subscription(user_id: str) -> Optional[dict]:
+    """Plan and status of the user's latest active subscription"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT plan_id, status
+            FROM subscriptions
+            WHERE user_id = %s AND status = 'active'
+            ORDER BY start_date DESC
+            LIMIT 1
+            """,
+            (user_id,)
+        )
+        return cursor.fetchone()
+
+
+def get_period_usage(user_id: str) -> int:
+    """Captions counted for the user's current billing period"""
+    period_start, _ = current_period(datetime.utcnow())
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT captions_generated FROM caption_usage WHERE user_id = %s AND period_start = %s",
+            (user_id, period_start)
+        )
+        row = cursor.fetchone()
+        return row['captions_generated'] if row else 0
+
+
+def change_notifications_installed() -> bool:
+    """True if the subscriptions and plans triggers that NOTIFY on writes exist"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT count(*) AS installed FROM pg_trigger
+            WHERE tgname IN ('notify_subscriptions_change', 'notify_plans_change') AND NOT tgisinternal
+            """
+        )
+        return cursor.fetchone()['installed'] == 2
+
+
+def get_active_subscription_usage(user_id: str) -> Optional[dict]:
+    """Latest active subscription joined with its plan and current-period usage"""
+    period_start, _ = current_period(datetime.utcnow())
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT
+                p.name as plan_name,
+                s.status,
+                p.caption_limit,
+                COALESCE(cu.captions_generated, 0) as captions_generated
+            FROM subscriptions s
+            JOIN plans p ON s.plan_id = p.id
+            LEFT JOIN caption_usage cu ON cu.user_id = s.user_id AND cu.period_start = %s
+            WHERE s.user_id = %s AND s.status = 'active'
+            ORDER BY s.start_date DESC
+            LIMIT 1
+            """,
+            (period_start, user_id)
+        )
+        return cursor.fetchone()
+
+
+def increment_caption_usage(user_id: str) -> int:
+    """Add one caption to the user's current-period usage and return the total"""
+    now = datetime.utcnow()
+    period_start, period_end = current_period(now)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
+            VALUES (%s, %s, %s, 1, %s)
+            ON CONFLICT (user_id, period_start) DO UPDATE
+                SET captions_generated = caption_usage.captions_generated + 1,
+                    last_generated_at = EXCLUDED.last_generated_at
+            RETURNING captions_generated
+            """,
+            (user_id, period_start, period_end, now)
+        )
+        return cursor.fetchone()['captions_generated']
+
+
+def reserve_captions(user_id: str, count: int = 1, caption_limit: int = None) -> Optional[dict]:
+    """Atomically check the plan limit and add ``count`` captions to usage.
+
+    A single INSERT ... ON CONFLICT DO UPDATE both creates the period's usage
+    row and increments it, and its WHERE clause refuses the update when the
+    new total would exceed the plan limit, so concurrent reservations cannot
+    overshoot. The limit is looked up from the user's active subscription,
+    unless the caller already knows it (plan_cache.py). Returns the new usage
+    and limit, or None when nothing was reserved (no active subscription or
+    limit reached).
+    """
+    now = datetime.utcnow()
+    period_start, period_end = current_period(now)
+    params = {
+        "user_id": user_id,
+        "period_start": period_start,
+        "period_end": period_end,
+        "count": count,
+        "now": now,
+        "caption_limit": caption_limit,
+    }
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if caption_limit is not None:
+            cursor.execute(
+                """
+                INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
+                SELECT %(user_id)s::uuid, %(period_start)s, %(period_end)s, %(count)s, %(now)s
+                WHERE %(count)s <= %(caption_limit)s
+                ON CONFLICT (user_id, period_start) DO UPDATE
+                    SET captions_generated = caption_usage.captions_generated + EXCLUDED.captions_generated,
+                        last_generated_at = EXCLUDED.last_generated_at
+                    WHERE caption_usage.captions_generated + EXCLUDED.captions_generated <= %(caption_limit)s
+                RETURNING captions_generated, period_start, %(caption_limit)s AS caption_limit
+                """,
+                params
+            )
+            return cursor.fetchone()
+        cursor.execute(
+            """
+            WITH plan AS (
+                SELECT p.caption_limit
+                FROM subscriptions s
+                JOIN plans p ON s.plan_id = p.id
+                WHERE s.user_id = %(user_id)s AND s.status = 'active'
+                ORDER BY s.start_date DESC
+                LIMIT 1
+            )
+            INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
+            SELECT %(user_id)s::uuid, %(period_start)s, %(period_end)s, %(count)s, %(now)s
+            FROM plan
+            WHERE %(count)s <= plan.caption_limit
+            ON CONFLICT (user_id, period_start) DO UPDATE
+                SET captions_generated = caption_usage.captions_generated + EXCLUDED.captions_generated,
+                    last_generated_at = EXCLUDED.last_generated_at
+                WHERE caption_usage.captions_generated + EXCLUDED.captions_generated
+                    <= (SELECT caption_limit FROM plan)
+            RETURNING captions_generated, period_start, (SELECT caption_limit FROM plan) AS caption_limit
+            """,
+            params
+        )
+        return cursor.fetchone()
+
+
+def release_captions(user_id: str, count: int, period_start: datetime) -> Optional[int]:
+    """Give back ``count`` previously reserved captions; returns the new total"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE caption_usage
+            SET captions_generated = GREATEST(captions_generated - %s, 0)
+            WHERE user_id = %s AND period_start = %s
+            RETURNING captions_generated
+            """,
+            (count, user_id, period_start)
+        )
+        row = cursor.fetchone()
+        return row['captions_generated'] if row else None
+
+
+def add_caption_usage(rows: list, page_size: int = 500) -> dict:
+    """Add counted captions to many users' usage rows in batched multi-row upserts.
+
+    ``rows`` are (user_id, period_start, period_end, count, last_generated_at).
+    They are written in key order, so two processes flushing overlapping users
+    lock the rows in the same order and cannot deadlock. Returns the new
+    totals by (user_id, period_start).
+    """
+    rows = sorted(rows, key=lambda row: (str(row[0]), row[1]))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        returned = execute_values(
+            cursor,
+            """
+            INSERT INTO caption_usage (user_id, period_start, period_end, captions_generated, last_generated_at)
+            VALUES %s
+            ON CONFLICT (user_id, period_start) DO UPDATE
+                SET captions_generated = caption_usage.captions_generated + EXCLUDED.captions_generated,
+                    last_generated_at = GREATEST(caption_usage.last_generated_at, EXCLUDED.last_generated_at)
+            RETURNING user_id, period_start, captions_generated
+            """,
+            rows,
+            template="(%s::uuid, %s, %s, %s, %s)",
+            page_size=page_size,
+            fetch=True,
+        )
+        return {(str(row['user_id']), row['period_start']): row['captions_generated'] for row in returned}
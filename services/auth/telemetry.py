@@ -0,0 +1,269 @@
+"""
+Request IDs, timings and Prometheus metrics for the auth service.
+
+- Each request's ID is the caller's X-Request-ID (the caption backend sends
+  the ID of the request it is serving) or a new one. It is echoed in the
+  response and printed with slow queries.
+- run_db() (db.py) times every data-access call in repository.py by name, on
+  the thread that runs it. The time includes waiting for a pooled connection
+  but not waiting for a threadpool thread.
+- passwords.py times each bcrypt operation.
+- usage.py times each write-behind flush of caption usage by what triggered it.
+- plan_cache.py records the age of each cached plan it serves and how long
+  change notifications took to arrive.
+
+/metrics renders these, the per-endpoint request timings and the connection
+pool, password hashing, usage and plan cache counters in the Prometheus text
+format. Numbers are per process; the image runs one uvicorn process per pod.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Data-access calls slower than this are printed with the request ID; 0 turns it off
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket is +Inf
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Cached entries live from a fresh load up to PLAN_CACHE_TTL_SECONDS
+CACHE_AGE_BUCKETS = (0.1, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket duration histogram in seconds"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    return
+            self.counts[-1] += 1
+
+    def snapshot(self) -> tuple:
+        """([(le, cumulative count)], count, sum)"""
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        cumulative = 0
+        buckets = []
+        for bound, n in zip([repr(float(b)) for b in self.buckets] + ["+Inf"], counts):
+            cumulative += n
+            buckets.append((bound, cumulative))
+        return buckets, count, total
+
+
+class Timings:
+    """Histogram and error count per name (query, endpoint, operation)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.errors = {}
+
+    def observe(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        histogram.observe(seconds)
+
+    def items(self) -> list:
+        with self._lock:
+            return sorted(self.histograms.items())
+
+    def error_counts(self) -> dict:
+        with self._lock:
+            return dict(self.errors)
+
+
+class RequestCounts:
+    """Requests by endpoint, method and status"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, endpoint: str, method: str, status: int):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def items(self) -> list:
+        with self._lock:
+            return sorted(self.counts.items())
+
+
+request_timings = Timings()
+request_counts = RequestCounts()
+db_query_timings = Timings()
+password_hash_timings = Timings()
+usage_flush_timings = Timings()
+plan_cache_notification_lag = Timings()
+plan_cache_entry_age = Histogram(CACHE_AGE_BUCKETS)
+
+
+def new_request_id(incoming: str = None) -> str:
+    """The caller's request ID if it is usable, a fresh one otherwise"""
+    if incoming and _REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def set_request_id(request_id: str):
+    _request_id.set(request_id)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def record_request(endpoint: str, method: str, status: int, seconds: float):
+    request_counts.add(endpoint, method, status)
+    request_timings.observe(endpoint, seconds)
+
+
+def timed_query(fn, *args, **kwargs):
+    """Call a repository function, timing it as one query"""
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = fn(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        db_query_timings.observe(fn.__name__, elapsed, error=failed)
+        if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            print(f"Slow query {fn.__name__}: {elapsed * 1000:.0f}ms (request {current_request_id()})")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def _header(lines: list, name: str, kind: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _histograms(lines: list, name: str, help_text: str, label: str, timings: Timings):
+    _header(lines, name, "histogram", help_text)
+    for key, histogram in timings.items():
+        buckets, count, total = histogram.snapshot()
+        for bound, cumulative in buckets:
+            lines.append(f"{name}_bucket{_labels({label: key, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels({label: key})} {total!r}")
+        lines.append(f"{name}_count{_labels({label: key})} {count}")
+
+
+def _values(lines: list, name: str, kind: str, help_text: str, samples: list):
+    _header(lines, name, kind, help_text)
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {value!r}")
+
+
+def render_metrics(db_pool_stats: dict, password_hashing_stats: dict, usage_stats: dict,
+                   plan_cache_stats: dict) -> str:
+    """Prometheus text exposition format (0.0.4)"""
+    lines = []
+    _values(lines, "auth_http_requests_total", "counter", "HTTP requests by endpoint, method and status", [
+        ({"endpoint": endpoint, "method": method, "status": status}, count)
+        for (endpoint, method, status), count in request_counts.items()
+    ])
+    _histograms(lines, "auth_http_request_duration_seconds", "Request latency by endpoint",
+                "endpoint", request_timings)
+    _histograms(lines, "auth_db_query_duration_seconds",
+                "Data-access call latency by repository function, pool wait included", "query", db_query_timings)
+    _values(lines, "auth_db_query_errors_total", "counter", "Data-access calls that raised", [
+        ({"query": query}, count) for query, count in sorted(db_query_timings.error_counts().items())
+    ])
+    _histograms(lines, "auth_password_hash_duration_seconds", "bcrypt operation latency, queue wait excluded",
+                "operation", password_hash_timings)
+
+    _values(lines, "auth_db_pool_in_use", "gauge", "Database connections checked out",
+            [({}, db_pool_stats["in_use"])])
+    _values(lines, "auth_db_pool_max_size", "gauge", "Database connections the pool may open",
+            [({}, db_pool_stats["max_size"])])
+    _values(lines, "auth_db_pool_acquired_total", "counter", "Connections handed out",
+            [({}, db_pool_stats["acquired"])])
+    _values(lines, "auth_db_pool_exhausted_total", "counter", "Requests turned away with no free connection (503)",
+            [({}, db_pool_stats["exhausted"])])
+    _values(lines, "auth_db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection",
+            [({}, float(db_pool_stats["wait_seconds_total"]))])
+    _values(lines, "auth_password_hash_in_flight", "gauge", "bcrypt operations running or queued",
+            [({}, password_hashing_stats["in_flight"])])
+    _values(lines, "auth_password_hash_rejected_total", "counter", "bcrypt operations shed with 429",
+            [({}, password_hashing_stats["rejected"])])
+
+    if usage_stats["mode"] == "write-behind":
+        _histograms(lines, "auth_usage_flush_duration_seconds",
+                    "Write-behind usage flush latency by trigger (interval, size, exact, shutdown)",
+                    "trigger", usage_flush_timings)
+        _values(lines, "auth_usage_flush_errors_total", "counter", "Usage flushes that failed", [
+            ({"trigger": trigger}, count) for trigger, count in sorted(usage_flush_timings.error_counts().items())
+        ])
+        _values(lines, "auth_usage_pending_captions", "gauge", "Captions counted in memory and not yet written",
+                [({}, usage_stats["pending_captions"])])
+        _values(lines, "auth_usage_pending_users", "gauge", "Users with captions not yet written",
+                [({}, usage_stats["pending_users"])])
+        _values(lines, "auth_usage_flushed_rows_total", "counter", "caption_usage rows written by flushes",
+                [({}, usage_stats["flushed_rows"])])
+        _values(lines, "auth_usage_flushed_captions_total", "counter", "Captions written by flushes",
+                [({}, usage_stats["flushed_captions"])])
+        _values(lines, "auth_usage_reservations_total", "counter",
+                "Reservations granted from memory (local) or decided by the database (exact)", [
+                    ({"path": "local"}, usage_stats["local_reservations"]),
+                    ({"path": "exact"}, usage_stats["exact_reservations"]),
+                ])
+
+    if plan_cache_stats["enabled"]:
+        _values(lines, "auth_plan_cache_lookups_total", "counter",
+                "Plan lookups answered from memory (hit), loaded (miss) or sent to the database while not listening",
+                [({"result": "hit"}, plan_cache_stats["hits"]),
+                 ({"result": "miss"}, plan_cache_stats["misses"]),
+                 ({"result": "bypassed"}, plan_cache_stats["bypassed"])])
+        _values(lines, "auth_plan_cache_entries", "gauge", "Users whose active plan is cached",
+                [({}, plan_cache_stats["entries"])])
+        _values(lines, "auth_plan_cache_listening", "gauge", "1 while the change notification listener is connected",
+                [({}, int(plan_cache_stats["listening"]))])
+        _values(lines, "auth_plan_cache_invalidations_total", "counter", "Cache entries dropped, by reason", [
+            ({"reason": reason}, count) for reason, count in sorted(plan_cache_stats["invalidations"].items())
+        ])
+        _histograms(lines, "auth_plan_cache_notification_lag_seconds",
+                    "Time from a subscriptions/plans write to its notification arriving here",
+                    "channel", plan_cache_notification_lag)
+        _header(lines, "auth_plan_cache_entry_age_seconds", "histogram", "Age of the cached entries served")
+        buckets, count, total = plan_cache_entry_age.snapshot()
+        for bound, cumulative in buckets:
+            lines.append(f"auth_plan_cache_entry_age_seconds_bucket{_labels({'le': bound})} {cumulative}")
+        lines.append(f"auth_plan_cache_entry_age_seconds_sum {total!r}")
+        lines.append(f"auth_plan_cache_entry_age_seconds_count {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,301 @@
+import threading
+import time
+import types
+from datetime import datetime
+
+import pytest
+
+import repository
+import usage
+from usage import WriteBehindUsage
+
+USER = "user-1"
+LIMIT = 100
+TOLERANCE = 10
+
+
+class FakeRepository:
+    """The caption_usage queries WriteBehindUsage uses, over a dict"""
+
+    current_period = staticmethod(repository.current_period)
+
+    def __init__(self, limit: int = LIMIT):
+        self.limit = limit
+        self.totals = {}
+        self.calls = []
+        # Flushes to fail before succeeding again
+        self.failures = 0
+        # Set to an Event to hold add_caption_usage until it is set
+        self.hold = None
+        self.flushing = threading.Event()
+
+    def add_caption_usage(self, rows, page_size=500):
+        self.calls.append(("add", sorted((row[0], row[3]) for row in rows)))
+        self.flushing.set()
+        if self.hold is not None:
+            self.hold.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        totals = {}
+        for user_id, period_start, _, count, _ in rows:
+            key = (user_id, period_start)
+            totals[key] = self.totals[key] = self.totals.get(key, 0) + count
+        return totals
+
+    def reserve_captions(self, user_id, count=1, caption_limit=None):
+        self.calls.append(("reserve", count))
+        period_start, _ = self.current_period(datetime.utcnow())
+        limit = caption_limit if caption_limit is not None else self.limit
+        total = self.totals.get((user_id, period_start), 0) + count
+        if total > limit:
+            return None
+        self.totals[(user_id, period_start)] = total
+        return {"captions_generated": total, "period_start": period_start, "caption_limit": limit}
+
+    def release_captions(self, user_id, count, period_start):
+        self.calls.append(("release", count))
+        key = (user_id, period_start)
+        if key not in self.totals:
+            return None
+        self.totals[key] = max(0, self.totals[key] - count)
+        return self.totals[key]
+
+    def total(self, user_id=USER) -> int:
+        return self.totals.get((user_id, self.current_period(datetime.utcnow())[0]), 0)
+
+
+class FakeTime:
+    """usage.time with a settable monotonic clock and sleeps that only get recorded"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.perf_counter = time.perf_counter
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeRepository()
+    monkeypatch.setattr(usage, "repository", fake)
+    return fake
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(usage, "time", types.SimpleNamespace(
+        monotonic=fake.monotonic, perf_counter=fake.perf_counter, sleep=fake.sleep))
+    return fake
+
+
+@pytest.fixture
+def counter(db, clock):
+    counter = WriteBehindUsage(flush_interval=60, max_pending=1000, batch_size=500, tolerance=TOLERANCE,
+                               sync_seconds=5)
+    yield counter
+    if counter._thread is not None:
+        counter._stop.set()
+        counter._wake.set()
+        counter._thread.join(5)
+
+
+def reserve(counter, count=1, caption_limit=None):
+    """What usage.reserve_captions does: memory first, the exact path when it declines"""
+    return counter.reserve_local(USER, count, caption_limit) or counter.reserve_exact(USER, count, caption_limit)
+
+
+def period_start():
+    return repository.current_period(datetime.utcnow())[0]
+
+
+def test_first_reservation_is_exact_then_local(counter, db):
+    assert reserve(counter)["captions_generated"] == 1
+    assert db.calls == [("reserve", 1)]
+    assert reserve(counter, 2)["captions_generated"] == 3
+    assert db.calls == [("reserve", 1)]
+    assert counter.pending(USER) == 2
+    assert counter.stats()["local_reservations"] == 1
+
+
+def test_pending_per_user_is_capped_at_the_tolerance(counter, db):
+    reserve(counter)
+    for _ in range(TOLERANCE):
+        counter.reserve_local(USER, 1)
+    assert counter.pending(USER) == TOLERANCE
+    assert counter.reserve_local(USER, 1) is None
+    # The exact path writes the pending captions before reserving
+    assert reserve(counter)["captions_generated"] == 1 + TOLERANCE + 1
+    assert db.calls[-2:] == [("add", [(USER, TOLERANCE)]), ("reserve", 1)]
+    assert counter.pending(USER) == 0
+
+
+def test_reservation_near_the_limit_falls_back_to_exact(counter, db):
+    db.totals[(USER, period_start())] = 84
+    reserve(counter)
+    assert counter.known_total(USER) == 85
+    # 85 + 5 = 90 keeps TOLERANCE of headroom below 100; one more does not
+    assert counter.reserve_local(USER, 5)["captions_generated"] == 90
+    assert counter.reserve_local(USER, 1) is None
+    assert reserve(counter, 1)["captions_generated"] == 91
+    assert db.calls[-2:] == [("add", [(USER, 5)]), ("reserve", 1)]
+
+
+def test_exact_path_refuses_past_the_limit_and_keeps_the_count(counter, db):
+    db.totals[(USER, period_start())] = 95
+    reserve(counter)
+    assert reserve(counter, 5) is None
+    assert db.total() == 96
+    assert reserve(counter, 4)["captions_generated"] == 100
+
+
+def test_plan_cache_limit_overrides_the_one_read_with_usage(counter, db):
+    reserve(counter)
+    # A downgrade heard of through the plan cache: the cached limit of 100 no longer applies
+    assert counter.reserve_local(USER, 1, caption_limit=5) is None
+    assert reserve(counter, 10, caption_limit=5) is None
+    assert reserve(counter, 4, caption_limit=5)["captions_generated"] == 5
+
+
+def test_stale_numbers_take_the_exact_path(counter, db, clock):
+    reserve(counter)
+    counter.reserve_local(USER, 1)
+    clock.now += 5
+    assert counter.reserve_local(USER, 1) is None
+    assert counter.known_total(USER) is None
+    assert reserve(counter)["captions_generated"] == 3
+
+
+def test_failed_flush_keeps_its_counts(counter, db):
+    reserve(counter)
+    counter.reserve_local(USER, 3)
+    db.failures = 1
+    with pytest.raises(RuntimeError):
+        counter.flush("interval")
+    assert counter.pending(USER) == 3
+    assert counter.known_total(USER) == 4
+    stats = counter.stats()
+    assert (stats["pending_captions"], stats["flush_errors"], stats["flushes"]) == (3, 1, 0)
+
+    counter.flush("interval")
+    assert db.total() == 4
+    assert counter.pending(USER) == 0
+    assert counter.stats()["pending_captions"] == 0
+
+
+def test_failed_flush_keeps_counts_added_while_it_ran(counter, db):
+    reserve(counter)
+    counter.reserve_local(USER, 3)
+    db.hold = threading.Event()
+    db.failures = 1
+    errors = []
+
+    def failing_flush():
+        try:
+            counter.flush("interval")
+        except RuntimeError as e:
+            errors.append(e)
+
+    flush = threading.Thread(target=failing_flush)
+    flush.start()
+    assert db.flushing.wait(2)
+    counter.reserve_local(USER, 2)
+    db.hold.set()
+    flush.join(5)
+    assert len(errors) == 1
+    assert counter.pending(USER) == 5
+    counter.flush("interval")
+    assert db.total() == 6
+
+
+def test_release_while_a_flush_is_in_flight(counter, db):
+    reserve(counter)
+    counter.reserve_local(USER, 3)
+    db.hold = threading.Event()
+    flush = threading.Thread(target=counter.flush, args=("interval",))
+    flush.start()
+    assert db.flushing.wait(2)
+
+    # Being written: still counted against the limit, but no longer releasable from memory
+    assert counter.known_total(USER) == 4
+    assert counter.release_local(USER, 3, period_start()) is None
+    # Reserved after the flush started: released from memory
+    counter.reserve_local(USER, 2)
+    assert counter.release_local(USER, 2, period_start()) == 4
+
+    released = {}
+    release = threading.Thread(target=lambda: released.update(total=counter.release_exact(USER, 3, period_start())))
+    release.start()
+    time.sleep(0.05)
+    # The exact release waits for the flush, so the captions it gives back are in the database first
+    assert release.is_alive()
+    assert ("release", 3) not in db.calls
+
+    db.hold.set()
+    flush.join(5)
+    release.join(5)
+    assert released["total"] == 1
+    assert db.total() == 1
+    assert db.calls[-1] == ("release", 3)
+    assert counter.known_total(USER) == 1
+
+
+def test_release_of_written_captions_goes_to_the_database(counter, db):
+    reserve(counter)
+    counter.reserve_local(USER, 4)
+    counter.flush("interval")
+    assert counter.release_local(USER, 2, period_start()) is None
+    assert counter.release_exact(USER, 2, period_start()) == 3
+    assert db.total() == 3
+
+
+def test_flusher_writes_early_once_max_pending_is_reached(db, clock):
+    counter = WriteBehindUsage(flush_interval=60, max_pending=3, batch_size=500, tolerance=TOLERANCE,
+                               sync_seconds=5)
+    counter.start()
+    try:
+        reserve(counter)
+        counter.reserve_local(USER, 3)
+        deadline = time.monotonic() + 2
+        while db.total() != 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        counter.close()
+
+
+def test_close_flushes_everything(counter, db):
+    counter.start()
+    reserve(counter)
+    counter.reserve_local(USER, 2)
+    counter.reserve_exact("user-2", 1)
+    counter.increment_local("user-2")
+    counter.close()
+    assert db.total() == 3
+    assert db.total("user-2") == 2
+    assert counter.stats()["pending_captions"] == 0
+
+
+def test_close_retries_a_failed_final_flush(counter, db, clock):
+    reserve(counter)
+    counter.reserve_local(USER, 2)
+    db.failures = 2
+    counter.close()
+    assert clock.sleeps == [1, 2]
+    assert db.total() == 3
+
+
+def test_close_reports_what_could_not_be_flushed(counter, db, clock, capsys):
+    reserve(counter)
+    counter.reserve_local(USER, 2)
+    db.failures = usage.SHUTDOWN_FLUSH_ATTEMPTS
+    counter.close()
+    assert len(clock.sleeps) == usage.SHUTDOWN_FLUSH_ATTEMPTS
+    assert f"{USER} {period_start():%Y-%m}': 2" in capsys.readouterr().out
+    assert counter.pending(USER) == 2
@@ -0,0 +1,392 @@
+"""
+Caption usage accounting for the auth service.
+
+With USAGE_ACCOUNTING=direct (the default) every reservation, release and
+decrement is one statement on the user's caption_usage row
+(repository.py). An account generating in bulk then has all of its requests
+queue on that one row lock.
+
+With USAGE_ACCOUNTING=write-behind each process counts captions per user and
+billing period in memory. A flusher thread adds the counts to caption_usage
+in batched multi-row upserts every USAGE_FLUSH_INTERVAL_SECONDS, or sooner
+once USAGE_FLUSH_MAX_PENDING captions are waiting. On shutdown whatever is
+left is flushed before the connection pool closes, so a graceful stop loses
+nothing; a crash loses the unflushed counts.
+
+Quota stays enforced. A reservation is granted from memory only when:
+
+- this process read the user's usage and limit in the last USAGE_SYNC_SECONDS,
+- the user has fewer than USAGE_QUOTA_TOLERANCE captions unflushed here, and
+- the new total stays at least USAGE_QUOTA_TOLERANCE below the limit.
+
+Anything else takes the exact path: the user's unflushed captions are
+written, then the atomic reserve_captions() query decides. That covers small
+plans, users near their limit, and the first reservation after the cached
+numbers expire. No process holds more than USAGE_QUOTA_TOLERANCE unflushed
+captions for a user, and each leaves that much headroom below the limit. So
+a user can only go over the limit when more than two auth processes serve
+them at once, and then by at most USAGE_QUOTA_TOLERANCE per extra process.
+Plan changes reach a process within USAGE_SYNC_SECONDS, or as soon as the
+plan cache (plan_cache.py) hears of them when it is on: the cached limit is
+then used instead of the one read with the usage.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import repository
+from db import run_db
+from plan_cache import active_plan, plan_cache
+from telemetry import timed_query, usage_flush_timings
+
+load_dotenv()
+
+USAGE_ACCOUNTING = os.getenv("USAGE_ACCOUNTING", "direct").lower()
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "1"))
+# Unflushed captions (all users) that trigger a flush before the interval is up
+USAGE_FLUSH_MAX_PENDING = int(os.getenv("USAGE_FLUSH_MAX_PENDING", "500"))
+# Rows per upsert statement
+USAGE_FLUSH_BATCH_SIZE = int(os.getenv("USAGE_FLUSH_BATCH_SIZE", "500"))
+# Most captions one process holds unflushed per user, and the headroom it keeps below the limit
+USAGE_QUOTA_TOLERANCE = int(os.getenv("USAGE_QUOTA_TOLERANCE", "10"))
+# How long a user's usage and limit read from the database are trusted
+USAGE_SYNC_SECONDS = float(os.getenv("USAGE_SYNC_SECONDS", "5"))
+
+USAGE_ACCOUNTING_MODES = ("direct", "write-behind")
+if USAGE_ACCOUNTING not in USAGE_ACCOUNTING_MODES:
+    raise ValueError(f"Unknown USAGE_ACCOUNTING: {USAGE_ACCOUNTING}")
+
+# Attempts at the final flush on shutdown
+SHUTDOWN_FLUSH_ATTEMPTS = 3
+
+
+class UsageEntry:
+    """One user's usage for one billing period, as this process knows it"""
+
+    __slots__ = ("period_end", "base", "limit", "synced_at", "pending", "in_flight", "last_generated_at")
+
+    def __init__(self, period_end: datetime):
+        self.period_end = period_end
+        # Total in the database when last read or written by this process
+        self.base = 0
+        self.limit = None
+        self.synced_at = 0.0
+        # Counted here, not yet written / being written by a flush
+        self.pending = 0
+        self.in_flight = 0
+        self.last_generated_at = None
+
+    def total(self) -> int:
+        return self.base + self.in_flight + self.pending
+
+
+class WriteBehindUsage:
+    """In-memory usage counters flushed to caption_usage in batches"""
+
+    def __init__(self, flush_interval: float, max_pending: int, batch_size: int, tolerance: int,
+                 sync_seconds: float):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        # One writer at a time, so totals returned by the database are applied in order
+        self._write_lock = threading.RLock()
+        self._entries = {}
+        self._pending_total = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            "local_reservations": 0,
+            "exact_reservations": 0,
+            "local_releases": 0,
+            "exact_releases": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "flushed_captions": 0,
+            "flush_errors": 0,
+        }
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write everything still pending"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        for attempt in range(1, SHUTDOWN_FLUSH_ATTEMPTS + 1):
+            try:
+                self.flush("shutdown")
+                return
+            except Exception as e:
+                print(f"Usage flush on shutdown failed (attempt {attempt}): {str(e)}")
+                time.sleep(attempt)
+        with self._lock:
+            lost = {f"{user_id} {period_start:%Y-%m}": entry.pending
+                    for (user_id, period_start), entry in self._entries.items() if entry.pending}
+        print(f"Unflushed caption usage lost on shutdown: {lost}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            if self._stop.is_set():
+                return
+            trigger = "size" if self._wake.is_set() else "interval"
+            self._wake.clear()
+            try:
+                self.flush(trigger)
+            except Exception as e:
+                print(f"Usage flush failed, retrying next interval: {str(e)}")
+            self._evict()
+
+    def _evict(self):
+        """Forget users with nothing pending whose numbers have expired anyway"""
+        expired = time.monotonic() - self.sync_seconds
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if not entry.pending and not entry.in_flight and entry.synced_at < expired]:
+                del self._entries[key]
+
+    def flush(self, trigger: str, keys: list = None) -> dict:
+        """Write pending counts (all of them, or only keys) and return the new totals"""
+        with self._write_lock:
+            with self._lock:
+                rows = []
+                for key in keys if keys is not None else list(self._entries):
+                    entry = self._entries.get(key)
+                    if entry is not None and entry.pending:
+                        entry.in_flight, entry.pending = entry.pending, 0
+                        rows.append((key[0], key[1], entry.period_end, entry.in_flight, entry.last_generated_at))
+                self._pending_total -= sum(row[3] for row in rows)
+            if not rows:
+                return {}
+
+            start = time.perf_counter()
+            try:
+                totals = timed_query(repository.add_caption_usage, rows, self.batch_size)
+            except Exception:
+                usage_flush_timings.observe(trigger, time.perf_counter() - start, error=True)
+                with self._lock:
+                    for user_id, period_start, _, count, _ in rows:
+                        entry = self._entries[(user_id, period_start)]
+                        entry.pending += entry.in_flight
+                        entry.in_flight = 0
+                        self._pending_total += count
+                    self._stats["flush_errors"] += 1
+                raise
+            usage_flush_timings.observe(trigger, time.perf_counter() - start)
+
+            synced = time.monotonic()
+            with self._lock:
+                for user_id, period_start, _, count, _ in rows:
+                    entry = self._entries[(user_id, period_start)]
+                    entry.base = totals.get((user_id, period_start), entry.base + count)
+                    entry.in_flight = 0
+                    entry.synced_at = synced
+                self._stats["flushes"] += 1
+                self._stats["flushed_rows"] += len(rows)
+                self._stats["flushed_captions"] += sum(row[3] for row in rows)
+            return totals
+
+    def _add_pending(self, entry: UsageEntry, count: int, now: datetime):
+        # Called with self._lock held
+        entry.pending += count
+        entry.last_generated_at = now
+        self._pending_total += count
+        if self._pending_total >= self.max_pending:
+            self._wake.set()
+
+    def _entry(self, user_id: str, period_start: datetime, period_end: datetime) -> UsageEntry:
+        # Called with self._lock held
+        entry = self._entries.get((user_id, period_start))
+        if entry is None:
+            entry = self._entries[(user_id, period_start)] = UsageEntry(period_end)
+        return entry
+
+    def _fresh(self, entry: Optional[UsageEntry]) -> bool:
+        return (entry is not None and entry.limit is not None
+                and time.monotonic() - entry.synced_at < self.sync_seconds)
+
+    def reserve_local(self, user_id: str, count: int, caption_limit: int = None) -> Optional[dict]:
+        """A reservation granted from memory, or None when the exact path must decide"""
+        now = datetime.utcnow()
+        period_start, _ = repository.current_period(now)
+        with self._lock:
+            entry = self._entries.get((user_id, period_start))
+            if not self._fresh(entry):
+                return None
+            limit = caption_limit if caption_limit is not None else entry.limit
+            total = entry.total() + count
+            if entry.pending + count > self.tolerance or total > limit - self.tolerance:
+                return None
+            self._add_pending(entry, count, now)
+            self._stats["local_reservations"] += 1
+            return {"captions_generated": total, "period_start": period_start, "caption_limit": limit}
+
+    def reserve_exact(self, user_id: str, count: int, caption_limit: int = None) -> Optional[dict]:
+        """Flush the user's pending captions, then reserve atomically in the database"""
+        period_start, period_end = repository.current_period(datetime.utcnow())
+        with self._write_lock:
+            self.flush("exact", [(user_id, period_start)])
+            reservation = repository.reserve_captions(user_id, count, caption_limit)
+            with self._lock:
+                self._stats["exact_reservations"] += 1
+                if reservation:
+                    entry = self._entry(user_id, reservation['period_start'], period_end)
+                    entry.base = reservation['captions_generated']
+                    entry.limit = reservation['caption_limit']
+                    entry.synced_at = time.monotonic()
+        return reservation
+
+    def release_local(self, user_id: str, count: int, period_start: datetime) -> Optional[int]:
+        """Take back captions that are still pending here; None when they were already written"""
+        with self._lock:
+            entry = self._entries.get((user_id, period_start))
+            if entry is None or entry.pending < count:
+                return None
+            entry.pending -= count
+            self._pending_total -= count
+            self._stats["local_releases"] += 1
+            return entry.total()
+
+    def release_exact(self, user_id: str, count: int, period_start: datetime) -> Optional[int]:
+        with self._write_lock:
+            self.flush("exact", [(user_id, period_start)])
+            captions_generated = repository.release_captions(user_id, count, period_start)
+            with self._lock:
+                self._stats["exact_releases"] += 1
+                entry = self._entries.get((user_id, period_start))
+                if entry is not None and captions_generated is not None:
+                    entry.base = captions_generated
+        return captions_generated
+
+    def increment_local(self, user_id: str) -> Optional[int]:
+        """Count one caption without a limit check (/caption/decrement); None if usage is unknown here"""
+        now = datetime.utcnow()
+        period_start, _ = repository.current_period(now)
+        with self._lock:
+            entry = self._entries.get((user_id, period_start))
+            if not self._fresh(entry):
+                return None
+            self._add_pending(entry, 1, now)
+            return entry.total()
+
+    def increment_exact(self, user_id: str) -> int:
+        now = datetime.utcnow()
+        period_start, period_end = repository.current_period(now)
+        with self._write_lock:
+            with self._lock:
+                self._add_pending(self._entry(user_id, period_start, period_end), 1, now)
+            return self.flush("exact", [(user_id, period_start)])[(user_id, period_start)]
+
+    def known_total(self, user_id: str) -> Optional[int]:
+        """The user's current-period total if this process read it recently, unflushed captions included"""
+        period_start, _ = repository.current_period(datetime.utcnow())
+        with self._lock:
+            entry = self._entries.get((user_id, period_start))
+            return entry.total() if self._fresh(entry) else None
+
+    def pending(self, user_id: str) -> int:
+        """Captions counted here for the user's current period and not yet written"""
+        period_start, _ = repository.current_period(datetime.utcnow())
+        with self._lock:
+            entry = self._entries.get((user_id, period_start))
+            return entry.pending if entry is not None else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                pending_captions=self._pending_total,
+                pending_users=sum(1 for entry in self._entries.values() if entry.pending),
+                tracked_users=len(self._entries),
+            )
+        stats.update(
+            flush_interval_seconds=self.flush_interval,
+            flush_max_pending=self.max_pending,
+            quota_tolerance=self.tolerance,
+            sync_seconds=self.sync_seconds,
+        )
+        return stats
+
+
+usage_counter = WriteBehindUsage(
+    USAGE_FLUSH_INTERVAL_SECONDS,
+    USAGE_FLUSH_MAX_PENDING,
+    USAGE_FLUSH_BATCH_SIZE,
+    USAGE_QUOTA_TOLERANCE,
+    USAGE_SYNC_SECONDS,
+) if USAGE_ACCOUNTING == "write-behind" else None
+
+
+async def reserve_captions(user_id: str, count: int) -> Optional[dict]:
+    """Check the limit and count ``count`` captions; None when nothing was reserved"""
+    caption_limit = None
+    if plan_cache is not None:
+        plan = await active_plan(user_id)
+        if plan is None:
+            return None
+        caption_limit = plan['caption_limit']
+    if usage_counter is None:
+        return await run_db(repository.reserve_captions, user_id, count, caption_limit)
+    reservation = usage_counter.reserve_local(user_id, count, caption_limit)
+    if reservation is None:
+        reservation = await run_db(usage_counter.reserve_exact, user_id, count, caption_limit)
+    return reservation
+
+
+async def release_captions(user_id: str, count: int, period_start: datetime) -> Optional[int]:
+    """Give back reserved captions; the new total, or None when there is no usage for the period"""
+    if usage_counter is None:
+        return await run_db(repository.release_captions, user_id, count, period_start)
+    captions_generated = usage_counter.release_local(user_id, count, period_start)
+    if captions_generated is None:
+        captions_generated = await run_db(usage_counter.release_exact, user_id, count, period_start)
+    return captions_generated
+
+
+async def increment_captions(user_id: str) -> int:
+    """Count one caption without a limit check; the new total"""
+    if usage_counter is None:
+        return await run_db(repository.increment_caption_usage, user_id)
+    captions_generated = usage_counter.increment_local(user_id)
+    if captions_generated is None:
+        captions_generated = await run_db(usage_counter.increment_exact, user_id)
+    return captions_generated
+
+
+async def subscription_usage(user_id: str) -> Optional[dict]:
+    """Plan name, status and caption limit of the active subscription with this period's usage, or None"""
+    if plan_cache is None:
+        subscription = await run_db(repository.get_active_subscription_usage, user_id)
+        if subscription:
+            subscription['captions_generated'] += unflushed_captions(user_id)
+        return subscription
+    plan = await active_plan(user_id)
+    if plan is None:
+        return None
+    captions_generated = usage_counter.known_total(user_id) if usage_counter is not None else None
+    if captions_generated is None:
+        captions_generated = await run_db(repository.get_period_usage, user_id) + unflushed_captions(user_id)
+    return {**plan, "captions_generated": captions_generated}
+
+
+def unflushed_captions(user_id: str) -> int:
+    """Captions this process has counted for the user that the database does not show yet"""
+    return usage_counter.pending(user_id) if usage_counter is not None else 0
+
+
+def usage_stats() -> dict:
+    stats = usage_counter.stats() if usage_counter is not None else {}
+    return {"mode": USAGE_ACCOUNTING, **stats}